@@ -0,0 +1,81 @@
+import React, { useState, useEffect } from 'react';
+import { fetchAdTargeting, updateAdTargeting } from '../services/ads';
+
+// 每行一条规则：精确域名（a.example.com）或通配（*.example.com，含 example.com 本身）
+const toLines = (list) => (list || []).join('\n');
+const fromLines = (text) => text.split('\n').map(s => s.trim()).filter(Boolean);
+
+export default function TargetingDialog({ open, ad, onClose }) {
+  const [include, setInclude] = useState('');
+  const [exclude, setExclude] = useState('');
+  const [saving, setSaving] = useState(false);
+  const [error, setError] = useState('');
+
+  useEffect(() => {
+    if (!open || !ad) return;
+    setError('');
+    fetchAdTargeting(ad.id).then(rules => {
+      setInclude(toLines(rules.include));
+      setExclude(toLines(rules.exclude));
+    }).catch(e => setError(e.response?.data?.detail || '加载定向规则失败'));
+  }, [open, ad]);
+
+  const handleSave = async () => {
+    setSaving(true);
+    setError('');
+    try {
+      await updateAdTargeting(ad.id, { include: fromLines(include), exclude: fromLines(exclude) });
+      onClose();
+    } catch (e) {
+      setError(e.response?.data?.detail || '保存定向规则失败');
+    } finally {
+      setSaving(false);
+    }
+  };
+
+  if (!open) return null;
+
+  const textareaClass = "w-full h-28 px-4 py-3 rounded-lg border border-gray-300 dark:border-zinc-600 bg-white dark:bg-zinc-800 text-gray-900 dark:text-white placeholder-gray-500 dark:placeholder-gray-400 focus:ring-2 focus:ring-blue-500 focus:border-transparent transition-all font-mono text-sm";
+
+  return (
+    <div className="fixed inset-0 z-50 flex items-center justify-center backdrop-blur-sm">
+      <div className="absolute inset-0 bg-black/50 transition-opacity" onClick={onClose} />
+      <div className="relative z-10 w-full max-w-lg mx-4 p-6 rounded-xl bg-white dark:bg-zinc-900 text-gray-900 dark:text-gray-100 border border-gray-200 dark:border-zinc-700 shadow-2xl transform transition-all">
+        <div className="flex items-center justify-between mb-6">
+          <h3 className="text-xl font-bold text-gray-900 dark:text-white">域名定向（广告 #{ad?.id}）</h3>
+          <button onClick={onClose} className="p-2 rounded-lg hover:bg-gray-100 dark:hover:bg-zinc-800 transition-colors">
+            <svg className="w-5 h-5" fill="none" stroke="currentColor" viewBox="0 0 24 24">
+              <path strokeLinecap="round" strokeLinejoin="round" strokeWidth={2} d="M6 18L18 6M6 6l12 12" />
+            </svg>
+          </button>
+        </div>
+        <div className="space-y-5">
+          <div className="space-y-2">
+            <label className="text-sm font-medium text-gray-700 dark:text-gray-300">仅在以下域名投放（留空表示所有域名）</label>
+            <textarea value={include} onChange={e => setInclude(e.target.value)} className={textareaClass} placeholder={'example.com\n*.example.org'} />
+          </div>
+          <div className="space-y-2">
+            <label className="text-sm font-medium text-gray-700 dark:text-gray-300">不在以下域名投放</label>
+            <textarea value={exclude} onChange={e => setExclude(e.target.value)} className={textareaClass} placeholder="*.example.net" />
+          </div>
+          {error && <div className="text-sm text-red-600 dark:text-red-400">{error}</div>}
+        </div>
+        <div className="flex justify-end gap-3 mt-8 pt-6 border-t border-gray-200 dark:border-zinc-700">
+          <button
+            className="px-6 py-2.5 rounded-lg border border-gray-300 dark:border-zinc-600 text-gray-700 dark:text-gray-300 hover:bg-gray-50 dark:hover:bg-zinc-800 transition-colors font-medium"
+            onClick={onClose}
+          >
+            取消
+          </button>
+          <button
+            className="px-6 py-2.5 rounded-lg bg-gradient-to-r from-blue-600 to-blue-700 hover:from-blue-700 hover:to-blue-800 text-white font-medium shadow-lg hover:shadow-xl transition-all transform hover:scale-105 disabled:opacity-50"
+            onClick={handleSave}
+            disabled={saving}
+          >
+            {saving ? '保存中...' : '确定'}
+          </button>
+        </div>
+      </div>
+    </div>
+  );
+}
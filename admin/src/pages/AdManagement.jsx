@@ -1,9 +1,10 @@
-import React, { useEffect, useState, useMemo } from 'react';
+import React, { useEffect, useState, useMemo, useRef } from 'react';
 import PageHeader from '../components/PageHeader';
 import DataTablePro from '../components/DataTablePro';
-import { fetchAds, deleteAd, uploadAd, updateAd, updateAdStatus, updateAdXRedirect, fetchAdSettings, updateAdSettings } from '../services/ads';
+import { fetchAds, deleteAd, uploadAd, importAds, updateAd, updateAdStatus, updateAdXRedirect, fetchAdSettings, updateAdSettings } from '../services/ads';
 import Icon from '../components/Icon';
 import AdFormDialog from '../components/AdFormDialog';
+import TargetingDialog from '../components/TargetingDialog';
 import dayjs from 'dayjs';
 
 export default function AdManagement() {
@@ -29,6 +30,9 @@ export default function AdManagement() {
     status: 'all',
   });
   const [sorting, setSorting] = useState([]);
+  const [importing, setImporting] = useState(false);
+  const [targetingAd, setTargetingAd] = useState(null);
+  const importInputRef = useRef(null);
 
   const loadAds = () => {
     setLoading(true);
@@ -156,6 +160,27 @@ export default function AdManagement() {
     }
   };
 
+  // 批量导入：完成后提示成功/失败数量及失败原因
+  const handleImport = async (e) => {
+    const file = e.target.files && e.target.files[0];
+    e.target.value = '';
+    if (!file) return;
+    setImporting(true);
+    try {
+      const result = await importAds(file);
+      const failures = result.items
+        .filter(item => item.error)
+        .map(item => `第 ${item.row} 行 ${item.file || ''}: ${item.error}`);
+      window.alert([`导入成功 ${result.created} 条，失败 ${result.failed} 条`, ...failures].join('\n'));
+      loadAds();
+    } catch (error) {
+      console.error('批量导入失败:', error);
+      window.alert(`批量导入失败：${error.response?.data?.detail || error.message}`);
+    } finally {
+      setImporting(false);
+    }
+  };
+
   const handleDeleteAd = async (adId) => {
     if (window.confirm('确定要删除这个广告吗？')) {
       try {
@@ -299,6 +324,31 @@ export default function AdManagement() {
         </span>
       )
     },
+    {
+      key: 'impressions',
+      title: '展示',
+      dataIndex: 'impressions',
+      width: 70,
+      sortable: true,
+      render: (value) => (value ?? 0).toLocaleString()
+    },
+    {
+      key: 'clicks',
+      title: '点击',
+      dataIndex: 'clicks',
+      width: 70,
+      sortable: true,
+      render: (value) => (value ?? 0).toLocaleString()
+    },
+    {
+      key: 'ctr',
+      title: 'CTR',
+      dataIndex: 'ctr',
+      width: 70,
+      sortable: true,
+      sortingFn: (rowA, rowB) => (rowA.original.ctr ?? -1) - (rowB.original.ctr ?? -1),
+      render: (ctr) => (ctr == null ? '-' : `${(ctr * 100).toFixed(2)}%`)
+    },
     { 
       key: 'x_redirect_enabled', 
       title: 'X号跳转', 
@@ -336,7 +386,7 @@ export default function AdManagement() {
     {
       key: 'actions',
       title: '操作',
-      width: 200,
+      width: 260,
       sortable: false,
       render: (text, record) => (
         <div className="flex gap-2">
@@ -346,6 +396,12 @@ export default function AdManagement() {
           >
             编辑
           </button>
+          <button 
+            onClick={() => setTargetingAd(record)} 
+            className="px-3 py-1.5 rounded-lg bg-purple-50 dark:bg-purple-900/30 hover:bg-purple-100 dark:hover:bg-purple-900/50 text-purple-600 dark:text-purple-300 hover:text-purple-700 dark:hover:text-purple-200 border border-purple-200 dark:border-purple-700 hover:border-purple-300 dark:hover:border-purple-600 transition-all duration-200 text-sm font-medium"
+          >
+            定向
+          </button>
           <button 
             onClick={() => handleDeleteAd(record.id)} 
             className="px-3 py-1.5 rounded-lg bg-red-50 dark:bg-red-900/30 hover:bg-red-100 dark:hover:bg-red-900/50 text-red-600 dark:text-red-300 hover:text-red-700 dark:hover:text-red-200 border border-red-200 dark:border-red-700 hover:border-red-300 dark:hover:border-red-600 transition-all duration-200 text-sm font-medium"
@@ -370,13 +426,25 @@ export default function AdManagement() {
   return (
     <div>
       <PageHeader title="广告管理" extra={
-        <button 
-          onClick={() => handleOpenDialog()} 
-          className="px-6 py-2.5 rounded-lg bg-gradient-to-r from-blue-600 to-blue-700 hover:from-blue-700 hover:to-blue-800 dark:from-blue-500 dark:to-blue-600 dark:hover:from-blue-600 dark:hover:to-blue-700 text-white inline-flex items-center gap-2 font-medium shadow-lg hover:shadow-xl transition-all transform hover:scale-105"
-        >
-          <Icon name="plus" className="w-5 h-5" />
-          <span>新增广告</span>
-        </button>
+        <div className="flex items-center gap-3">
+          <input ref={importInputRef} type="file" accept=".zip" className="hidden" onChange={handleImport} />
+          <button 
+            onClick={() => importInputRef.current && importInputRef.current.click()} 
+            disabled={importing}
+            title="zip 内含图片与 manifest.csv（file,link,is_main,x_redirect_enabled）"
+            className="px-6 py-2.5 rounded-lg border border-gray-300 dark:border-zinc-600 bg-white dark:bg-zinc-800 hover:bg-gray-50 dark:hover:bg-zinc-700 text-gray-700 dark:text-gray-200 inline-flex items-center gap-2 font-medium shadow-sm transition-all disabled:opacity-50"
+          >
+            <Icon name="zip" className="w-5 h-5" />
+            <span>{importing ? '导入中...' : '批量导入'}</span>
+          </button>
+          <button 
+            onClick={() => handleOpenDialog()} 
+            className="px-6 py-2.5 rounded-lg bg-gradient-to-r from-blue-600 to-blue-700 hover:from-blue-700 hover:to-blue-800 dark:from-blue-500 dark:to-blue-600 dark:hover:from-blue-600 dark:hover:to-blue-700 text-white inline-flex items-center gap-2 font-medium shadow-lg hover:shadow-xl transition-all transform hover:scale-105"
+          >
+            <Icon name="plus" className="w-5 h-5" />
+            <span>新增广告</span>
+          </button>
+        </div>
       } />
       <div className="p-6 mb-6 bg-white dark:bg-zinc-900 border border-gray-200 dark:border-zinc-800 rounded-xl shadow-sm">
         <div className="flex flex-wrap items-center gap-6">
@@ -510,6 +578,11 @@ export default function AdManagement() {
         onCancel={handleCloseDialog}
         ad={editingAd}
       />
+      <TargetingDialog
+        open={!!targetingAd}
+        ad={targetingAd}
+        onClose={() => setTargetingAd(null)}
+      />
       
       {/* 图片放大模态框 */}
       {imageModalOpen && (
@@ -2,7 +2,7 @@ import React, { useState, useEffect } from 'react'
 import PageHeader from '../components/PageHeader'
 import DataTablePro from '../components/DataTablePro'
 import Loading from '../components/Loading'
-import { getClicksByDomainIp } from '../services/stats'
+import { getClicksByDomainIp, getAdCtr } from '../services/stats'
 import dayjs from 'dayjs';
 
 export default function Stats() {
@@ -13,6 +13,8 @@ export default function Stats() {
       end: dayjs().format('YYYY-MM-DD'),
     type: 'main'
   })
+  const [ctrData, setCtrData] = useState([])
+  const [ctrLoading, setCtrLoading] = useState(false)
   const [pagination, setPagination] = useState({
     current: 1,
     pageSize: 10,
@@ -41,6 +43,20 @@ export default function Stats() {
     }
   }
 
+  // 加载各广告 CTR（所选日期区间）
+  const loadCtr = async () => {
+    try {
+      setCtrLoading(true)
+      const result = await getAdCtr({ start: filters.start, end: filters.end })
+      setCtrData(result.data || [])
+    } catch (error) {
+      console.error('加载CTR数据失败:', error)
+      setCtrData([])
+    } finally {
+      setCtrLoading(false)
+    }
+  }
+
   // 处理筛选条件变化
   const handleFilterChange = (key, value) => {
     setFilters(prev => ({
@@ -52,11 +68,13 @@ export default function Stats() {
   // 处理查询
   const handleQuery = () => {
     loadData(1, pagination.pageSize)
+    loadCtr()
   }
 
   // 初始加载
   useEffect(() => {
     loadData(1, 10)
+    loadCtr()
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [])
 
@@ -65,6 +83,36 @@ export default function Stats() {
     loadData(page, pageSize);
   }
 
+  // CTR 表格列定义
+  const ctrColumns = [
+    { key: 'ad_id', title: '广告ID', dataIndex: 'ad_id', width: 80 },
+    {
+      key: 'is_main',
+      title: '类型',
+      dataIndex: 'is_main',
+      width: 80,
+      render: (isMain) => (isMain ? '主广告' : '次广告')
+    },
+    {
+      key: 'link',
+      title: '链接',
+      dataIndex: 'link',
+      width: 260,
+      render: (link) => (
+        <span className="block truncate" title={link}>{link}</span>
+      )
+    },
+    { key: 'impressions', title: '展示', dataIndex: 'impressions', width: 100, render: (v) => (v ?? 0).toLocaleString() },
+    { key: 'clicks', title: '点击', dataIndex: 'clicks', width: 100, render: (v) => (v ?? 0).toLocaleString() },
+    {
+      key: 'ctr',
+      title: 'CTR',
+      dataIndex: 'ctr',
+      width: 100,
+      render: (ctr) => (ctr == null ? '-' : `${(ctr * 100).toFixed(2)}%`)
+    },
+  ]
+
   // 表格列定义
   const columns = [
     {
@@ -206,6 +254,25 @@ export default function Stats() {
         )}
       </div>
 
+      {/* 各广告 CTR */}
+      <div className="bg-white dark:bg-zinc-800 rounded-lg shadow-sm border border-gray-200 dark:border-zinc-700">
+        <h3 className="px-6 pt-6 text-lg font-semibold text-gray-900 dark:text-white">
+          广告点击率（CTR）
+        </h3>
+        {ctrLoading ? (
+          <div className="p-8">
+            <Loading />
+          </div>
+        ) : (
+          <DataTablePro
+            columns={ctrColumns}
+            data={ctrData}
+            rowKey="ad_id"
+            emptyText="暂无展示数据"
+          />
+        )}
+      </div>
+
       {/* 统计信息 */}
       {!loading && data.length > 0 && (
         <div className="bg-white dark:bg-zinc-800 rounded-lg shadow-sm border border-gray-200 dark:border-zinc-700 p-6">
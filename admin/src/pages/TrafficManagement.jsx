@@ -2,7 +2,7 @@ import React, { useEffect, useState } from 'react';
 import PageHeader from '../components/PageHeader';
 import Icon from '../components/Icon';
 import EChart from '../components/EChart';
-import { fetchStatsOverview, fetchDailyStats } from '../services/traffic';
+import { fetchDashboard, fetchTimeseries } from '../services/traffic';
 import dayjs from 'dayjs';
 
 // 将流量数据转换为 ECharts 需要的格式
@@ -24,6 +24,32 @@ const toChartOption = (dailyData, key, name) => {
   };
 };
 
+// 分时趋势：访问量与主 / 次广告点击量画在同一张图上
+const toTimeseriesOption = (series) => {
+  if (!series || !Array.isArray(series)) return null;
+  return {
+    tooltip: { trigger: 'axis' },
+    legend: { data: ['访问量', '主广告点击量', '次广告点击量'] },
+    xAxis: {
+      type: 'category',
+      data: series.map(d => d.time),
+    },
+    yAxis: { type: 'value' },
+    series: [
+      { name: '访问量', type: 'line', data: series.map(d => d.page_views) },
+      { name: '主广告点击量', type: 'line', data: series.map(d => d.main_clicks) },
+      { name: '次广告点击量', type: 'line', data: series.map(d => d.secondary_clicks) },
+    ],
+    grid: { left: 50, right: 20, top: 40, bottom: 30 }
+  };
+};
+
+const BUCKETS = [
+  { value: 'hour', label: '按小时' },
+  { value: 'day', label: '按天' },
+  { value: 'week', label: '按周' },
+];
+
 export default function TrafficManagement() {
   const [overviewData, setOverviewData] = useState({});
   const [dailyData, setDailyData] = useState([]);
@@ -32,17 +58,20 @@ export default function TrafficManagement() {
     start: dayjs().format('YYYY-MM-DD'),
     end: dayjs().format('YYYY-MM-DD'),
   });
+  const [bucket, setBucket] = useState('hour');
+  const [timeseries, setTimeseries] = useState([]);
+  const [timeseriesError, setTimeseriesError] = useState('');
 
   const loadTrafficData = async () => {
     setLoading(true);
-    const overview = await fetchStatsOverview();
-    setOverviewData(overview);
-
-    const daily = await fetchDailyStats({
+    // 概览与日统计由后端并发查询，一次返回
+    const dashboard = await fetchDashboard({
       start: dateRange.start,
       end: dateRange.end,
+      include: 'overview,daily',
     });
-    setDailyData(daily);
+    setOverviewData(dashboard.overview);
+    setDailyData(dashboard.daily);
     setLoading(false);
   };
 
@@ -78,12 +107,28 @@ export default function TrafficManagement() {
     }
   };
 
+  const loadTimeseries = async () => {
+    setTimeseriesError('');
+    try {
+      const result = await fetchTimeseries({ start: dateRange.start, end: dateRange.end, bucket });
+      setTimeseries(result.data);
+    } catch (e) {
+      // 小时数据只保留最近一段时间，超出时由后端返回原因
+      setTimeseries([]);
+      setTimeseriesError(e.response?.data?.detail || '加载分时数据失败');
+    }
+  };
+
   const kpiData = calculateKpiData();
 
   useEffect(() => {
     loadTrafficData();
   }, [dateRange]);
 
+  useEffect(() => {
+    loadTimeseries();
+  }, [dateRange, bucket]);
+
   const kpis = [
     { key: 'total_views', label: '网站总访问量', icon: 'globe' },
     { key: 'total_clicks', label: '总广告访问量', icon: 'list' },
@@ -161,6 +206,38 @@ export default function TrafficManagement() {
 
       {/* 图表区 */}
        <div className="grid grid-cols-1 gap-6">
+         <div className="p-6 rounded-2xl border border-gray-100 dark:border-zinc-700 bg-white dark:bg-zinc-900 shadow-sm hover:shadow-md transition-all duration-200">
+           <div className="flex items-center justify-between mb-6">
+             <div className="flex items-center gap-3">
+               <div className="p-3 rounded-xl bg-amber-50 text-amber-500 dark:bg-amber-950 dark:text-amber-400">
+                 <Icon name="gauge" className="w-6 h-6" />
+               </div>
+               <h3 className="text-xl font-bold text-gray-900 dark:text-white">分时趋势</h3>
+             </div>
+             <div className="flex gap-2">
+               {BUCKETS.map(b => (
+                 <button
+                   key={b.value}
+                   className={`px-3 py-1.5 rounded-lg text-sm font-medium transition-colors ${
+                     bucket === b.value
+                       ? 'bg-blue-600 text-white'
+                       : 'bg-gray-100 text-gray-700 hover:bg-gray-200 dark:bg-zinc-800 dark:text-gray-300 dark:hover:bg-zinc-700'
+                   }`}
+                   onClick={() => setBucket(b.value)}
+                 >
+                   {b.label}
+                 </button>
+               ))}
+             </div>
+           </div>
+           <div className="bg-gray-50 dark:bg-zinc-800 rounded-xl p-5">
+             {timeseriesError ? (
+               <div className="h-[350px] flex items-center justify-center text-sm text-gray-500 dark:text-gray-400">{timeseriesError}</div>
+             ) : (
+               <EChart option={toTimeseriesOption(timeseries)} style={{ height: 350 }} />
+             )}
+           </div>
+         </div>
          <div className="p-6 rounded-2xl border border-gray-100 dark:border-zinc-700 bg-white dark:bg-zinc-900 shadow-sm hover:shadow-md transition-all duration-200">
            <div className="flex items-center gap-3 mb-6">
              <div className="p-3 rounded-xl bg-blue-50 text-blue-500 dark:bg-blue-950 dark:text-blue-400">
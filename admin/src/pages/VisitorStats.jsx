@@ -2,7 +2,7 @@ import React, { useState, useEffect } from 'react'
 import PageHeader from '../components/PageHeader'
 import DataTablePro from '../components/DataTablePro'
 import Loading from '../components/Loading'
-import { getVisitorsByDomainIp } from '../services/stats'
+import { getVisitorsByDomainIp, getTopDomainsIps } from '../services/stats'
 import dayjs from 'dayjs';
 
 /**
@@ -22,6 +22,7 @@ export default function VisitorStats() {
     start: dayjs().subtract(30, 'days').format('YYYY-MM-DD'),
     end: dayjs().format('YYYY-MM-DD')
   })
+  const [top, setTop] = useState({ domains: [], ips: [] })
   const [pagination, setPagination] = useState({
     current: 1,
     pageSize: 10,
@@ -70,16 +71,31 @@ export default function VisitorStats() {
     }))
   }
 
+  /**
+   * 加载热门域名与 IP（前 10）
+   */
+  const loadTop = async () => {
+    try {
+      const result = await getTopDomainsIps({ start: filters.start, end: filters.end, metric: 'views', k: 10 })
+      setTop({ domains: result.domains || [], ips: result.ips || [] })
+    } catch (error) {
+      console.error('加载热门域名/IP失败:', error)
+      setTop({ domains: [], ips: [] })
+    }
+  }
+
   /**
    * 处理查询操作
    */
   const handleQuery = () => {
     loadData(1, pagination.pageSize)
+    loadTop()
   }
 
   // 初始加载数据
   useEffect(() => {
     loadData(1, 10)
+    loadTop()
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [])
 
@@ -210,6 +226,31 @@ export default function VisitorStats() {
         )}
       </div>
 
+      {/* 热门域名 / IP */}
+      {(top.domains.length > 0 || top.ips.length > 0) && (
+        <div className="grid grid-cols-1 md:grid-cols-2 gap-4">
+          {[['domains', '热门域名'], ['ips', '热门 IP']].map(([field, title]) => (
+            <div key={field} className="bg-white dark:bg-zinc-800 rounded-lg shadow-sm border border-gray-200 dark:border-zinc-700 p-6">
+              <h3 className="text-lg font-semibold text-gray-900 dark:text-white mb-4">
+                {title}（访问量前 10）
+              </h3>
+              <ol className="space-y-2">
+                {top[field].map((item, index) => (
+                  <li key={item.key} className="flex items-center justify-between text-sm">
+                    <span className="text-gray-700 dark:text-gray-300 truncate" title={item.key}>
+                      {index + 1}. {item.key}
+                    </span>
+                    <span className="font-medium text-gray-900 dark:text-white" title={item.error ? `误差不超过 ${item.error}` : undefined}>
+                      {item.error ? '≈' : ''}{item.count.toLocaleString()}
+                    </span>
+                  </li>
+                ))}
+              </ol>
+            </div>
+          ))}
+        </div>
+      )}
+
       {/* 统计信息 */}
       {!loading && pagination.total > 0 && (
         <div className="bg-white dark:bg-zinc-800 rounded-lg shadow-sm border border-gray-200 dark:border-zinc-700 p-6">
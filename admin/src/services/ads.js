@@ -16,6 +16,18 @@ export async function uploadAd(formData) {
   return response.data;
 }
 
+// 批量导入广告（zip：图片 + manifest.csv / manifest.json）
+export async function importAds(file) {
+  const formData = new FormData();
+  formData.append('file', file);
+  const response = await http.post('/ads/import', formData, {
+    headers: {
+      'Content-Type': 'multipart/form-data',
+    },
+  });
+  return response.data; // { created, failed, items: [{ row, file, id, error }] }
+}
+
 // 编辑广告
 export async function updateAd(adId, formData) {
   const response = await http.put(`/ads/${adId}`, formData, {
@@ -38,6 +50,18 @@ export async function updateAdXRedirect(adId, enabled) {
   return response.data;
 }
 
+// 获取广告域名定向规则：{ include: [...], exclude: [...] }
+export async function fetchAdTargeting(adId) {
+  const response = await http.get(`/ads/${adId}/targeting`);
+  return response.data;
+}
+
+// 整体替换广告域名定向规则
+export async function updateAdTargeting(adId, rules) {
+  const response = await http.put(`/ads/${adId}/targeting`, rules);
+  return response.data;
+}
+
 // 删除广告
 export async function deleteAd(adId) {
   const response = await http.delete(`/ads/${adId}`);
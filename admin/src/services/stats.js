@@ -74,4 +74,44 @@ export const getDailyStats = async (params) => {
     }
   })
   return response.data
-}
\ No newline at end of file
+}
+
+/**
+ * 获取各广告的展示、点击与 CTR（按 CTR 降序）
+ * @param {Object} params - 查询参数；不传日期时为累计值
+ * @param {string} [params.start] - 开始日期 (YYYY-MM-DD)
+ * @param {string} [params.end] - 结束日期 (YYYY-MM-DD)
+ * @returns {Promise<Object>} { data: [{ ad_id, img_url, link, is_main, status, impressions, clicks, ctr }] }
+ */
+export const getAdCtr = async (params = {}) => {
+  const { start, end } = params
+  const response = await http.get('/stats/ctr', {
+    params: {
+      start,
+      end
+    }
+  })
+  return response.data
+}
+
+/**
+ * 获取区间内访问量或点击量前 K 的域名与 IP（服务端流式摘要，计数为估计值）
+ * @param {Object} params - 查询参数
+ * @param {string} params.start - 开始日期 (YYYY-MM-DD)
+ * @param {string} params.end - 结束日期 (YYYY-MM-DD)
+ * @param {string} params.metric - 'views' | 'clicks'
+ * @param {number} params.k - 返回条数
+ * @returns {Promise<Object>} { domains: [{ key, count, error }], ips: [...] }
+ */
+export const getTopDomainsIps = async (params) => {
+  const { start, end, metric = 'views', k = 10 } = params
+  const response = await http.get('/stats/top', {
+    params: {
+      start,
+      end,
+      metric,
+      k
+    }
+  })
+  return response.data
+}
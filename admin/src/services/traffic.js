@@ -11,3 +11,16 @@ export async function fetchDailyStats(params) {
   const response = await http.get('/stats/daily', { params });
   return response.data;
 }
+
+
+// 获取统计面板（概览 + 日统计等，一次请求并发查询）
+export async function fetchDashboard(params) {
+  const response = await http.get('/stats/dashboard', { params });
+  return response.data;
+}
+
+// 获取按小时 / 天 / 周分桶的访问量与点击量（bucket: 'hour' | 'day' | 'week'）
+export async function fetchTimeseries(params) {
+  const response = await http.get('/stats/timeseries', { params });
+  return response.data;
+}
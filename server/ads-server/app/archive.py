@@ -0,0 +1,379 @@
+"""
+统计数据列式归档与查询
+
+每晚由 archive_job.py 把已结束的日期从 MySQL 导出为按天的 NumPy 列文件，长区间的统计查询
+直接在内存映射的数组上做向量化聚合，不再扫描 MySQL 明细表。
+
+目录结构（ARCHIVE_DIR，默认 data/archive）：
+- archive.json：{format, first_day, last_day}，first_day ~ last_day 之间的每一天都已归档（无数据的日期也有清单）
+- days/<YYYY-MM-DD>/dict_{domain,ip}_{data,offsets,hash}.npy：当日的域名 / IP 字典（下标即编码）：
+  UTF-8 拼接的字节、每项的起止偏移量、每项的 64 位哈希（用于跨天去重计数），与列文件一样按需内存映射。
+  字典按天独立，导出和查询的开销只与涉及的日期有关，不随归档总量增长
+- days/<YYYY-MM-DD>/manifest.json：当日汇总（page_views / clicks / main_clicks / secondary_clicks / visits）与行数
+- days/<YYYY-MM-DD>/visitors_{domain,ip,visits}.npy：访客明细，按 visits 降序
+- days/<YYYY-MM-DD>/clicks_{domain,ip,clicks}.npy：按 (广告类型, 域名, IP) 汇总的点击，
+  前 secondary_rows 行为次广告、其后 main_rows 行为主广告，各段按 clicks 降序
+
+广告类型在导出时按 ads 表确定（与在线查询一样只统计仍存在的广告）。
+"""
+
+import os
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+
+import numpy as np
+import orjson
+
+from . import db
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', os.path.join(BASE_DIR, 'data', 'archive'))
+# 只归档早于「今天 - ARCHIVE_LAG_DAYS + 1」的日期，给迟到事件（溢出队列补写、journal 消费延迟）留出时间
+ARCHIVE_LAG_DAYS = int(os.environ.get('ARCHIVE_LAG_DAYS', 2))
+# 查询时同时保持映射的数组文件数
+ARCHIVE_OPEN_ARRAYS = 256
+# 归档格式版本：与 archive.json 中的 format 不一致时（例如旧版的全局 JSON 字典）整体重新导出
+ARCHIVE_FORMAT = 2
+# 跨天去重计数时，累积多少个哈希后合并一次
+_UNIQUE_MERGE_SIZE = 4_000_000
+
+_VISITOR_COLUMNS = ('domain', 'ip', 'visits')
+_CLICK_COLUMNS = ('domain', 'ip', 'clicks')
+
+
+def _day_range(start: str, end: str):
+    d, last = date.fromisoformat(start), date.fromisoformat(end)
+    while d <= last:
+        yield d.isoformat()
+        d += timedelta(days=1)
+
+
+def _next_day(day: str) -> str:
+    return (date.fromisoformat(day) + timedelta(days=1)).isoformat()
+
+
+def _write_json(path: str, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(orjson.dumps(data))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str):
+    with open(path, 'rb') as f:
+        return orjson.loads(f.read())
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _hash_array(values) -> np.ndarray:
+    return np.array([_hash64(v) for v in values], dtype=np.uint64)
+
+
+class Dictionary:
+    """单日的字符串 <-> int32 编码字典"""
+
+    def __init__(self):
+        self.values = []
+        self.index = {}
+
+    def encode(self, values) -> np.ndarray:
+        index = self.index
+        codes = np.empty(len(values), dtype=np.int32)
+        for i, v in enumerate(values):
+            code = index.get(v)
+            if code is None:
+                code = index[v] = len(self.values)
+                self.values.append(v)
+            codes[i] = code
+        return codes
+
+    def save(self, directory: str, name: str):
+        encoded = [v.encode('utf-8') for v in self.values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        np.save(os.path.join(directory, f'dict_{name}_data.npy'), np.frombuffer(b''.join(encoded), dtype=np.uint8))
+        np.save(os.path.join(directory, f'dict_{name}_offsets.npy'), offsets)
+        np.save(os.path.join(directory, f'dict_{name}_hash.npy'), _hash_array(self.values))
+
+
+class _DistinctCounter:
+    """64 位哈希的去重计数：分批累积，超过 _UNIQUE_MERGE_SIZE 时合并去重，控制内存"""
+
+    def __init__(self):
+        self._unique = np.empty(0, dtype=np.uint64)
+        self._pending = []
+        self._pending_size = 0
+
+    def add(self, hashes: np.ndarray):
+        self._pending.append(hashes)
+        self._pending_size += len(hashes)
+        if self._pending_size >= _UNIQUE_MERGE_SIZE:
+            self._merge()
+
+    def _merge(self):
+        self._unique = np.unique(np.concatenate([self._unique] + self._pending))
+        self._pending = []
+        self._pending_size = 0
+
+    def count(self) -> int:
+        self._merge()
+        return len(self._unique)
+
+
+class ArchiveWriter:
+    """将已结束的日期导出为列文件（archive_job.py 调用）"""
+
+    def __init__(self, directory: str = ARCHIVE_DIR, lag_days: int = ARCHIVE_LAG_DAYS):
+        self.directory = directory
+        self.lag_days = lag_days
+        self.meta_path = os.path.join(directory, 'archive.json')
+
+    def run(self):
+        """导出所有未归档且已结束的日期，返回导出的日期列表"""
+        meta = _read_json(self.meta_path) if os.path.exists(self.meta_path) else None
+        if meta and meta.get('format') != ARCHIVE_FORMAT:
+            logger.info('archive format changed, re-exporting all days')
+            os.remove(self.meta_path)
+            shutil.rmtree(os.path.join(self.directory, 'days'), ignore_errors=True)
+            shutil.rmtree(os.path.join(self.directory, 'dict'), ignore_errors=True)
+            meta = None
+        os.makedirs(os.path.join(self.directory, 'days'), exist_ok=True)
+        last_closed = (date.today() - timedelta(days=self.lag_days)).isoformat()
+        if meta:
+            first_day = _next_day(meta['last_day'])
+        else:
+            first_day = db.get_stats_first_day()
+            if first_day is None:
+                return []
+            meta = {'format': ARCHIVE_FORMAT, 'first_day': first_day, 'last_day': None}
+        exported = []
+        for day in _day_range(first_day, last_closed) if first_day <= last_closed else ():
+            self.export_day(day)
+            # 当日目录（含字典）先于 archive.json 写入：读取方看到新的 last_day 时，该日数据一定已就绪
+            meta['last_day'] = day
+            _write_json(self.meta_path, meta)
+            exported.append(day)
+            logger.info('archived %s', day)
+        return exported
+
+    def export_day(self, day: str):
+        days_dir = os.path.join(self.directory, 'days')
+        tmp_dir = os.path.join(days_dir, f".{day}.{os.getpid()}.tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        domains, ips = Dictionary(), Dictionary()
+        visitors = db.export_visitor_rows(day)
+        visitors.sort(key=lambda r: -r[2])
+        self._save_columns(tmp_dir, 'visitors', visitors, _VISITOR_COLUMNS, domains, ips)
+
+        # (is_main, domain, ip, clicks) -> 次广告段在前、主广告段在后，各段按点击量降序
+        clicks = db.export_click_rows(day)
+        clicks.sort(key=lambda r: (r[0], -r[3]))
+        secondary_rows = sum(1 for r in clicks if not r[0])
+        self._save_columns(tmp_dir, 'clicks', [r[1:] for r in clicks], _CLICK_COLUMNS, domains, ips)
+        domains.save(tmp_dir, 'domain')
+        ips.save(tmp_dir, 'ip')
+
+        totals = db.export_day_totals(day)
+        manifest = dict(
+            totals,
+            day=day,
+            visitor_rows=len(visitors),
+            visits=int(sum(r[2] for r in visitors)),
+            secondary_rows=secondary_rows,
+            main_rows=len(clicks) - secondary_rows,
+        )
+        _write_json(os.path.join(tmp_dir, 'manifest.json'), manifest)
+
+        final_dir = os.path.join(days_dir, day)
+        shutil.rmtree(final_dir, ignore_errors=True)
+        os.replace(tmp_dir, final_dir)
+
+    def _save_columns(self, directory: str, prefix: str, rows, columns, domains: Dictionary, ips: Dictionary):
+        domain_col, ip_col, count_col = columns
+        np.save(os.path.join(directory, f'{prefix}_{domain_col}.npy'), domains.encode([r[0] for r in rows]))
+        np.save(os.path.join(directory, f'{prefix}_{ip_col}.npy'), ips.encode([r[1] for r in rows]))
+        np.save(os.path.join(directory, f'{prefix}_{count_col}.npy'), np.array([int(r[2]) for r in rows], dtype=np.int64))
+
+
+class ArchiveReader:
+    """基于内存映射数组的查询引擎"""
+
+    def __init__(self, directory: str = ARCHIVE_DIR):
+        self.directory = directory
+        self.meta_path = os.path.join(directory, 'archive.json')
+        self._lock = threading.Lock()
+        self._meta = None
+        self._meta_mtime = None
+        self._manifests = {}
+        self._arrays = OrderedDict()
+
+    # --- 元数据与缓存 ---
+
+    def _load_meta(self):
+        """archive.json 变化时重新读取；无归档时返回 None"""
+        try:
+            mtime = os.path.getmtime(self.meta_path)
+        except OSError:
+            return None
+        with self._lock:
+            if mtime != self._meta_mtime:
+                meta = _read_json(self.meta_path)
+                if meta.get('format') != ARCHIVE_FORMAT or not meta.get('last_day'):
+                    # 旧格式（等待 archive_job 重新导出）或尚未导出任何日期：全部查询 MySQL
+                    meta = None
+                if meta is None or self._meta is None or meta['first_day'] != self._meta['first_day']:
+                    # 归档被重建：丢弃旧的清单与数组缓存
+                    self._manifests = {}
+                    self._arrays.clear()
+                self._meta = meta
+                self._meta_mtime = mtime
+            return self._meta
+
+    def _manifest(self, day: str) -> dict:
+        manifest = self._manifests.get(day)
+        if manifest is None:
+            manifest = _read_json(os.path.join(self.directory, 'days', day, 'manifest.json'))
+            self._manifests[day] = manifest
+        return manifest
+
+    def _array(self, day: str, name: str) -> np.ndarray:
+        key = (day, name)
+        with self._lock:
+            arr = self._arrays.get(key)
+            if arr is not None:
+                self._arrays.move_to_end(key)
+                return arr
+        path = os.path.join(self.directory, 'days', day, f'{name}.npy')
+        # 空数组无法映射，直接读取
+        arr = np.load(path, mmap_mode='r') if os.path.getsize(path) > 128 else np.load(path)
+        with self._lock:
+            self._arrays[key] = arr
+            while len(self._arrays) > ARCHIVE_OPEN_ARRAYS:
+                self._arrays.popitem(last=False)
+        return arr
+
+    def _strings(self, day: str, name: str, codes) -> list:
+        """将当日字典中的编码解码为字符串"""
+        data = self._array(day, f'dict_{name}_data')
+        offsets = self._array(day, f'dict_{name}_offsets')
+        return [bytes(data[offsets[c]:offsets[c + 1]]).decode('utf-8') for c in codes]
+
+    # --- 路由 ---
+
+    def split(self, start: str, end: str):
+        """把 [start, end] 拆成 (归档部分, 在线部分)，每部分为 (start, end) 或 None"""
+        meta = self._load_meta()
+        if meta is None or start > meta['last_day']:
+            return None, (start, end)
+        old_start = max(start, meta['first_day'])
+        old = (old_start, min(end, meta['last_day'])) if old_start <= min(end, meta['last_day']) else None
+        recent = (_next_day(meta['last_day']), end) if end > meta['last_day'] else None
+        return old, recent
+
+    # --- 查询 ---
+
+    def daily(self, start: str, end: str, field: str):
+        """按天的汇总值（page_views / clicks / main_clicks / secondary_clicks），只返回非零的日期"""
+        rows = []
+        for day in _day_range(start, end):
+            value = self._manifest(day)[field]
+            if value:
+                rows.append((day, value))
+        return rows
+
+    def _page(self, start: str, end: str, offset: int, limit: int, rows_of, slice_of):
+        """按日期降序、组内按计数降序分页：整天跳过，只读取落在本页的日期"""
+        total = sum(rows_of(self._manifest(day)) for day in _day_range(start, end))
+        result = []
+        for day in reversed(list(_day_range(start, end))):
+            if limit <= 0:
+                break
+            n = rows_of(self._manifest(day))
+            if offset >= n:
+                offset -= n
+                continue
+            take = min(n - offset, limit)
+            result.append((day, slice_of(day, self._manifest(day), offset, offset + take)))
+            limit -= take
+            offset = 0
+        return result, total
+
+    def clicks_page(self, start: str, end: str, is_main: bool, offset: int, limit: int):
+        """按 (域名, IP, 日期) 的点击明细分页，返回 (rows, total)"""
+        count_field = 'main_rows' if is_main else 'secondary_rows'
+
+        def slice_of(day, manifest, lo, hi):
+            base = manifest['secondary_rows'] if is_main else 0
+            return tuple(self._array(day, f'clicks_{c}')[base + lo:base + hi] for c in _CLICK_COLUMNS)
+
+        pages, total = self._page(start, end, offset, limit, lambda m: m[count_field], slice_of)
+        return self._decode(pages, 'clicks'), total
+
+    def visitors_page(self, start: str, end: str, offset: int, limit: int):
+        """按 (域名, IP, 日期) 的访客明细分页，返回 (rows, total)"""
+        def slice_of(day, manifest, lo, hi):
+            return tuple(self._array(day, f'visitors_{c}')[lo:hi] for c in _VISITOR_COLUMNS)
+
+        pages, total = self._page(start, end, offset, limit, lambda m: m['visitor_rows'], slice_of)
+        return self._decode(pages, 'visits'), total
+
+    def _decode(self, pages, count_name: str):
+        rows = []
+        for day, (domain_codes, ip_codes, counts) in pages:
+            domains = self._strings(day, 'domain', domain_codes.tolist())
+            ips = self._strings(day, 'ip', ip_codes.tolist())
+            for d, i, n in zip(domains, ips, counts.tolist()):
+                rows.append({'domain': d, 'ip': i, 'day': day, count_name: n})
+        return rows
+
+    def visitors_summary(self, start: str, end: str, recent_domains=(), recent_ips=(), recent_visits: int = 0):
+        """区间内总访问量与去重域名 / IP 数；recent_* 为在线部分的去重值，与归档部分合并去重
+
+        各天字典编码互不相同，跨天按字典中预先计算的 64 位哈希去重。
+        """
+        domain_counter, ip_counter = _DistinctCounter(), _DistinctCounter()
+        visits = 0
+        for day in _day_range(start, end):
+            manifest = self._manifest(day)
+            if not manifest['visitor_rows']:
+                continue
+            visits += manifest['visits']
+            domain_counter.add(np.unique(self._array(day, 'dict_domain_hash')[self._array(day, 'visitors_domain')]))
+            ip_counter.add(np.unique(self._array(day, 'dict_ip_hash')[self._array(day, 'visitors_ip')]))
+        domain_counter.add(_hash_array(recent_domains))
+        ip_counter.add(_hash_array(recent_ips))
+        return {
+            'total_visits': visits + recent_visits,
+            'distinct_domains': domain_counter.count(),
+            'distinct_ips': ip_counter.count(),
+        }
+
+    def domain_totals(self, start: str, end: str, metric: str) -> dict:
+        """区间内各域名的访问量（metric='views'）或点击量（metric='clicks'）合计：{domain: n}"""
+        totals = {}
+        prefix, count_col = ('visitors', 'visits') if metric == 'views' else ('clicks', 'clicks')
+        for day in _day_range(start, end):
+            codes = self._array(day, f'{prefix}_domain')
+            if not len(codes):
+                continue
+            sums = np.bincount(codes, weights=self._array(day, f'{prefix}_{count_col}')).astype(np.int64)
+            nonzero = np.flatnonzero(sums).tolist()
+            for domain, n in zip(self._strings(day, 'domain', nonzero), sums[nonzero].tolist()):
+                totals[domain] = totals.get(domain, 0) + n
+        return totals
+
+
+reader = ArchiveReader()
@@ -0,0 +1,209 @@
+"""
+数据库熔断器与事件溢出队列
+
+连续失败达到阈值后熔断（open），在冷却时间内直接拒绝数据库调用而不是等待超时；
+冷却结束后放行一次试探（half_open），成功则恢复。熔断期间投放使用磁盘上的最后可用快照，
+埋点事件写入有界的本地队列，恢复后由后台线程补写。
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+
+import pymysql
+
+from . import db
+from .events import aggregate
+
+logger = logging.getLogger(__name__)
+
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('DB_BREAKER_FAILURE_THRESHOLD', 5))
+BREAKER_RESET_SECONDS = float(os.environ.get('DB_BREAKER_RESET_SECONDS', 15))
+# 溢出队列最多保留的事件数，超出后丢弃最旧的事件
+SPILL_MAX_EVENTS = int(os.environ.get('EVENT_SPILL_MAX_EVENTS', 100000))
+SPILL_DRAIN_BATCH = 5000
+SPILL_DRAIN_INTERVAL = 1.0
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+# 视为数据库不可用的 OperationalError 错误码：无法连接（2003）、连接断开（2006 / 2013 / 2055）。
+# 死锁（1213）、锁等待超时（1205）、查询被 KILL（1317）等说明数据库仍在工作，不计入
+CONNECTION_ERROR_CODES = frozenset((2003, 2006, 2013, 2055))
+
+
+def is_db_unavailable(error: Exception) -> bool:
+    """是否为连接层面的失败（数据库不可达、连接断开、连接池耗尽）"""
+    if isinstance(error, (pymysql.err.InterfaceError, db.PoolTimeout)):
+        return True
+    return (isinstance(error, pymysql.err.OperationalError)
+            and bool(error.args) and error.args[0] in CONNECTION_ERROR_CODES)
+
+
+class CircuitOpenError(Exception):
+    """熔断中，未执行数据库调用"""
+
+
+class DatabaseUnavailableError(Exception):
+    """经熔断器的调用因数据库不可用而失败（原始异常见 __cause__）"""
+
+
+# 经熔断器的调用在数据库不可用时抛出的异常；直接访问数据库的代码用 is_db_unavailable 判断
+DB_UNAVAILABLE_ERRORS = (DatabaseUnavailableError,)
+# 事件写入稍后重试即可能成功的错误：熔断、数据库不可用，以及死锁 / 锁等待超时等其他 OperationalError
+RETRYABLE_WRITE_ERRORS = (CircuitOpenError, DatabaseUnavailableError, pymysql.err.OperationalError)
+
+
+class CircuitBreaker:
+    """closed -> open -> half_open -> closed 的三态熔断器"""
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def _allow(self) -> bool:
+        with self._lock:
+            if self.state == STATE_CLOSED:
+                return True
+            if self.state == STATE_OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = STATE_HALF_OPEN
+            if self.state == STATE_HALF_OPEN and not self._trial_running:
+                # 半开状态只放行一个试探调用
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != STATE_CLOSED:
+                logger.info('db circuit closed')
+            self.state = STATE_CLOSED
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self, error: Exception):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)
+            self._trial_running = False
+            if self.state == STATE_HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != STATE_OPEN:
+                    logger.warning('db circuit opened: %s', error)
+                self.state = STATE_OPEN
+                self.opened_at = time.monotonic()
+
+    def call(self, fn, *args, **kwargs):
+        """经熔断器执行数据库调用；熔断中抛出 CircuitOpenError，数据库不可用时抛出 DatabaseUnavailableError"""
+        if not self._allow():
+            raise CircuitOpenError('database circuit open')
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if is_db_unavailable(e):
+                self.record_failure(e)
+                raise DatabaseUnavailableError(str(e)) from e
+            # 非可用性错误（SQL 错误、死锁、锁等待超时等）不影响熔断状态，但要释放半开试探
+            with self._lock:
+                self._trial_running = False
+            raise
+        self.record_success()
+        return result
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'last_error': self.last_error,
+            }
+
+
+class SpillQueue:
+    """数据库不可用时暂存埋点事件的有界队列，由后台线程在恢复后补写"""
+
+    def __init__(self, breaker: CircuitBreaker, max_events: int = SPILL_MAX_EVENTS):
+        self.breaker = breaker
+        self._events = deque(maxlen=max_events)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.spilled = 0
+        self.dropped = 0
+        self.drained = 0
+
+    def put(self, events):
+        with self._lock:
+            overflow = len(self._events) + len(events) - self._events.maxlen
+            if overflow > 0:
+                self.dropped += overflow
+            self._events.extend(events)
+            self.spilled += len(events)
+
+    def drain_once(self) -> int:
+        with self._lock:
+            n = min(len(self._events), SPILL_DRAIN_BATCH)
+            batch = [self._events.popleft() for _ in range(n)]
+        if not batch:
+            return 0
+        try:
+            self.breaker.call(db.apply_event_batch, aggregate(batch))
+        except RETRYABLE_WRITE_ERRORS:
+            # 数据库仍不可用或锁冲突：放回队首，保持顺序，等待下次重试
+            with self._lock:
+                # 队列已满时丢弃最旧的事件，即批次的开头部分（extendleft 在满时会从右端挤掉最新的事件）
+                overflow = len(self._events) + n - self._events.maxlen
+                if overflow > 0:
+                    self.dropped += overflow
+                    batch = batch[overflow:]
+                self._events.extendleft(reversed(batch))
+            return 0
+        except Exception:
+            # 数据错误等重试也不会成功，放回队列只会阻塞后续补写：记录后丢弃该批次
+            logger.exception('dropping %d spilled events that cannot be written', n)
+            with self._lock:
+                self.dropped += n
+            return 0
+        with self._lock:
+            self.drained += n
+        return n
+
+    def _run(self):
+        while True:
+            if not self.drain_once():
+                time.sleep(SPILL_DRAIN_INTERVAL)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='event-spill-drain', daemon=True)
+            self._thread.start()
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                'pending': len(self._events),
+                'max_events': self._events.maxlen,
+                'spilled': self.spilled,
+                'drained': self.drained,
+                'dropped': self.dropped,
+            }
+
+
+breaker = CircuitBreaker()
+spill_queue = SpillQueue(breaker)
+
+
+def write_events(events):
+    """经熔断器将事件写入统计表；数据库不可用或锁冲突时转入溢出队列（锁冲突不计入熔断）"""
+    try:
+        breaker.call(db.apply_event_batch, aggregate(events))
+    except RETRYABLE_WRITE_ERRORS:
+        spill_queue.put(events)
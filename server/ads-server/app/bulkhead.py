@@ -0,0 +1,82 @@
+"""
+工作隔离（bulkhead）
+
+报表查询在独立、定长的线程池中执行，且同时在途的任务数有上限，超出直接返回 503，
+不会占用投放与埋点接口所用的默认线程池。客户端断开时取消仍在执行的 MySQL 查询。
+"""
+
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import anyio.to_thread
+import pymysql
+from fastapi import HTTPException, Request
+
+from . import db
+
+# 投放 / 埋点（同步接口）使用的默认线程池大小
+SERVING_THREADS = int(os.environ.get('SERVING_THREADS', 40))
+# 报表线程数与排队上限
+REPORTING_THREADS = int(os.environ.get('REPORTING_THREADS', db.REPORTING_POOL_SIZE))
+REPORTING_MAX_QUEUE = int(os.environ.get('REPORTING_MAX_QUEUE', 32))
+# MySQL 因 MAX_EXECUTION_TIME 中止查询时的错误码
+ER_QUERY_TIMEOUT = 3024
+# 检查客户端是否断开的间隔（秒）
+DISCONNECT_POLL_INTERVAL = 0.5
+
+
+def configure_serving_threads():
+    """设置 FastAPI 同步接口所用默认线程池的大小（需在事件循环内调用）"""
+    anyio.to_thread.current_default_thread_limiter().total_tokens = SERVING_THREADS
+
+
+class Bulkhead:
+    """独立线程池 + 在途任务上限"""
+
+    def __init__(self, name: str, max_workers: int, max_queue: int, cancel=None):
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'{name}-')
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._cancel = cancel
+
+    async def run(self, request: Request, fn, *args, **kwargs):
+        """在本 bulkhead 中执行 fn；请求方断开时取消正在执行的查询"""
+        if not self._slots.acquire(blocking=False):
+            raise HTTPException(status_code=503, detail=f'{self.name} busy')
+        running = {}
+
+        def call():
+            running['thread'] = threading.get_ident()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                running.pop('thread', None)
+                # 在线程内释放：请求方断开后查询可能仍在执行，此时不能提前让出名额
+                self._slots.release()
+
+        task = self._executor.submit(call)
+        # 尚未开始执行就被取消时 call() 不会运行，由这里释放名额
+        task.add_done_callback(lambda t: t.cancelled() and self._slots.release())
+        future = asyncio.wrap_future(task)
+        while True:
+            done, _ = await asyncio.wait({future}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                try:
+                    return future.result()
+                except db.PoolTimeout:
+                    raise HTTPException(status_code=503, detail=f'{self.name} busy')
+                except pymysql.err.OperationalError as e:
+                    if e.args and e.args[0] == ER_QUERY_TIMEOUT:
+                        raise HTTPException(status_code=504, detail='query timeout')
+                    raise
+            if request is not None and await request.is_disconnected():
+                future.cancel()
+                thread = running.get('thread')
+                if thread is not None and self._cancel:
+                    await asyncio.get_running_loop().run_in_executor(None, self._cancel, thread)
+                raise HTTPException(status_code=499, detail='client closed request')
+
+
+reporting = Bulkhead('reporting', REPORTING_THREADS, REPORTING_MAX_QUEUE, cancel=db.cancel_reporting_query)
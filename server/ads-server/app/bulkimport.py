@@ -0,0 +1,183 @@
+"""
+广告批量导入
+
+上传一个 zip：图片素材 + 清单（manifest.csv 或 manifest.json），清单每行一条广告：
+file（zip 内图片路径，相对清单所在目录）、link、is_main、x_redirect_enabled。
+素材在线程池中流式解压到上传目录（不整体读入内存），成功的条目用一条多行 INSERT 在一个事务中写入，
+返回逐条结果。文件名一律重新生成，不使用 zip 内的路径，避免路径穿越。
+"""
+
+import io
+import os
+import csv
+import uuid
+import zipfile
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+
+import orjson
+
+from . import db
+
+IMPORT_MAX_ITEMS = int(os.environ.get('IMPORT_MAX_ITEMS', 500))
+IMPORT_MAX_FILE_BYTES = int(os.environ.get('IMPORT_MAX_FILE_BYTES', 10 * 1024 * 1024))
+IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', 4))
+ALLOWED_IMAGE_EXTS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
+MANIFEST_NAMES = ('manifest.csv', 'manifest.json')
+_CHUNK = 64 * 1024
+
+_TRUE = {'1', 'true', 'yes', 'y', 'on', 'main'}
+_FALSE = {'0', 'false', 'no', 'n', 'off', 'secondary', ''}
+
+
+class InvalidImport(ValueError):
+    """整个导入包无效（不是 zip、缺少清单、条目过多等）"""
+
+
+def _parse_bool(value, default: bool) -> bool:
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text == '':
+        return default
+    if text in _TRUE:
+        return True
+    if text in _FALSE:
+        return False
+    raise ValueError(f'invalid boolean: {value}')
+
+
+def _find_manifest(zf: zipfile.ZipFile):
+    """返回路径最短的清单文件（兼容压缩整个文件夹时多出的一层目录）"""
+    candidates = [
+        info for info in zf.infolist()
+        if not info.is_dir() and posixpath.basename(info.filename).lower() in MANIFEST_NAMES
+        and not info.filename.startswith('__MACOSX/')
+    ]
+    if not candidates:
+        raise InvalidImport('manifest.csv or manifest.json not found')
+    return min(candidates, key=lambda info: (info.filename.count('/'), info.filename))
+
+
+def _read_manifest(zf: zipfile.ZipFile, info: zipfile.ZipInfo):
+    if info.file_size > IMPORT_MAX_FILE_BYTES:
+        raise InvalidImport('manifest too large')
+    with zf.open(info) as f:
+        if info.filename.lower().endswith('.json'):
+            rows = orjson.loads(f.read())
+            if isinstance(rows, dict):
+                rows = rows.get('ads')
+            if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+                raise InvalidImport('manifest.json must be a list of objects')
+            return rows
+        reader = csv.DictReader(io.TextIOWrapper(f, encoding='utf-8-sig', newline=''))
+        return [{(k or '').strip(): v for k, v in row.items()} for row in reader]
+
+
+def _extract(zf: zipfile.ZipFile, info: zipfile.ZipInfo, upload_dir: str) -> str:
+    """流式解压单个素材到上传目录，返回新文件名"""
+    ext = posixpath.splitext(info.filename)[1].lower()
+    fname = f"{uuid.uuid4().hex}{ext}"
+    fpath = os.path.join(upload_dir, fname)
+    tmp_path = f"{fpath}.part"
+    try:
+        with zf.open(info) as src, open(tmp_path, 'wb') as dst:
+            # zip 头部的 file_size 可伪造，写入时再按实际字节数限制
+            written = 0
+            while True:
+                chunk = src.read(_CHUNK)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > IMPORT_MAX_FILE_BYTES:
+                    raise ValueError('file too large')
+                dst.write(chunk)
+        os.replace(tmp_path, fpath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return fname
+
+
+def import_zip(fileobj, upload_dir: str, url_prefix: str):
+    """处理导入包，返回逐条结果 [{row, file, id, error}]
+
+    fileobj 为可 seek 的文件对象（上传的临时文件），整个包无效时抛出 InvalidImport。
+    """
+    try:
+        zf = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile:
+        raise InvalidImport('not a zip file')
+
+    with zf:
+        manifest_info = _find_manifest(zf)
+        rows = _read_manifest(zf, manifest_info)
+        if not rows:
+            raise InvalidImport('manifest is empty')
+        if len(rows) > IMPORT_MAX_ITEMS:
+            raise InvalidImport(f'too many items (max {IMPORT_MAX_ITEMS})')
+        base_dir = posixpath.dirname(manifest_info.filename)
+        members = {info.filename: info for info in zf.infolist() if not info.is_dir()}
+
+        # 先校验清单，只解压通过校验的条目
+        results = []
+        jobs = []
+        for i, row in enumerate(rows, start=1):
+            name = str(row.get('file') or '').strip()
+            result = {'row': i, 'file': name, 'id': None, 'error': None}
+            results.append(result)
+            try:
+                link = str(row.get('link') or '').strip()
+                if not name:
+                    raise ValueError('file is required')
+                if not link:
+                    raise ValueError('link is required')
+                info = members.get(posixpath.normpath(posixpath.join(base_dir, name)))
+                if info is None:
+                    raise ValueError('file not found in zip')
+                if posixpath.splitext(name)[1].lower() not in ALLOWED_IMAGE_EXTS:
+                    raise ValueError('unsupported image type')
+                if info.file_size > IMPORT_MAX_FILE_BYTES:
+                    raise ValueError('file too large')
+                is_main = _parse_bool(row.get('is_main'), False)
+                x_redirect_enabled = _parse_bool(row.get('x_redirect_enabled'), True)
+            except ValueError as e:
+                result['error'] = str(e)
+                continue
+            jobs.append((result, info, link, is_main, x_redirect_enabled))
+
+        # zipfile 支持多个成员并发读取（底层文件读取有锁），解压在工作线程中并行进行
+        with ThreadPoolExecutor(max_workers=IMPORT_WORKERS, thread_name_prefix='ad-import-') as pool:
+            futures = [pool.submit(_extract, zf, info, upload_dir) for _, info, _, _, _ in jobs]
+            extracted = []
+            for (result, _, link, is_main, x_redirect_enabled), future in zip(jobs, futures):
+                try:
+                    fname = future.result()
+                except Exception as e:
+                    # 损坏、加密或压缩方式不支持的成员只影响本条
+                    result['error'] = str(e) or e.__class__.__name__
+                    continue
+                extracted.append((result, fname, link, is_main, x_redirect_enabled))
+
+    if extracted:
+        ads = [
+            {'img_url': f"{url_prefix}/{fname}", 'link': link,
+             'is_main': is_main, 'x_redirect_enabled': x_redirect_enabled}
+            for _, fname, link, is_main, x_redirect_enabled in extracted
+        ]
+        try:
+            ids = db.create_ads_bulk(ads)
+        except Exception:
+            # 事务回滚后已解压的文件不再被引用，一并删除
+            for _, fname, _, _, _ in extracted:
+                try:
+                    os.remove(os.path.join(upload_dir, fname))
+                except OSError:
+                    pass
+            raise
+        for (result, _, _, _, _), ad_id in zip(extracted, ids):
+            result['id'] = ad_id
+    return results
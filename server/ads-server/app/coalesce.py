@@ -0,0 +1,110 @@
+"""
+埋点事件合并写入
+
+各请求的事件先追加到进程内缓冲区，由后台线程每 EVENT_COALESCE_MS 毫秒（或缓冲达到
+EVENT_COALESCE_MAX_EVENTS 条时）聚合为一个 EventBatch 写入，多个请求共用一次多行 upsert 与一个事务。
+代价是进程崩溃时最多丢失一个间隔内的事件；需要持久化保证时使用 journal。
+EVENT_COALESCE_MS=0 时关闭合并，每个请求同步写入。
+"""
+
+import os
+import time
+import logging
+import threading
+
+from .breaker import write_events
+
+logger = logging.getLogger(__name__)
+
+COALESCE_INTERVAL = float(os.environ.get('EVENT_COALESCE_MS', 1000)) / 1000
+COALESCE_MAX_EVENTS = int(os.environ.get('EVENT_COALESCE_MAX_EVENTS', 5000))
+
+
+class EventCoalescer:
+    """进程内事件缓冲 + 定时批量写入"""
+
+    def __init__(self, interval: float = COALESCE_INTERVAL, max_events: int = COALESCE_MAX_EVENTS,
+                 write=write_events):
+        self.interval = interval
+        self.max_events = max_events
+        self._write = write
+        self._events = []
+        self._cond = threading.Condition()
+        # 保证同一时刻只有一个批次在写入（后台线程与关闭时的 flush）
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self.flushes = 0
+        self.written = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def add(self, events):
+        with self._cond:
+            self._events.extend(events)
+            if len(self._events) >= self.max_events:
+                self._cond.notify()
+
+    def flush(self) -> int:
+        """立即写入缓冲区中的事件，返回写入条数"""
+        with self._write_lock:
+            with self._cond:
+                events, self._events = self._events, []
+            if not events:
+                return 0
+            try:
+                self._write(events)
+                written = len(events)
+            except Exception:
+                # 非可用性错误（数据异常等）通常只由个别事件引起：对半拆分重试，只丢弃无法写入的事件
+                logger.exception('failed to write %d coalesced events, retrying in halves', len(events))
+                written = self._write_isolating(events)
+            self.flushes += 1
+            self.written += written
+            return written
+
+    def _write_isolating(self, events) -> int:
+        """将写入失败的批次对半拆分后分别写入，返回成功写入的条数；单个事件仍失败时丢弃"""
+        if len(events) == 1:
+            logger.warning('dropping event that cannot be written: %r', events[0])
+            return 0
+        mid = len(events) // 2
+        written = 0
+        for part in (events[:mid], events[mid:]):
+            try:
+                self._write(part)
+                written += len(part)
+            except Exception:
+                written += self._write_isolating(part)
+        return written
+
+    def _run(self):
+        while True:
+            deadline = time.monotonic() + self.interval
+            with self._cond:
+                while len(self._events) < self.max_events:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            self.flush()
+
+    def start(self):
+        if self.enabled and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='event-coalescer', daemon=True)
+            self._thread.start()
+
+    def status(self) -> dict:
+        with self._cond:
+            pending = len(self._events)
+        return {
+            'enabled': self.enabled,
+            'interval_ms': int(self.interval * 1000),
+            'pending': pending,
+            'flushes': self.flushes,
+            'written': self.written,
+        }
+
+
+coalescer = EventCoalescer()
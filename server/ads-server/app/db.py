@@ -1,6 +1,9 @@
 
 import threading
 import os
+import time
+import queue
+from contextlib import ExitStack, contextmanager
 from datetime import datetime
 import random
 import pymysql
@@ -13,8 +16,36 @@ MYSQL_USER = os.environ.get('MYSQL_USER', 'ads-db')
 MYSQL_PASSWORD = os.environ.get('MYSQL_PASSWORD', 'msLLm3477eaRYT8z')
 MYSQL_DB = os.environ.get('MYSQL_DB', 'ads-db')
 
-
-DB_LOCK = threading.Lock()
+# 单次调用的超时（秒）：连接、读、写；避免数据库变慢时请求无限挂起
+DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', 3))
+DB_READ_TIMEOUT = int(os.environ.get('DB_READ_TIMEOUT', 10))
+DB_WRITE_TIMEOUT = int(os.environ.get('DB_WRITE_TIMEOUT', 10))
+
+# 只读副本（可选）：配置 MYSQL_REPLICA_HOST 后报表查询优先走副本，延迟过大或不可用时回退主库
+MYSQL_REPLICA_HOST = os.environ.get('MYSQL_REPLICA_HOST')
+MYSQL_REPLICA_PORT = int(os.environ.get('MYSQL_REPLICA_PORT', 3306))
+MYSQL_REPLICA_USER = os.environ.get('MYSQL_REPLICA_USER', MYSQL_USER)
+MYSQL_REPLICA_PASSWORD = os.environ.get('MYSQL_REPLICA_PASSWORD', MYSQL_PASSWORD)
+# 允许的最大复制延迟（秒）与延迟检查间隔；MYSQL_REPLICA_CHECK_LAG=false 时不检查（例如本地用独立实例测试）
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('MYSQL_REPLICA_MAX_LAG_SECONDS', 10))
+REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get('MYSQL_REPLICA_LAG_CHECK_INTERVAL', 5))
+REPLICA_CHECK_LAG = os.environ.get('MYSQL_REPLICA_CHECK_LAG', 'true').lower() in ('1', 'true', 'yes', 'on')
+
+# 批量创建广告时每条 INSERT 的行数（每行最长约 3KB，远低于 max_allowed_packet）
+BULK_INSERT_CHUNK = 100
+
+# 热点计数行（page_views / ad_clicks / ad_impressions）的分片数：写入随机落到某个分片，读取时按逻辑键求和
+COUNTER_SHARDS = int(os.environ.get('COUNTER_SHARDS', 16))
+
+# 连接池（bulkhead）：投放/埋点与报表查询各用独立的连接预算，互不挤占
+SERVING_POOL_SIZE = int(os.environ.get('DB_SERVING_POOL_SIZE', 20))
+REPORTING_POOL_SIZE = int(os.environ.get('DB_REPORTING_POOL_SIZE', 4))
+# 等待空闲连接的最长秒数，超时抛出 PoolTimeout
+POOL_ACQUIRE_TIMEOUT = float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT', 5))
+# 连接闲置超过该秒数后，复用前先 ping 检查
+POOL_PING_AFTER_IDLE = 30
+# 报表查询的服务端超时（MySQL MAX_EXECUTION_TIME，毫秒，仅作用于 SELECT）
+REPORTING_MAX_EXECUTION_MS = int(os.environ.get('DB_REPORTING_MAX_EXECUTION_MS', 30000))
 
 SCHEMA_TABLES = [
     # 广告表
@@ -45,21 +76,24 @@ SCHEMA_TABLES = [
         INDEX idx_domain (domain)
     ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
     """,
-    # 页面访问量，按 day 为唯一键
+    # 页面访问量，(day, shard) 唯一，按 day 求和得到当日访问量
     """
     CREATE TABLE IF NOT EXISTS page_views (
-        day DATE PRIMARY KEY,
-        count BIGINT DEFAULT 0
+        day DATE NOT NULL,
+        shard SMALLINT NOT NULL DEFAULT 0,
+        count BIGINT DEFAULT 0,
+        PRIMARY KEY (day, shard)
     ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
     """,
-    # 广告点击，(ad_id, day) 唯一
+    # 广告点击，(ad_id, day, shard) 唯一
     """
     CREATE TABLE IF NOT EXISTS ad_clicks (
         id BIGINT PRIMARY KEY AUTO_INCREMENT,
         ad_id BIGINT,
         day DATE,
+        shard SMALLINT NOT NULL DEFAULT 0,
         clicks BIGINT DEFAULT 0,
-        UNIQUE KEY uk_ad_day (ad_id, day)
+        UNIQUE KEY uk_ad_day_shard (ad_id, day, shard)
     ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
     """,
     # 广告点击按域名和IP统计，(ad_id, day, domain, ip) 唯一
@@ -74,6 +108,67 @@ SCHEMA_TABLES = [
         UNIQUE KEY uk_ad_day_domain_ip (ad_id, day, domain, ip)
     ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
     """,
+    # 广告展示量，(ad_id, day, shard) 唯一
+    """
+    CREATE TABLE IF NOT EXISTS ad_impressions (
+        id BIGINT PRIMARY KEY AUTO_INCREMENT,
+        ad_id BIGINT NOT NULL,
+        day DATE NOT NULL,
+        shard SMALLINT NOT NULL DEFAULT 0,
+        impressions BIGINT DEFAULT 0,
+        UNIQUE KEY uk_ad_day_shard (ad_id, day, shard)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+    # 按小时的页面访问量，(day, hour, shard) 唯一；超过 HOURLY_RETENTION_DAYS 的行由 compact_hourly_stats 删除
+    """
+    CREATE TABLE IF NOT EXISTS page_views_hourly (
+        day DATE NOT NULL,
+        hour TINYINT NOT NULL,
+        shard SMALLINT NOT NULL DEFAULT 0,
+        count BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, hour, shard)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+    # 按小时的广告点击，(day, hour, ad_id, shard) 唯一；主 / 次广告在查询时关联 ads 区分
+    """
+    CREATE TABLE IF NOT EXISTS ad_clicks_hourly (
+        day DATE NOT NULL,
+        hour TINYINT NOT NULL,
+        ad_id BIGINT NOT NULL,
+        shard SMALLINT NOT NULL DEFAULT 0,
+        clicks BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, hour, ad_id, shard)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+    # 广告累计展示 / 点击（用于 CTR），与日计数在同一事务中增量更新；(ad_id, shard) 唯一，按 ad_id 求和
+    """
+    CREATE TABLE IF NOT EXISTS ad_stats (
+        ad_id BIGINT NOT NULL,
+        shard SMALLINT NOT NULL DEFAULT 0,
+        impressions BIGINT NOT NULL DEFAULT 0,
+        clicks BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (ad_id, shard)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+    # 广告定向规则：mode 为 include（仅在匹配域名投放）或 exclude（不在匹配域名投放）；
+    # pattern 为精确域名或 *.example.com（匹配 example.com 及其子域名）
+    """
+    CREATE TABLE IF NOT EXISTS ad_targeting (
+        id BIGINT PRIMARY KEY AUTO_INCREMENT,
+        ad_id BIGINT NOT NULL,
+        mode VARCHAR(16) NOT NULL,
+        pattern VARCHAR(255) NOT NULL,
+        UNIQUE KEY uk_ad_mode_pattern (ad_id, mode, pattern)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+    # 事件 journal 各分段的已消费偏移量，与统计数据在同一事务中更新
+    """
+    CREATE TABLE IF NOT EXISTS journal_offsets (
+        segment VARCHAR(255) PRIMARY KEY,
+        offset BIGINT NOT NULL,
+        updated_at DATETIME
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
     # 访客访问按域名和IP统计，(day, domain, ip) 唯一
     """
     CREATE TABLE IF NOT EXISTS visitor_views_by_domain_ip (
@@ -96,11 +191,12 @@ def _get_root_conn():
         user=MYSQL_USER, 
         password=MYSQL_PASSWORD, 
         cursorclass=DictCursor, 
-        autocommit=True
+        autocommit=True,
+        connect_timeout=DB_CONNECT_TIMEOUT
     )
 
 
-def get_conn():
+def get_conn(read_timeout: int = DB_READ_TIMEOUT):
     """获取数据库连接"""
     return pymysql.connect(
         host=MYSQL_HOST, 
@@ -109,54 +205,362 @@ def get_conn():
         password=MYSQL_PASSWORD, 
         database=MYSQL_DB, 
         cursorclass=DictCursor, 
-        autocommit=True
+        autocommit=True,
+        connect_timeout=DB_CONNECT_TIMEOUT,
+        read_timeout=read_timeout,
+        write_timeout=DB_WRITE_TIMEOUT
     )
 
 
-def init_db():
-    """初始化数据库和表"""
-    with DB_LOCK:
-        # 创建数据库（如果不存在），然后创建表
-        root_conn = _get_root_conn()
+def get_replica_conn(read_timeout: int = DB_READ_TIMEOUT):
+    """获取只读副本连接"""
+    return pymysql.connect(
+        host=MYSQL_REPLICA_HOST, 
+        port=MYSQL_REPLICA_PORT, 
+        user=MYSQL_REPLICA_USER, 
+        password=MYSQL_REPLICA_PASSWORD, 
+        database=MYSQL_DB, 
+        cursorclass=DictCursor, 
+        autocommit=True,
+        connect_timeout=DB_CONNECT_TIMEOUT,
+        read_timeout=read_timeout,
+        write_timeout=DB_WRITE_TIMEOUT
+    )
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except pymysql.MySQLError:
+        pass
+
+
+class PoolTimeout(Exception):
+    """连接池在等待时间内没有可用连接"""
+
+
+class ConnectionPool:
+    """固定上限的连接池
+
+    size 限制同时占用的连接数（即该类工作的连接预算）；空闲连接复用，出错的连接直接丢弃。
+    记录每个线程当前占用的连接，便于在客户端断开时取消其正在执行的查询。
+    """
+
+    def __init__(self, name: str, size: int, connect=None, init_sql=None):
+        self.name = name
+        self.size = size
+        self._connect = connect or get_conn
+        self._init_sql = init_sql or []
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.LifoQueue()
+        self._in_use = {}
+        self._lock = threading.Lock()
+
+    def _new_conn(self):
+        conn = self._connect()
+        with conn.cursor() as cur:
+            for sql in self._init_sql:
+                cur.execute(sql)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        if not self._slots.acquire(timeout=POOL_ACQUIRE_TIMEOUT):
+            raise PoolTimeout(f'{self.name} pool exhausted')
+        conn = None
         try:
-            with root_conn.cursor() as cur:
-                cur.execute(f"CREATE DATABASE IF NOT EXISTS `{MYSQL_DB}` CHARACTER SET utf8mb4 COLLATE utf8mb4_general_ci;")
+            conn = self._take_idle()
+            if conn is None:
+                conn = self._new_conn()
+            with self._lock:
+                self._in_use[threading.get_ident()] = conn
+            try:
+                yield conn
+            except Exception:
+                _close_quietly(conn)
+                conn = None
+                raise
         finally:
-            root_conn.close()
-
-        conn = get_conn()
+            with self._lock:
+                self._in_use.pop(threading.get_ident(), None)
+            if conn is not None and conn.open:
+                self._idle.put((conn, time.monotonic()))
+            self._slots.release()
+
+    def _take_idle(self):
+        """取一个可用的空闲连接；闲置较久的连接先 ping 一次，失效则丢弃"""
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return None
+            if time.monotonic() - last_used < POOL_PING_AFTER_IDLE:
+                return conn
+            try:
+                conn.ping(reconnect=False)
+                return conn
+            except pymysql.MySQLError:
+                _close_quietly(conn)
+
+    def cancel_thread_query(self, thread_ident: int) -> bool:
+        """取消指定线程在本池连接上正在执行的查询（KILL QUERY）"""
+        with self._lock:
+            conn = self._in_use.get(thread_ident)
+        if conn is None:
+            return False
+        killer = self._connect()
+        try:
+            with killer.cursor() as cur:
+                cur.execute("KILL QUERY %s", (conn.thread_id(),))
+        except pymysql.MySQLError:
+            return False
+        finally:
+            killer.close()
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_use = len(self._in_use)
+        return {'size': self.size, 'in_use': in_use, 'idle': self._idle.qsize()}
+
+
+SERVING_POOL = ConnectionPool('serving', SERVING_POOL_SIZE)
+# 报表连接的读超时需覆盖服务端 MAX_EXECUTION_TIME
+_REPORTING_READ_TIMEOUT = REPORTING_MAX_EXECUTION_MS // 1000 + 5
+REPORTING_POOL = ConnectionPool(
+    'reporting', REPORTING_POOL_SIZE,
+    connect=lambda: get_conn(read_timeout=_REPORTING_READ_TIMEOUT),
+    init_sql=[f"SET SESSION MAX_EXECUTION_TIME={REPORTING_MAX_EXECUTION_MS}"],
+)
+REPLICA_POOL = ConnectionPool(
+    'replica', REPORTING_POOL_SIZE,
+    connect=lambda: get_replica_conn(read_timeout=_REPORTING_READ_TIMEOUT),
+    init_sql=[f"SET SESSION MAX_EXECUTION_TIME={REPORTING_MAX_EXECUTION_MS}"],
+) if MYSQL_REPLICA_HOST else None
+
+
+class ReplicaRouter:
+    """报表查询的路由：副本可用且复制延迟在阈值内时走副本，否则回退到主库报表连接池"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self.healthy = False
+        self.lag_seconds = None
+        self.last_error = None
+
+    def _check(self):
+        """查询副本的复制延迟（SHOW REPLICA STATUS，旧版本回退 SHOW SLAVE STATUS）"""
+        if not REPLICA_CHECK_LAG:
+            return True, 0, None
+        conn = get_replica_conn()
         try:
             with conn.cursor() as cur:
-                for s in SCHEMA_TABLES:
-                    cur.execute(s)
-                # 初始化默认设置（如不存在）
-                # ads_global_enabled / ads_main_enabled / ads_secondary_enabled 全部默认开启
-                cur.execute("INSERT IGNORE INTO settings (k, v) VALUES ('ads_global_enabled', 'true')")
-                cur.execute("INSERT IGNORE INTO settings (k, v) VALUES ('ads_main_enabled', 'true')")
-                cur.execute("INSERT IGNORE INTO settings (k, v) VALUES ('ads_secondary_enabled', 'true')")
-                # 广告频率控制：主广告和次要广告每日仅弹出一次的开关，默认关闭
-                cur.execute("INSERT IGNORE INTO settings (k, v) VALUES ('main_ad_once_per_day', 'false')")
-                cur.execute("INSERT IGNORE INTO settings (k, v) VALUES ('secondary_ad_once_per_day', 'false')")
+                try:
+                    cur.execute("SHOW REPLICA STATUS")
+                except pymysql.err.ProgrammingError:
+                    cur.execute("SHOW SLAVE STATUS")
+                row = cur.fetchone()
         finally:
-            conn.close()
+            _close_quietly(conn)
+        if not row:
+            return False, None, 'not a replica'
+        lag = row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+        if lag is None:
+            return False, None, 'replication stopped'
+        return lag <= REPLICA_MAX_LAG_SECONDS, lag, None
+
+    def refresh(self, force: bool = False):
+        if REPLICA_POOL is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._checked_at < REPLICA_LAG_CHECK_INTERVAL:
+            return
+        # 同一时刻只有一个线程检查，其余线程沿用上次结果
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            try:
+                self.healthy, self.lag_seconds, self.last_error = self._check()
+            except pymysql.MySQLError as e:
+                self.healthy, self.lag_seconds, self.last_error = False, None, str(e)
+            self._checked_at = time.monotonic()
+        finally:
+            self._lock.release()
+
+    def mark_down(self, error: Exception):
+        self.healthy = False
+        self.last_error = str(error)
+        self._checked_at = time.monotonic()
+
+    def pool(self) -> ConnectionPool:
+        self.refresh()
+        return REPLICA_POOL if REPLICA_POOL is not None and self.healthy else REPORTING_POOL
+
+    def status(self) -> dict:
+        return {
+            'configured': REPLICA_POOL is not None,
+            'healthy': self.healthy,
+            'lag_seconds': self.lag_seconds,
+            'max_lag_seconds': REPLICA_MAX_LAG_SECONDS,
+            'last_error': self.last_error,
+        }
+
+
+replica_router = ReplicaRouter()
+
+
+@contextmanager
+def _reporting_connection():
+    """报表查询连接：优先副本；副本连接失败时标记为不可用并改用主库"""
+    with ExitStack() as stack:
+        conn = None
+        if replica_router.pool() is REPLICA_POOL:
+            try:
+                conn = stack.enter_context(REPLICA_POOL.connection())
+            except pymysql.err.OperationalError as e:
+                replica_router.mark_down(e)
+        if conn is None:
+            conn = stack.enter_context(REPORTING_POOL.connection())
+        yield conn
+
+
+def init_db():
+    """初始化数据库和表"""
+    # 创建数据库（如果不存在），然后创建表
+    root_conn = _get_root_conn()
+    try:
+        with root_conn.cursor() as cur:
+            cur.execute(f"CREATE DATABASE IF NOT EXISTS `{MYSQL_DB}` CHARACTER SET utf8mb4 COLLATE utf8mb4_general_ci;")
+    finally:
+        root_conn.close()
+
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            for s in SCHEMA_TABLES:
+                cur.execute(s)
+            _migrate_counter_shards(cur)
+            # 初始化默认设置（如不存在）
+            # ads_global_enabled / ads_main_enabled / ads_secondary_enabled 全部默认开启
+            cur.execute("INSERT IGNORE INTO settings (k, v) VALUES ('ads_global_enabled', 'true')")
+            cur.execute("INSERT IGNORE INTO settings (k, v) VALUES ('ads_main_enabled', 'true')")
+            cur.execute("INSERT IGNORE INTO settings (k, v) VALUES ('ads_secondary_enabled', 'true')")
+            # 广告频率控制：主广告和次要广告每日仅弹出一次的开关，默认关闭
+            cur.execute("INSERT IGNORE INTO settings (k, v) VALUES ('main_ad_once_per_day', 'false')")
+            cur.execute("INSERT IGNORE INTO settings (k, v) VALUES ('secondary_ad_once_per_day', 'false')")
+        _backfill_ad_stats(conn)
+    finally:
+        conn.close()
+
+
+# 旧版计数表升级为分片计数：(表名, 旧唯一键的 DROP 子句, 新唯一键的 ADD 子句)
+_SHARDED_COUNTER_MIGRATIONS = [
+    ('page_views', 'DROP PRIMARY KEY', 'ADD PRIMARY KEY (day, shard)'),
+    ('ad_clicks', 'DROP INDEX uk_ad_day', 'ADD UNIQUE KEY uk_ad_day_shard (ad_id, day, shard)'),
+    ('ad_impressions', 'DROP INDEX uk_ad_day', 'ADD UNIQUE KEY uk_ad_day_shard (ad_id, day, shard)'),
+]
+
+
+def _migrate_counter_shards(cur):
+    """为旧版计数表补充 shard 列并调整唯一键（已有数据全部归入 0 号分片）"""
+    for table, drop_key, add_key in _SHARDED_COUNTER_MIGRATIONS:
+        cur.execute(
+            "SELECT COUNT(*) as cnt FROM information_schema.COLUMNS WHERE TABLE_SCHEMA=%s AND TABLE_NAME=%s AND COLUMN_NAME='shard'",
+            (MYSQL_DB, table)
+        )
+        if cur.fetchone()['cnt'] == 0:
+            cur.execute(
+                f"ALTER TABLE {table} ADD COLUMN shard SMALLINT NOT NULL DEFAULT 0 AFTER day, {drop_key}, {add_key}"
+            )
+
+
+def _backfill_ad_stats(conn):
+    """首次创建 ad_stats 时由历史日计数回填
+
+    settings 中的标记与回填在同一事务中写入，多个 worker 同时启动时只有一个执行回填；
+    DELETE 与 INSERT ... SELECT 对涉及的行加锁，并发写入会等待回填提交，不会重复计数。
+    """
+    conn.begin()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("INSERT IGNORE INTO settings (k, v) VALUES ('ad_stats_backfilled', 'true')")
+            if cur.rowcount == 1:
+                # 整体重算：回填前其他 worker 已写入的增量同样包含在日计数中
+                cur.execute("DELETE FROM ad_stats")
+                cur.execute(
+                    """
+                    INSERT INTO ad_stats (ad_id, shard, impressions, clicks)
+                    SELECT ad_id, 0, SUM(impressions), SUM(clicks) FROM (
+                        SELECT ad_id, impressions, 0 AS clicks FROM ad_impressions
+                        UNION ALL
+                        SELECT ad_id, 0 AS impressions, clicks FROM ad_clicks WHERE ad_id IS NOT NULL
+                    ) t GROUP BY ad_id
+                    """
+                )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _pick_shard() -> int:
+    """随机选择计数分片，分散同一逻辑行上的行锁竞争"""
+    return random.randrange(COUNTER_SHARDS)
 
 
 # CRUD + 统计实现
 def create_ad(img_url: str, link: str, is_main: bool = False, x_redirect_enabled: bool = True):
     """创建广告"""
     now = datetime.now()
-    with DB_LOCK:
-        conn = get_conn()
+    with SERVING_POOL.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO ads (img_url, link, is_main, x_redirect_enabled, created_at) VALUES (%s, %s, %s, %s, %s)",
+                (img_url, link, 1 if is_main else 0, 1 if x_redirect_enabled else 0, now),
+            )
+            ad_id = cur.lastrowid
+            return ad_id
+
+
+def create_ads_bulk(ads):
+    """批量创建广告：分块多行 INSERT，整体一个事务，按输入顺序返回新广告 id
+
+    ads 为 [{img_url, link, is_main, x_redirect_enabled}]，img_url 须唯一（按 img_url 取回 id）。
+    """
+    if not ads:
+        return []
+    now = datetime.now()
+    rows = [
+        (ad['img_url'], ad['link'], 1 if ad['is_main'] else 0, 1 if ad['x_redirect_enabled'] else 0, now)
+        for ad in ads
+    ]
+    ids = {}
+    with SERVING_POOL.connection() as conn:
+        conn.begin()
         try:
             with conn.cursor() as cur:
-                cur.execute(
-                    "INSERT INTO ads (img_url, link, is_main, x_redirect_enabled, created_at) VALUES (%s, %s, %s, %s, %s)",
-                    (img_url, link, 1 if is_main else 0, 1 if x_redirect_enabled else 0, now),
-                )
-                ad_id = cur.lastrowid
-                return ad_id
-        finally:
-            conn.close()
+                # 显式分块，每块一条多行 INSERT：lastrowid 为该语句第一行的 id，以此限定主键范围（img_url 无索引）。
+                # 不用 executemany，它会按 max_stmt_length 自行拆分语句，lastrowid 只对应最后一条
+                for i in range(0, len(rows), BULK_INSERT_CHUNK):
+                    chunk = rows[i:i + BULK_INSERT_CHUNK]
+                    cur.execute(
+                        "INSERT INTO ads (img_url, link, is_main, x_redirect_enabled, created_at) VALUES "
+                        + ','.join(['(%s, %s, %s, %s, %s)'] * len(chunk)),
+                        [v for row in chunk for v in row]
+                    )
+                    placeholders = ','.join(['%s'] * len(chunk))
+                    cur.execute(f"SELECT id, img_url FROM ads WHERE id>=%s AND img_url IN ({placeholders})",
+                                [cur.lastrowid] + [row[0] for row in chunk])
+                    ids.update((r['img_url'], r['id']) for r in cur.fetchall())
+                missing = [ad['img_url'] for ad in ads if ad['img_url'] not in ids]
+                if missing:
+                    raise RuntimeError(f'failed to read back ids of {len(missing)} imported ads')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return [ids[ad['img_url']] for ad in ads]
 
 
 def list_ads(start: str = None, end: str = None, type_filter: str = None, status: str = None):
@@ -178,121 +582,211 @@ def list_ads(start: str = None, end: str = None, type_filter: str = None, status
         params.append(end)
     q += " ORDER BY created_at DESC"
     
-    with DB_LOCK:
-        conn = get_conn()
+    with _reporting_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(q, params)
+            rows = cur.fetchall()
+        totals = _ad_totals(conn, [r['id'] for r in rows])
+    for r in rows:
+        impressions, clicks = totals.get(r['id'], (0, 0))
+        r['impressions'] = impressions
+        r['clicks'] = clicks
+        r['ctr'] = _ctr(impressions, clicks)
+    return rows
+
+
+def _ctr(impressions: int, clicks: int):
+    """点击率（0~1）；无展示时为 None"""
+    return round(clicks / impressions, 6) if impressions else None
+
+
+def _ad_totals(conn, ad_ids=None):
+    """从 ad_stats 读取累计展示 / 点击：{ad_id: (impressions, clicks)}"""
+    q = "SELECT ad_id, SUM(impressions) AS impressions, SUM(clicks) AS clicks FROM ad_stats"
+    params = []
+    if ad_ids is not None:
+        if not ad_ids:
+            return {}
+        q += f" WHERE ad_id IN ({','.join(['%s'] * len(ad_ids))})"
+        params = list(ad_ids)
+    q += " GROUP BY ad_id"
+    with conn.cursor() as cur:
+        cur.execute(q, params)
+        return {r['ad_id']: (int(r['impressions']), int(r['clicks'])) for r in cur.fetchall()}
+
+
+def get_ad_ctr(start: str = None, end: str = None):
+    """各广告的展示、点击与 CTR，按 CTR 降序
+
+    不传日期时读取增量维护的 ad_stats（累计值）；传入日期区间时按日计数表汇总该区间。
+    """
+    with _reporting_connection() as conn:
+        if start is None and end is None:
+            totals = _ad_totals(conn)
+        else:
+            start = start or '1970-01-01'
+            end = end or '9999-12-31'
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT ad_id, SUM(impressions) AS impressions, SUM(clicks) AS clicks FROM (
+                        SELECT ad_id, impressions, 0 AS clicks FROM ad_impressions WHERE day BETWEEN %s AND %s
+                        UNION ALL
+                        SELECT ad_id, 0 AS impressions, clicks FROM ad_clicks WHERE day BETWEEN %s AND %s AND ad_id IS NOT NULL
+                    ) t GROUP BY ad_id
+                    """,
+                    (start, end, start, end)
+                )
+                totals = {r['ad_id']: (int(r['impressions']), int(r['clicks'])) for r in cur.fetchall()}
+        if not totals:
+            return []
+        with conn.cursor() as cur:
+            cur.execute(
+                f"SELECT id, img_url, link, is_main, status FROM ads WHERE id IN ({','.join(['%s'] * len(totals))})",
+                list(totals)
+            )
+            ads = {r['id']: r for r in cur.fetchall()}
+    rows = []
+    for ad_id, (impressions, clicks) in totals.items():
+        ad = ads.get(ad_id)
+        if ad is None:
+            continue
+        rows.append({
+            'ad_id': ad_id,
+            'img_url': ad['img_url'],
+            'link': ad['link'],
+            'is_main': ad['is_main'],
+            'status': ad['status'],
+            'impressions': impressions,
+            'clicks': clicks,
+            'ctr': _ctr(impressions, clicks),
+        })
+    rows.sort(key=lambda r: (r['ctr'] is None, -(r['ctr'] or 0), -r['impressions']))
+    return rows
+
+
+def list_active_ads():
+    """有效广告列表（读主库，用于编译投放配置快照，不受副本延迟影响）"""
+    with SERVING_POOL.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT * FROM ads WHERE status='active' ORDER BY created_at DESC")
+            return cur.fetchall()
+
+
+def list_active_targeting():
+    """有效广告的定向规则（读主库，用于编译投放配置快照）"""
+    with SERVING_POOL.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT t.ad_id, t.mode, t.pattern FROM ad_targeting t JOIN ads a ON a.id=t.ad_id WHERE a.status='active'"
+            )
+            return cur.fetchall()
+
+
+def get_ad_targeting(ad_id: int):
+    """某个广告的定向规则：{'include': [...], 'exclude': [...]}"""
+    with SERVING_POOL.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT mode, pattern FROM ad_targeting WHERE ad_id=%s ORDER BY pattern", (ad_id,))
+            rules = {'include': [], 'exclude': []}
+            for r in cur.fetchall():
+                rules[r['mode']].append(r['pattern'])
+            return rules
+
+
+def set_ad_targeting(ad_id: int, include, exclude):
+    """整体替换某个广告的定向规则（一个事务）"""
+    rows = [(ad_id, 'include', p) for p in include] + [(ad_id, 'exclude', p) for p in exclude]
+    with SERVING_POOL.connection() as conn:
+        conn.begin()
         try:
             with conn.cursor() as cur:
-                cur.execute(q, params)
-                rows = cur.fetchall()
-                return rows
-        finally:
-            conn.close()
+                cur.execute("DELETE FROM ad_targeting WHERE ad_id=%s", (ad_id,))
+                if rows:
+                    cur.executemany("INSERT INTO ad_targeting (ad_id, mode, pattern) VALUES (%s, %s, %s)", rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
 
 
 def get_ad(ad_id: int):
     """根据ID获取广告"""
-    with DB_LOCK:
-        conn = get_conn()
-        try:
-            with conn.cursor() as cur:
-                cur.execute("SELECT * FROM ads WHERE id=%s", (ad_id,))
-                row = cur.fetchone()
-                return row
-        finally:
-            conn.close()
+    with SERVING_POOL.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT * FROM ads WHERE id=%s", (ad_id,))
+            row = cur.fetchone()
+            return row
 
 
 def delete_ad(ad_id: int):
     """删除广告"""
-    with DB_LOCK:
-        conn = get_conn()
-        try:
-            with conn.cursor() as cur:
-                cur.execute("DELETE FROM ads WHERE id=%s", (ad_id,))
-        finally:
-            conn.close()
+    with SERVING_POOL.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM ads WHERE id=%s", (ad_id,))
+            cur.execute("DELETE FROM ad_targeting WHERE ad_id=%s", (ad_id,))
 
 
 def update_ad_status(ad_id: int, status: str):
     """更新广告状态"""
-    with DB_LOCK:
-        conn = get_conn()
-        try:
-            with conn.cursor() as cur:
-                cur.execute("UPDATE ads SET status=%s WHERE id=%s", (status, ad_id))
-        finally:
-            conn.close()
+    with SERVING_POOL.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("UPDATE ads SET status=%s WHERE id=%s", (status, ad_id))
 
 
 def update_ad_x_redirect(ad_id: int, enabled: bool):
     """更新广告X号重定向设置"""
-    with DB_LOCK:
-        conn = get_conn()
-        try:
-            with conn.cursor() as cur:
-                cur.execute("UPDATE ads SET x_redirect_enabled=%s WHERE id=%s", (1 if enabled else 0, ad_id))
-        finally:
-            conn.close()
+    with SERVING_POOL.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("UPDATE ads SET x_redirect_enabled=%s WHERE id=%s", (1 if enabled else 0, ad_id))
 
 
 def update_ad(ad_id: int, img_url=None, link=None, is_main=None, x_redirect_enabled=None):
     """更新广告信息"""
-    with DB_LOCK:
-        conn = get_conn()
-        try:
-            with conn.cursor() as cur:
-                # 构建动态更新语句
-                updates = []
-                params = []
-                
-                if img_url is not None:
-                    updates.append("img_url=%s")
-                    params.append(img_url)
-                if link is not None:
-                    updates.append("link=%s")
-                    params.append(link)
-                if is_main is not None:
-                    updates.append("is_main=%s")
-                    params.append(1 if is_main else 0)
-                if x_redirect_enabled is not None:
-                    updates.append("x_redirect_enabled=%s")
-                    params.append(1 if x_redirect_enabled else 0)
-                
-                if updates:
-                    params.append(ad_id)
-                    sql = f"UPDATE ads SET {', '.join(updates)} WHERE id=%s"
-                    cur.execute(sql, params)
-        finally:
-            conn.close()
+    with SERVING_POOL.connection() as conn:
+        with conn.cursor() as cur:
+            # 构建动态更新语句
+            updates = []
+            params = []
+            
+            if img_url is not None:
+                updates.append("img_url=%s")
+                params.append(img_url)
+            if link is not None:
+                updates.append("link=%s")
+                params.append(link)
+            if is_main is not None:
+                updates.append("is_main=%s")
+                params.append(1 if is_main else 0)
+            if x_redirect_enabled is not None:
+                updates.append("x_redirect_enabled=%s")
+                params.append(1 if x_redirect_enabled else 0)
+            
+            if updates:
+                params.append(ad_id)
+                sql = f"UPDATE ads SET {', '.join(updates)} WHERE id=%s"
+                cur.execute(sql, params)
 
 
 def get_setting(key: str, default: str = None):
     """读取单个设置项。返回字符串值或默认值。"""
-    with DB_LOCK:
-        conn = get_conn()
-        try:
-            with conn.cursor() as cur:
-                cur.execute("SELECT v FROM settings WHERE k=%s", (key,))
-                row = cur.fetchone()
-                if row and 'v' in row:
-                    return row['v']
-                return default
-        finally:
-            conn.close()
+    with SERVING_POOL.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT v FROM settings WHERE k=%s", (key,))
+            row = cur.fetchone()
+            if row and 'v' in row:
+                return row['v']
+            return default
 
 
 def set_setting(key: str, value: str):
     """写入单个设置项（字符串）。"""
-    with DB_LOCK:
-        conn = get_conn()
-        try:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "INSERT INTO settings (k, v) VALUES (%s, %s) ON DUPLICATE KEY UPDATE v=VALUES(v)",
-                    (key, value)
-                )
-        finally:
-            conn.close()
+    with SERVING_POOL.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO settings (k, v) VALUES (%s, %s) ON DUPLICATE KEY UPDATE v=VALUES(v)",
+                (key, value)
+            )
 
 
 def _to_bool(s: str, default: bool = True) -> bool:
@@ -333,344 +827,463 @@ def update_ad_settings(global_enabled: bool = None, main_enabled: bool = None, s
         set_setting('secondary_ad_once_per_day', 'true' if secondary_ad_once_per_day else 'false')
 
 
-def get_random_pair():
-    """获取随机的主广告和次要广告组合"""
-    # 读取设置
-    settings = get_ad_settings()
-    ge = settings['global_enabled']
-    me = settings['main_enabled']
-    se = settings['secondary_enabled']
-
-    if not ge:
-        # 全局关闭则均不返回
-        return {"main": None, "secondary": None}
-
-    with DB_LOCK:
-        conn = get_conn()
-        try:
-            with conn.cursor() as cur:
-                mains = []
-                secs = []
-                if me:
-                    cur.execute("SELECT * FROM ads WHERE is_main=1 AND status='active'")
-                    mains = cur.fetchall()
-                if se:
-                    cur.execute("SELECT * FROM ads WHERE is_main=0 AND status='active'")
-                    secs = cur.fetchall()
-        finally:
-            conn.close()
-
-    main = random.choice(mains) if mains else None
-    secondary = random.choice(secs) if secs else None
-    return {"main": main, "secondary": secondary}
-
-
-def record_page_view(day: str = None):
-    """记录页面访问量"""
-    day = day or datetime.now().date().isoformat()
-    with DB_LOCK:
-        conn = get_conn()
-        try:
-            with conn.cursor() as cur:
-                # 使用 INSERT ... ON DUPLICATE KEY UPDATE
-                cur.execute(
-                    "INSERT INTO page_views (day, count) VALUES (%s, 1) ON DUPLICATE KEY UPDATE count = count + 1", 
-                    (day,)
-                )
-        finally:
-            conn.close()
-
+def get_existing_ad_ids(ad_ids):
+    """返回 ad_ids 中实际存在的广告ID集合"""
+    ad_ids = list(set(ad_ids))
+    if not ad_ids:
+        return set()
+    placeholders = ', '.join(['%s'] * len(ad_ids))
+    with SERVING_POOL.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT id FROM ads WHERE id IN ({placeholders})", ad_ids)
+            return {r['id'] for r in cur.fetchall()}
 
 
+def apply_event_batch(batch, journal_offsets: dict = None):
+    """将 events.EventBatch 的聚合计数写入各统计表：每张表一条多行 upsert，整体一个事务
 
-def record_ad_click(ad_id: int, day: str = None):
-    """记录广告点击量"""
-    day = day or datetime.now().date().isoformat()
-    with DB_LOCK:
-        conn = get_conn()
-        try:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "INSERT INTO ad_clicks (ad_id, day, clicks) VALUES (%s, %s, 1) ON DUPLICATE KEY UPDATE clicks = clicks + 1", 
-                    (ad_id, day)
-                )
-        finally:
-            conn.close()
-
-
-
-
-def record_ad_click_by_domain_ip(ad_id: int, domain: str, ip: str, day: str = None):
-    """记录按域名和IP的广告点击量"""
-    day = day or datetime.now().date().isoformat()
-    with DB_LOCK:
-        conn = get_conn()
+    journal_offsets 为 {分段名: 偏移量}，与统计数据在同一事务中提交，保证 journal 记录恰好生效一次。
+    """
+    if not len(batch) and not journal_offsets:
+        return
+    with SERVING_POOL.connection() as conn:
+        conn.begin()
         try:
             with conn.cursor() as cur:
-                cur.execute(
-                    "INSERT INTO ad_clicks_by_domain_ip (ad_id, day, domain, ip, clicks) VALUES (%s, %s, %s, %s, 1) ON DUPLICATE KEY UPDATE clicks = clicks + 1", 
-                    (ad_id, day, domain, ip)
-                )
-        finally:
-            conn.close()
+                _upsert_event_batch(cur, batch)
+                if journal_offsets:
+                    now = datetime.now()
+                    cur.executemany(
+                        "INSERT INTO journal_offsets (segment, offset, updated_at) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE offset=VALUES(offset), updated_at=VALUES(updated_at)",
+                        [(name, offset, now) for name, offset in sorted(journal_offsets.items())]
+                    )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def get_journal_offsets():
+    """读取 journal 各分段的已消费偏移量"""
+    with SERVING_POOL.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT segment, offset FROM journal_offsets")
+            return {r['segment']: r['offset'] for r in cur.fetchall()}
+
+
+def delete_journal_offset(segment: str):
+    """删除已消费完并清理的分段偏移量"""
+    with SERVING_POOL.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM journal_offsets WHERE segment=%s", (segment,))
+
+
+def _upsert_event_batch(cur, batch):
+    """在给定游标上执行 EventBatch 的多行 upsert（不负责事务）
+
+    行按唯一键排序后写入，保证并发事务的加锁顺序一致，避免死锁；同一批次的计数行落在同一个分片。
+    """
+    shard = _pick_shard()
+    if batch.page_views:
+        cur.executemany(
+            "INSERT INTO page_views (day, shard, count) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE count = count + VALUES(count)",
+            [(day, shard, n) for day, n in sorted(batch.page_views.items())]
+        )
+    if batch.visitor_views:
+        cur.executemany(
+            "INSERT INTO visitor_views_by_domain_ip (day, domain, ip, visits) VALUES (%s, %s, %s, %s) ON DUPLICATE KEY UPDATE visits = visits + VALUES(visits)",
+            [(day, domain, ip, n) for (day, domain, ip), n in sorted(batch.visitor_views.items())]
+        )
+    if batch.ad_clicks:
+        cur.executemany(
+            "INSERT INTO ad_clicks (ad_id, day, shard, clicks) VALUES (%s, %s, %s, %s) ON DUPLICATE KEY UPDATE clicks = clicks + VALUES(clicks)",
+            [(ad_id, day, shard, n) for (ad_id, day), n in sorted(batch.ad_clicks.items())]
+        )
+    if batch.ad_clicks_by_domain_ip:
+        cur.executemany(
+            "INSERT INTO ad_clicks_by_domain_ip (ad_id, day, domain, ip, clicks) VALUES (%s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE clicks = clicks + VALUES(clicks)",
+            [(ad_id, day, domain, ip, n) for (ad_id, day, domain, ip), n in sorted(batch.ad_clicks_by_domain_ip.items())]
+        )
+    if batch.ad_impressions:
+        cur.executemany(
+            "INSERT INTO ad_impressions (ad_id, day, shard, impressions) VALUES (%s, %s, %s, %s) ON DUPLICATE KEY UPDATE impressions = impressions + VALUES(impressions)",
+            [(ad_id, day, shard, n) for (ad_id, day), n in sorted(batch.ad_impressions.items())]
+        )
+    if batch.page_views_hourly:
+        cur.executemany(
+            "INSERT INTO page_views_hourly (day, hour, shard, count) VALUES (%s, %s, %s, %s) ON DUPLICATE KEY UPDATE count = count + VALUES(count)",
+            [(day, hour, shard, n) for (day, hour), n in sorted(batch.page_views_hourly.items())]
+        )
+    if batch.ad_clicks_hourly:
+        cur.executemany(
+            "INSERT INTO ad_clicks_hourly (day, hour, ad_id, shard, clicks) VALUES (%s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE clicks = clicks + VALUES(clicks)",
+            [(day, hour, ad_id, shard, n) for (ad_id, day, hour), n in sorted(batch.ad_clicks_hourly.items(), key=lambda kv: (kv[0][1], kv[0][2], kv[0][0]))]
+        )
+    # 累计展示 / 点击随日计数一起增量更新，CTR 报表无需扫描日计数
+    ad_totals = {}
+    for (ad_id, _), n in batch.ad_impressions.items():
+        ad_totals.setdefault(ad_id, [0, 0])[0] += n
+    for (ad_id, _), n in batch.ad_clicks.items():
+        ad_totals.setdefault(ad_id, [0, 0])[1] += n
+    if ad_totals:
+        cur.executemany(
+            "INSERT INTO ad_stats (ad_id, shard, impressions, clicks) VALUES (%s, %s, %s, %s) ON DUPLICATE KEY UPDATE impressions = impressions + VALUES(impressions), clicks = clicks + VALUES(clicks)",
+            [(ad_id, shard, imps, clicks) for ad_id, (imps, clicks) in sorted(ad_totals.items())]
+        )
+
+
+def cancel_reporting_query(thread_ident: int) -> bool:
+    """取消报表线程正在执行的查询（客户端断开时调用）"""
+    cancelled = REPORTING_POOL.cancel_thread_query(thread_ident)
+    if REPLICA_POOL is not None:
+        cancelled = REPLICA_POOL.cancel_thread_query(thread_ident) or cancelled
+    return cancelled
+
+
+def _reporting_scalar(sql: str, params=None):
+    """在报表连接上执行返回单个值的查询"""
+    with _reporting_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            row = cur.fetchone()
+            return (list(row.values())[0] if row else None) or 0
+
+
+def _reporting_rows(sql: str, params=None):
+    """在报表连接上执行查询并返回所有行"""
+    with _reporting_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            return cur.fetchall()
+
+
+# 以下单查询函数各自占用一个报表连接，可被 /stats/dashboard 并发执行
+def get_total_views():
+    """累计页面访问量"""
+    return _reporting_scalar("SELECT SUM(count) as total_views FROM page_views")
+
+
+def get_total_clicks(is_main: bool = None):
+    """累计点击量；is_main 为 None 时不区分广告类型"""
+    if is_main is None:
+        return _reporting_scalar("SELECT SUM(clicks) as total_clicks FROM ad_clicks")
+    return _reporting_scalar(
+        "SELECT SUM(ad_clicks.clicks) as clicks FROM ad_clicks JOIN ads ON ads.id=ad_clicks.ad_id WHERE ads.is_main=%s",
+        (1 if is_main else 0,)
+    )
 
 
+def get_daily_page_views(start: str, end: str):
+    """按天的页面访问量"""
+    rows = _reporting_rows(
+        "SELECT DATE_FORMAT(day, '%%Y-%%m-%%d') as day, SUM(count) as count FROM page_views WHERE day BETWEEN %s AND %s GROUP BY day ORDER BY day", 
+        (start, end)
+    )
+    return [{'day': r['day'], 'count': r['count']} for r in rows]
+
+
+def get_daily_clicks(start: str, end: str, is_main: bool = None):
+    """按天的点击量；is_main 为 None 时不区分广告类型"""
+    if is_main is None:
+        rows = _reporting_rows(
+            "SELECT DATE_FORMAT(day, '%%Y-%%m-%%d') as day, SUM(clicks) as clicks FROM ad_clicks WHERE day BETWEEN %s AND %s GROUP BY day ORDER BY day", 
+            (start, end)
+        )
+    else:
+        rows = _reporting_rows(
+            "SELECT DATE_FORMAT(day, '%%Y-%%m-%%d') as day, SUM(ad_clicks.clicks) as clicks FROM ad_clicks JOIN ads ON ads.id=ad_clicks.ad_id WHERE ads.is_main=%s AND day BETWEEN %s AND %s GROUP BY day ORDER BY day", 
+            (1 if is_main else 0, start, end)
+        )
+    return [{'day': r['day'], 'clicks': r['clicks']} for r in rows]
+
+
+def get_hourly_stats(start: str, end: str):
+    """按小时的访问量与点击量（总数 / 主广告 / 次要广告），返回 {(day, hour): {...}}，只包含有数据的小时"""
+    result = {}
+
+    def bucket(r):
+        key = (r['day'], r['hour'])
+        if key not in result:
+            result[key] = {'page_views': 0, 'clicks': 0, 'main_clicks': 0, 'secondary_clicks': 0}
+        return result[key]
+
+    for r in _reporting_rows(
+        "SELECT DATE_FORMAT(day, '%%Y-%%m-%%d') as day, hour, SUM(count) as count FROM page_views_hourly WHERE day BETWEEN %s AND %s GROUP BY day, hour",
+        (start, end)
+    ):
+        bucket(r)['page_views'] = int(r['count'])
+    # 与日统计一致：总点击不关联 ads，主 / 次按当前广告类型区分
+    for r in _reporting_rows(
+        "SELECT DATE_FORMAT(c.day, '%%Y-%%m-%%d') as day, c.hour, ads.is_main, SUM(c.clicks) as clicks FROM ad_clicks_hourly c LEFT JOIN ads ON ads.id=c.ad_id WHERE c.day BETWEEN %s AND %s GROUP BY c.day, c.hour, ads.is_main",
+        (start, end)
+    ):
+        b = bucket(r)
+        b['clicks'] += int(r['clicks'])
+        if r['is_main'] is not None:
+            b['main_clicks' if r['is_main'] else 'secondary_clicks'] += int(r['clicks'])
+    return result
+
+
+def compact_hourly_stats(before_day: str, chunk: int = 10000) -> int:
+    """删除 before_day 之前的小时计数，返回删除的行数
+
+    这些日期的数据在 page_views / ad_clicks 中已有同一事务写入的日计数，按天 / 周统计不受影响；
+    分批删除，避免长时间持有大量行锁阻塞事件写入。
+    """
+    deleted = 0
+    with SERVING_POOL.connection() as conn:
+        with conn.cursor() as cur:
+            for table in ('page_views_hourly', 'ad_clicks_hourly'):
+                while True:
+                    cur.execute(f"DELETE FROM {table} WHERE day < %s LIMIT {int(chunk)}", (before_day,))
+                    deleted += cur.rowcount
+                    if cur.rowcount < chunk:
+                        break
+    return deleted
 
 
 def get_overview():
     """获取统计概览"""
-    with DB_LOCK:
-        conn = get_conn()
-        try:
-            with conn.cursor() as cur:
-                cur.execute("SELECT SUM(count) as total_views FROM page_views")
-                total_views = cur.fetchone().get('total_views') or 0
-                
-                cur.execute("SELECT SUM(clicks) as total_clicks FROM ad_clicks")
-                total_clicks = cur.fetchone().get('total_clicks') or 0
-                
-                cur.execute(
-                    "SELECT SUM(ad_clicks.clicks) as main_clicks FROM ad_clicks JOIN ads ON ads.id=ad_clicks.ad_id WHERE ads.is_main=1"
-                )
-                main_clicks = cur.fetchone().get('main_clicks') or 0
-                
-                cur.execute(
-                    "SELECT SUM(ad_clicks.clicks) as sec_clicks FROM ad_clicks JOIN ads ON ads.id=ad_clicks.ad_id WHERE ads.is_main=0"
-                )
-                sec_clicks = cur.fetchone().get('sec_clicks') or 0
-                
-                return {
-                    'total_views': total_views,
-                    'total_clicks': total_clicks,
-                    'main_clicks': main_clicks,
-                    'secondary_clicks': sec_clicks
-                }
-        finally:
-            conn.close()
-
-
+    return {
+        'total_views': get_total_views(),
+        'total_clicks': get_total_clicks(),
+        'main_clicks': get_total_clicks(is_main=True),
+        'secondary_clicks': get_total_clicks(is_main=False)
+    }
 
 
 def get_daily_stats(start: str, end: str):
     """获取日统计数据"""
-    with DB_LOCK:
-        conn = get_conn()
-        try:
-            with conn.cursor() as cur:
-                # 页面访问量
-                cur.execute(
-                    "SELECT DATE_FORMAT(day, '%%Y-%%m-%%d') as day, count FROM page_views WHERE day BETWEEN %s AND %s ORDER BY day", 
-                    (start, end)
-                )
-                pv = [{'day': r['day'], 'count': r['count']} for r in cur.fetchall()]
-                
-                # 总点击量
-                cur.execute(
-                    "SELECT DATE_FORMAT(day, '%%Y-%%m-%%d') as day, SUM(clicks) as clicks FROM ad_clicks WHERE day BETWEEN %s AND %s GROUP BY day ORDER BY day", 
-                    (start, end)
-                )
-                clicks = [{'day': r['day'], 'clicks': r['clicks']} for r in cur.fetchall()]
-                
-                # 主广告点击量
-                cur.execute(
-                    "SELECT DATE_FORMAT(day, '%%Y-%%m-%%d') as day, SUM(ad_clicks.clicks) as clicks FROM ad_clicks JOIN ads ON ads.id=ad_clicks.ad_id WHERE ads.is_main=1 AND day BETWEEN %s AND %s GROUP BY day ORDER BY day", 
-                    (start, end)
-                )
-                main = [{'day': r['day'], 'clicks': r['clicks']} for r in cur.fetchall()]
-                
-                # 次要广告点击量
-                cur.execute(
-                    "SELECT DATE_FORMAT(day, '%%Y-%%m-%%d') as day, SUM(ad_clicks.clicks) as clicks FROM ad_clicks JOIN ads ON ads.id=ad_clicks.ad_id WHERE ads.is_main=0 AND day BETWEEN %s AND %s GROUP BY day ORDER BY day", 
-                    (start, end)
-                )
-                sec = [{'day': r['day'], 'clicks': r['clicks']} for r in cur.fetchall()]
-                
-                return {
-                    'page_views': pv, 
-                    'clicks': clicks, 
-                    'main_clicks': main, 
-                    'secondary_clicks': sec
-                }
-        finally:
-            conn.close()
-
-
+    return {
+        'page_views': get_daily_page_views(start, end), 
+        'clicks': get_daily_clicks(start, end), 
+        'main_clicks': get_daily_clicks(start, end, is_main=True), 
+        'secondary_clicks': get_daily_clicks(start, end, is_main=False)
+    }
 
 
 def get_clicks_by_domain_ip(start: str, end: str, is_main: bool = True, page: int = 1, page_size: int = 10):
     """获取按域名和IP的点击统计数据"""
-    with DB_LOCK:
-        conn = get_conn()
-        try:
-            with conn.cursor() as cur:
-                # Get total count
-                cur.execute(
-                    """
-                    SELECT COUNT(*) as total
-                    FROM (
-                        SELECT 1
-                        FROM ad_clicks_by_domain_ip 
-                        JOIN ads ON ads.id = ad_clicks_by_domain_ip.ad_id 
-                        WHERE ads.is_main = %s AND day BETWEEN %s AND %s 
-                        GROUP BY domain, ip, day
-                    ) as grouped_data
-                    """,
-                    (1 if is_main else 0, start, end)
-                )
-                total = cur.fetchone()['total']
-
-                # Get paginated data
-                offset = (page - 1) * page_size
-                cur.execute(
-                    """
-                    SELECT 
-                        domain, 
-                        ip, 
-                        DATE_FORMAT(day, '%%Y-%%m-%%d') as day, 
-                        SUM(clicks) as clicks 
+    with _reporting_connection() as conn:
+        with conn.cursor() as cur:
+            # Get total count
+            cur.execute(
+                """
+                SELECT COUNT(*) as total
+                FROM (
+                    SELECT 1
                     FROM ad_clicks_by_domain_ip 
                     JOIN ads ON ads.id = ad_clicks_by_domain_ip.ad_id 
                     WHERE ads.is_main = %s AND day BETWEEN %s AND %s 
-                    GROUP BY domain, ip, day 
-                    ORDER BY day DESC, clicks DESC
-                    LIMIT %s OFFSET %s
-                    """, 
-                    (1 if is_main else 0, start, end, page_size, offset)
-                )
-                rows = cur.fetchall()
-                return {'data': rows, 'total': total}
-        finally:
-            conn.close()
+                    GROUP BY domain, ip, day
+                ) as grouped_data
+                """,
+                (1 if is_main else 0, start, end)
+            )
+            total = cur.fetchone()['total']
+
+            # Get paginated data
+            offset = (page - 1) * page_size
+            cur.execute(
+                """
+                SELECT 
+                    domain, 
+                    ip, 
+                    DATE_FORMAT(day, '%%Y-%%m-%%d') as day, 
+                    SUM(clicks) as clicks 
+                FROM ad_clicks_by_domain_ip 
+                JOIN ads ON ads.id = ad_clicks_by_domain_ip.ad_id 
+                WHERE ads.is_main = %s AND day BETWEEN %s AND %s 
+                GROUP BY domain, ip, day 
+                ORDER BY day DESC, clicks DESC
+                LIMIT %s OFFSET %s
+                """, 
+                (1 if is_main else 0, start, end, page_size, offset)
+            )
+            rows = cur.fetchall()
+            return {'data': rows, 'total': total}
 
 
+def get_visitors_by_domain_ip(start: str, end: str, page: int = 1, page_size: int = 10):
+    """获取按域名和IP的访客统计数据"""
+    with _reporting_connection() as conn:
+        with conn.cursor() as cur:
+             # 1. 获取总览数据
+            cur.execute(
+                """
+                SELECT
+                    SUM(visits) as total_visits,
+                    COUNT(DISTINCT domain) as distinct_domains,
+                    COUNT(DISTINCT ip) as distinct_ips
+                FROM visitor_views_by_domain_ip
+                WHERE day BETWEEN %s AND %s
+                """,
+                (start, end)
+            )
+            summary = cur.fetchone()
+            summary = {
+                'total_visits': summary.get('total_visits') or 0,
+                'distinct_domains': summary.get('distinct_domains') or 0,
+                'distinct_ips': summary.get('distinct_ips') or 0,
+            }
+
+            # 2. 获取总记录数
+            cur.execute(
+                """
+                SELECT COUNT(*) as total FROM (
+                    SELECT 1
+                    FROM visitor_views_by_domain_ip 
+                    WHERE day BETWEEN %s AND %s 
+                    GROUP BY domain, ip, day
+                ) as grouped_data
+                """,
+                (start, end)
+            )
+            total = cur.fetchone()['total']
+
+            # 3. 获取分页数据
+            offset = (page - 1) * page_size
+            cur.execute(
+                """
+                SELECT 
+                    domain, 
+                    ip, 
+                    DATE_FORMAT(day, '%%Y-%%m-%%d') as day, 
+                    SUM(visits) as visits 
+                FROM visitor_views_by_domain_ip 
+                WHERE day BETWEEN %s AND %s 
+                GROUP BY domain, ip, day 
+                ORDER BY day DESC, visits DESC
+                LIMIT %s OFFSET %s
+                """, 
+                (start, end, page_size, offset)
+            )
+            rows = cur.fetchall()
+            return {'data': rows, 'total': total, 'summary': summary}
+
+
+def get_visitor_distinct_values(start: str, end: str):
+    """区间内的去重域名、去重 IP 与总访问量（与归档部分合并计算去重数时使用）"""
+    with _reporting_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT DISTINCT domain FROM visitor_views_by_domain_ip WHERE day BETWEEN %s AND %s", (start, end))
+            domains = [r['domain'] for r in cur.fetchall()]
+            cur.execute("SELECT DISTINCT ip FROM visitor_views_by_domain_ip WHERE day BETWEEN %s AND %s", (start, end))
+            ips = [r['ip'] for r in cur.fetchall()]
+            cur.execute("SELECT SUM(visits) AS visits FROM visitor_views_by_domain_ip WHERE day BETWEEN %s AND %s", (start, end))
+            visits = int(cur.fetchone()['visits'] or 0)
+    return domains, ips, visits
+
+
+def get_domain_totals(start: str, end: str, metric: str = 'views'):
+    """区间内各域名的访问量或点击量合计：{domain: n}"""
+    if metric == 'views':
+        sql = "SELECT domain, SUM(visits) AS n FROM visitor_views_by_domain_ip WHERE day BETWEEN %s AND %s GROUP BY domain"
+    else:
+        sql = (
+            "SELECT domain, SUM(clicks) AS n FROM ad_clicks_by_domain_ip JOIN ads ON ads.id = ad_clicks_by_domain_ip.ad_id "
+            "WHERE day BETWEEN %s AND %s GROUP BY domain"
+        )
+    return {r['domain']: int(r['n']) for r in _reporting_rows(sql, (start, end))}
+
+
+# 列式归档导出（archive_job.py），使用独立连接，不受报表查询超时限制
+ARCHIVE_READ_TIMEOUT = 600
+
+
+def _export_rows(sql: str, params):
+    conn = get_conn(read_timeout=ARCHIVE_READ_TIMEOUT)
+    try:
+        with conn.cursor(pymysql.cursors.Cursor) as cur:
+            cur.execute(sql, params)
+            return list(cur.fetchall())
+    finally:
+        conn.close()
+
+
+def get_stats_first_day():
+    """统计表中最早的日期（YYYY-MM-DD），无数据时返回 None"""
+    rows = _export_rows(
+        """
+        SELECT MIN(d) FROM (
+            SELECT MIN(day) AS d FROM page_views
+            UNION ALL SELECT MIN(day) FROM ad_clicks
+            UNION ALL SELECT MIN(day) FROM ad_clicks_by_domain_ip
+            UNION ALL SELECT MIN(day) FROM visitor_views_by_domain_ip
+        ) t
+        """,
+        None
+    )
+    first = rows[0][0] if rows else None
+    return first.isoformat() if first else None
 
 
-def record_visitor_view_by_domain_ip(domain: str, ip: str, day: str = None):
-    """记录按域名和IP的访客访问量"""
-    day = day or datetime.now().date().isoformat()
-    with DB_LOCK:
-        conn = get_conn()
-        try:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "INSERT INTO visitor_views_by_domain_ip (day, domain, ip, visits) VALUES (%s, %s, %s, 1) ON DUPLICATE KEY UPDATE visits = visits + 1", 
-                    (day, domain, ip)
-                )
-        finally:
-            conn.close()
+def export_visitor_rows(day: str):
+    """某天的访客明细：[(domain, ip, visits)]"""
+    return _export_rows("SELECT domain, ip, visits FROM visitor_views_by_domain_ip WHERE day=%s", (day,))
 
 
-def get_visitors_by_domain_ip(start: str, end: str, page: int = 1, page_size: int = 10):
-    """获取按域名和IP的访客统计数据"""
-    with DB_LOCK:
-        conn = get_conn()
-        try:
-            with conn.cursor() as cur:
-                 # 1. 获取总览数据
-                cur.execute(
-                    """
-                    SELECT
-                        SUM(visits) as total_visits,
-                        COUNT(DISTINCT domain) as distinct_domains,
-                        COUNT(DISTINCT ip) as distinct_ips
-                    FROM visitor_views_by_domain_ip
-                    WHERE day BETWEEN %s AND %s
-                    """,
-                    (start, end)
-                )
-                summary = cur.fetchone()
-                summary = {
-                    'total_visits': summary.get('total_visits') or 0,
-                    'distinct_domains': summary.get('distinct_domains') or 0,
-                    'distinct_ips': summary.get('distinct_ips') or 0,
-                }
-
-                # 2. 获取总记录数
-                cur.execute(
-                    """
-                    SELECT COUNT(*) as total FROM (
-                        SELECT 1
-                        FROM visitor_views_by_domain_ip 
-                        WHERE day BETWEEN %s AND %s 
-                        GROUP BY domain, ip, day
-                    ) as grouped_data
-                    """,
-                    (start, end)
-                )
-                total = cur.fetchone()['total']
+def export_click_rows(day: str):
+    """某天按 (广告类型, 域名, IP) 汇总的点击：[(is_main, domain, ip, clicks)]"""
+    return _export_rows(
+        """
+        SELECT ads.is_main, c.domain, c.ip, SUM(c.clicks)
+        FROM ad_clicks_by_domain_ip c JOIN ads ON ads.id = c.ad_id
+        WHERE c.day=%s GROUP BY ads.is_main, c.domain, c.ip
+        """,
+        (day,)
+    )
 
-                # 3. 获取分页数据
-                offset = (page - 1) * page_size
-                cur.execute(
-                    """
-                    SELECT 
-                        domain, 
-                        ip, 
-                        DATE_FORMAT(day, '%%Y-%%m-%%d') as day, 
-                        SUM(visits) as visits 
-                    FROM visitor_views_by_domain_ip 
-                    WHERE day BETWEEN %s AND %s 
-                    GROUP BY domain, ip, day 
-                    ORDER BY day DESC, visits DESC
-                    LIMIT %s OFFSET %s
-                    """, 
-                    (start, end, page_size, offset)
-                )
-                rows = cur.fetchall()
-                return {'data': rows, 'total': total, 'summary': summary}
-        finally:
-            conn.close()
+
+def export_day_totals(day: str):
+    """某天的汇总计数，与 get_daily_page_views / get_daily_clicks 的口径一致"""
+    page_views = _export_rows("SELECT SUM(count) FROM page_views WHERE day=%s", (day,))[0][0]
+    clicks = _export_rows("SELECT SUM(clicks) FROM ad_clicks WHERE day=%s", (day,))[0][0]
+    by_type = dict(_export_rows(
+        "SELECT ads.is_main, SUM(ad_clicks.clicks) FROM ad_clicks JOIN ads ON ads.id=ad_clicks.ad_id WHERE day=%s GROUP BY ads.is_main",
+        (day,)
+    ))
+    return {
+        'page_views': int(page_views or 0),
+        'clicks': int(clicks or 0),
+        'main_clicks': int(by_type.get(1) or 0),
+        'secondary_clicks': int(by_type.get(0) or 0),
+    }
 
 
 # 域名黑名单管理
 def add_domain_to_blacklist(domain: str):
     """添加域名到黑名单"""
     now = datetime.now()
-    with DB_LOCK:
-        conn = get_conn()
-        try:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "INSERT IGNORE INTO domain_blacklist (domain, created_at) VALUES (%s, %s)",
-                    (domain, now)
-                )
-                return cur.rowcount > 0
-        finally:
-            conn.close()
+    with SERVING_POOL.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT IGNORE INTO domain_blacklist (domain, created_at) VALUES (%s, %s)",
+                (domain, now)
+            )
+            return cur.rowcount > 0
 
 
 def remove_domain_from_blacklist(domain_id: int):
     """从黑名单移除域名"""
-    with DB_LOCK:
-        conn = get_conn()
-        try:
-            with conn.cursor() as cur:
-                cur.execute("DELETE FROM domain_blacklist WHERE id=%s", (domain_id,))
-        finally:
-            conn.close()
+    with SERVING_POOL.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM domain_blacklist WHERE id=%s", (domain_id,))
 
 
 def list_blacklist_domains():
     """获取黑名单域名列表"""
-    with DB_LOCK:
-        conn = get_conn()
-        try:
-            with conn.cursor() as cur:
-                cur.execute("SELECT * FROM domain_blacklist ORDER BY created_at DESC")
-                rows = cur.fetchall()
-                return rows
-        finally:
-            conn.close()
+    with SERVING_POOL.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT * FROM domain_blacklist ORDER BY created_at DESC")
+            rows = cur.fetchall()
+            return rows
 
 
 def is_domain_blacklisted(domain: str):
     """检查域名是否在黑名单中"""
-    with DB_LOCK:
-        conn = get_conn()
-        try:
-            with conn.cursor() as cur:
-                cur.execute("SELECT COUNT(*) as cnt FROM domain_blacklist WHERE domain=%s", (domain,))
-                row = cur.fetchone()
-                return row['cnt'] > 0
-        finally:
-            conn.close()
\ No newline at end of file
+    with SERVING_POOL.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) as cnt FROM domain_blacklist WHERE domain=%s", (domain,))
+            row = cur.fetchone()
+            return row['cnt'] > 0
\ No newline at end of file
@@ -0,0 +1,118 @@
+"""
+埋点事件聚合
+
+将一批 page_view / impression / click 事件在内存中按各统计表的唯一键合并计数，
+再由 db.apply_event_batch 以每张表一条多行 upsert 的方式写入。
+"""
+
+from collections import namedtuple
+from datetime import datetime
+
+EVENT_PAGE_VIEW = 'page_view'
+EVENT_IMPRESSION = 'impression'
+EVENT_CLICK = 'click'
+EVENT_TYPES = (EVENT_PAGE_VIEW, EVENT_IMPRESSION, EVENT_CLICK)
+
+# 与统计表 domain / ip 列宽一致，超长的值截断后再入库，避免单个事件导致整批写入失败
+DOMAIN_MAX_LENGTH = 255
+IP_MAX_LENGTH = 64
+
+# 单个埋点事件；day 为事件发生日期（YYYY-MM-DD），hour 为发生的小时（0-23），均在接收时确定。
+# hour 为 None 的事件（旧版 journal 记录）只计入日计数
+Event = namedtuple('Event', ['type', 'ad_id', 'domain', 'ip', 'day', 'hour'], defaults=(None,))
+
+
+def _today() -> str:
+    return datetime.now().date().isoformat()
+
+
+def _now():
+    now = datetime.now()
+    return now.date().isoformat(), now.hour
+
+
+def clamp_domain(domain: str) -> str:
+    return domain[:DOMAIN_MAX_LENGTH] if domain else domain
+
+
+def clamp_ip(ip: str) -> str:
+    return ip[:IP_MAX_LENGTH] if ip else ip
+
+
+def page_view_event(domain: str, ip: str) -> Event:
+    return Event(EVENT_PAGE_VIEW, None, clamp_domain(domain), clamp_ip(ip), *_now())
+
+
+def impression_event(ad_id: int, domain: str, ip: str) -> Event:
+    return Event(EVENT_IMPRESSION, ad_id, clamp_domain(domain), clamp_ip(ip), *_now())
+
+
+def click_event(ad_id: int, domain: str, ip: str) -> Event:
+    return Event(EVENT_CLICK, ad_id, clamp_domain(domain), clamp_ip(ip), *_now())
+
+
+def _inc(counter: dict, key, n: int = 1):
+    counter[key] = counter.get(key, 0) + n
+
+
+class EventBatch:
+    """按表聚合的事件计数"""
+
+    def __init__(self):
+        # day -> count
+        self.page_views = {}
+        # (day, domain, ip) -> visits
+        self.visitor_views = {}
+        # (ad_id, day) -> clicks
+        self.ad_clicks = {}
+        # (ad_id, day, domain, ip) -> clicks
+        self.ad_clicks_by_domain_ip = {}
+        # (ad_id, day) -> impressions
+        self.ad_impressions = {}
+        # (day, hour) -> count
+        self.page_views_hourly = {}
+        # (ad_id, day, hour) -> clicks
+        self.ad_clicks_hourly = {}
+        self.size = 0
+
+    def add_page_view(self, domain: str, ip: str, day: str = None, hour: int = None):
+        if day is None:
+            day, hour = _now()
+        _inc(self.page_views, day)
+        _inc(self.visitor_views, (day, domain, ip))
+        if hour is not None:
+            _inc(self.page_views_hourly, (day, hour))
+        self.size += 1
+
+    def add_click(self, ad_id: int, domain: str, ip: str, day: str = None, hour: int = None):
+        if day is None:
+            day, hour = _now()
+        _inc(self.ad_clicks, (ad_id, day))
+        _inc(self.ad_clicks_by_domain_ip, (ad_id, day, domain, ip))
+        if hour is not None:
+            _inc(self.ad_clicks_hourly, (ad_id, day, hour))
+        self.size += 1
+
+    def add_impression(self, ad_id: int, day: str = None):
+        day = day or _today()
+        _inc(self.ad_impressions, (ad_id, day))
+        self.size += 1
+
+    def add(self, event: Event):
+        if event.type == EVENT_PAGE_VIEW:
+            self.add_page_view(event.domain, event.ip, event.day, event.hour)
+        elif event.type == EVENT_IMPRESSION:
+            self.add_impression(event.ad_id, event.day)
+        elif event.type == EVENT_CLICK:
+            self.add_click(event.ad_id, event.domain, event.ip, event.day, event.hour)
+
+    def __len__(self):
+        return self.size
+
+
+def aggregate(events) -> EventBatch:
+    """将事件列表聚合为 EventBatch"""
+    batch = EventBatch()
+    for e in events:
+        batch.add(e)
+    return batch
@@ -0,0 +1,98 @@
+"""
+服务端广告频率控制
+
+按 (day, ip, domain, slot) 记录“今日已展示”，使用按天轮换的内存 Bloom 过滤器，
+不访问数据库。Bloom 过滤器只会误判为“已展示”（少量多余的封顶），不会漏判。
+
+过滤器保存在各进程的内存中，不跨进程共享：多 worker 部署时封顶只在单个 worker 内成立，
+同一访客的请求落到不同 worker 时，每个 worker 每天各可能展示一次。
+"""
+
+import os
+import math
+import hashlib
+import threading
+from datetime import datetime
+
+# 每日预计的不同 (ip, domain, slot) 数量与可接受误判率
+FREQCAP_EXPECTED_ITEMS = int(os.environ.get('FREQCAP_EXPECTED_ITEMS', 1000000))
+FREQCAP_FALSE_POSITIVE_RATE = float(os.environ.get('FREQCAP_FALSE_POSITIVE_RATE', 0.001))
+
+SLOT_MAIN = 'main'
+SLOT_SECONDARY = 'secondary'
+
+
+class BloomFilter:
+    """定长位数组 + k 个哈希（双重哈希）的 Bloom 过滤器"""
+
+    def __init__(self, expected_items: int, fp_rate: float):
+        n = max(1, expected_items)
+        m = int(-n * math.log(fp_rate) / (math.log(2) ** 2))
+        self.num_bits = max(8, m)
+        self.num_hashes = max(1, int(round(self.num_bits / n * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key: str) -> bool:
+        """加入 key，返回加入前是否（可能）已存在"""
+        existed = True
+        for pos in self._positions(key):
+            byte, bit = divmod(pos, 8)
+            mask = 1 << bit
+            if not self.bits[byte] & mask:
+                existed = False
+                self.bits[byte] |= mask
+        return existed
+
+    def __contains__(self, key: str) -> bool:
+        for pos in self._positions(key):
+            byte, bit = divmod(pos, 8)
+            if not self.bits[byte] & (1 << bit):
+                return False
+        return True
+
+
+class FrequencyCapper:
+    """按天轮换的频率控制器：只保留当天的 Bloom 过滤器，日期变化时换新"""
+
+    def __init__(self, expected_items: int = FREQCAP_EXPECTED_ITEMS,
+                 fp_rate: float = FREQCAP_FALSE_POSITIVE_RATE):
+        self.expected_items = expected_items
+        self.fp_rate = fp_rate
+        self._day = None
+        self._filter = None
+        self._lock = threading.Lock()
+
+    def _filter_for(self, day: str) -> BloomFilter:
+        if day != self._day:
+            self._day = day
+            self._filter = BloomFilter(self.expected_items, self.fp_rate)
+        return self._filter
+
+    @staticmethod
+    def _key(ip: str, domain: str, slot: str) -> str:
+        return f"{ip}|{domain}|{slot}"
+
+    def is_capped(self, ip: str, domain: str, slot: str, day: str = None) -> bool:
+        """该访客今日是否已展示过该广告位"""
+        day = day or datetime.now().date().isoformat()
+        with self._lock:
+            return day == self._day and self._key(ip, domain, slot) in self._filter
+
+    def mark_shown(self, ip: str, domain: str, slot: str, day: str = None):
+        """记录该访客今日已展示该广告位"""
+        day = day or datetime.now().date().isoformat()
+        with self._lock:
+            if self._day is not None and day < self._day:
+                # 已过去的日期不再需要记录，也不能让它换掉当天的过滤器
+                return
+            self._filter_for(day).add(self._key(ip, domain, slot))
+
+
+capper = FrequencyCapper()
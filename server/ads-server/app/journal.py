@@ -0,0 +1,281 @@
+"""
+埋点事件本地追加日志（journal）
+
+开启后，/events/* 不再直接写 MySQL，而是把事件编码为紧凑的二进制记录追加到本地分段文件，
+由后台线程批量 fsync（group commit）后返回。独立的消费进程（journal_consumer.py）读取分段、
+聚合后写入统计表，并在同一事务中记录每个分段的消费偏移量，保证每条记录恰好生效一次。
+
+文件布局：JOURNAL_DIR/<writer>-<序号>.seg，每个写入进程一个 writer 前缀，互不交叉。
+记录格式：<payload 长度 u32><crc32 u32><payload>，
+payload = <类型 u8><日期序数 u32><ad_id i64><domain 长度 u16><domain><ip 长度 u8><ip>，
+其中日期序数的低 24 位为日期，高 8 位为小时 + 1（旧版记录为 0，即不带小时）。
+"""
+
+import os
+import time
+import uuid
+import zlib
+import struct
+import logging
+import threading
+from datetime import date
+
+import pymysql
+
+from . import db
+from .events import Event, EVENT_TYPES, EventBatch, aggregate, clamp_domain, clamp_ip
+from .breaker import is_db_unavailable
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+
+JOURNAL_ENABLED = os.environ.get('EVENT_JOURNAL_ENABLED', 'false').lower() in ('1', 'true', 'yes', 'on')
+JOURNAL_DIR = os.environ.get('EVENT_JOURNAL_DIR', os.path.join(BASE_DIR, 'data', 'journal'))
+# 单个分段文件的最大字节数，超过后切换到新分段
+JOURNAL_SEGMENT_BYTES = int(os.environ.get('EVENT_JOURNAL_SEGMENT_BYTES', 64 * 1024 * 1024))
+# group commit 间隔：在此时间内到达的追加共用一次 fsync
+JOURNAL_COMMIT_INTERVAL = float(os.environ.get('EVENT_JOURNAL_COMMIT_MS', 5)) / 1000
+# 分段在该秒数内无写入且已读完，即视为已封闭（用于写入进程退出后的最后一个分段）
+JOURNAL_SEAL_SECONDS = float(os.environ.get('EVENT_JOURNAL_SEAL_SECONDS', 300))
+
+SEGMENT_SUFFIX = '.seg'
+
+_HEADER = struct.Struct('<II')
+_FIXED = struct.Struct('<BIqH')
+_TYPE_CODES = {t: i for i, t in enumerate(EVENT_TYPES)}
+_DAY_MASK = 0xFFFFFF
+_HOUR_SHIFT = 24
+
+
+def encode_event(event: Event) -> bytes:
+    # 按统计表列宽截断，超长记录写入 MySQL 时会失败
+    domain = clamp_domain(event.domain or '').encode('utf-8')
+    ip = clamp_ip(event.ip or '').encode('utf-8')[:255]
+    day = date.fromisoformat(event.day).toordinal()
+    if event.hour is not None:
+        day |= (event.hour + 1) << _HOUR_SHIFT
+    payload = (
+        _FIXED.pack(_TYPE_CODES[event.type], day,
+                    event.ad_id if event.ad_id is not None else -1, len(domain))
+        + domain + bytes([len(ip)]) + ip
+    )
+    return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_event(payload: bytes) -> Event:
+    type_code, day_ordinal, ad_id, domain_len = _FIXED.unpack_from(payload, 0)
+    pos = _FIXED.size
+    domain = payload[pos:pos + domain_len].decode('utf-8', 'replace')
+    pos += domain_len
+    ip_len = payload[pos]
+    ip = payload[pos + 1:pos + 1 + ip_len].decode('utf-8', 'replace')
+    hour = (day_ordinal >> _HOUR_SHIFT) - 1
+    # 旧版记录可能带有超长的值，读取时同样截断
+    return Event(EVENT_TYPES[type_code], ad_id if ad_id >= 0 else None, clamp_domain(domain), clamp_ip(ip),
+                 date.fromordinal(day_ordinal & _DAY_MASK).isoformat(), hour if hour >= 0 else None)
+
+
+def read_records(path: str, offset: int, max_records: int):
+    """从分段的 offset 开始读取完整且校验通过的记录，返回 (事件列表, 新偏移量)
+
+    遇到不完整或校验失败的记录（写入中或崩溃残留的尾部）即停止。
+    """
+    events = []
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while len(events) < max_records:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                break
+            length, crc = _HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            events.append(decode_event(payload))
+            offset += _HEADER.size + length
+    return events, offset
+
+
+def list_segments(directory: str = JOURNAL_DIR):
+    """按 writer 分组返回分段文件名（组内按序号排序）"""
+    groups = {}
+    if not os.path.isdir(directory):
+        return groups
+    for name in os.listdir(directory):
+        if not name.endswith(SEGMENT_SUFFIX):
+            continue
+        writer, _, seq = name[:-len(SEGMENT_SUFFIX)].rpartition('-')
+        if writer and seq.isdigit():
+            groups.setdefault(writer, []).append(name)
+    for names in groups.values():
+        names.sort()
+    return groups
+
+
+class JournalWriter:
+    """单进程的分段追加写入器，append 在事件落盘（fsync）后返回"""
+
+    def __init__(self, directory: str = JOURNAL_DIR, segment_bytes: int = JOURNAL_SEGMENT_BYTES,
+                 commit_interval: float = JOURNAL_COMMIT_INTERVAL):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.commit_interval = commit_interval
+        self.writer_id = f"{os.getpid()}_{uuid.uuid4().hex[:8]}"
+        self._seq = 0
+        self._file = None
+        self._open_next_segment()
+
+        self._cond = threading.Condition()
+        self._pending = []
+        self._thread = threading.Thread(target=self._run, name='journal-writer', daemon=True)
+        self._thread.start()
+
+    def _open_next_segment(self):
+        if self._file:
+            self._file.close()
+        self._seq += 1
+        name = f"{self.writer_id}-{self._seq:08d}{SEGMENT_SUFFIX}"
+        self._file = open(os.path.join(self.directory, name), 'ab')
+
+    def append(self, events):
+        """追加事件，阻塞至本批次 fsync 完成；写盘失败时抛出 OSError"""
+        entry = {'data': b''.join(encode_event(e) for e in events), 'done': False, 'error': None}
+        with self._cond:
+            self._pending.append(entry)
+            self._cond.notify_all()
+            while not entry['done']:
+                self._cond.wait()
+        if entry['error']:
+            raise entry['error']
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            # 等待一个提交间隔，让并发到达的追加合并到同一次 fsync
+            time.sleep(self.commit_interval)
+            with self._cond:
+                entries, self._pending = self._pending, []
+            error = None
+            try:
+                self._file.write(b''.join(e['data'] for e in entries))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                if self._file.tell() >= self.segment_bytes:
+                    self._open_next_segment()
+            except OSError as e:
+                error = e
+                # 写入失败的分段尾部可能不完整，切换到新分段继续
+                try:
+                    self._open_next_segment()
+                except OSError:
+                    pass
+            with self._cond:
+                for e in entries:
+                    e['done'] = True
+                    e['error'] = error
+                self._cond.notify_all()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> JournalWriter:
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = JournalWriter()
+    return _writer
+
+
+def _writer_alive(segment_name: str) -> bool:
+    """分段的写入进程是否仍在运行（writer 前缀以 pid 开头，journal 只在本机读写）"""
+    pid = segment_name.split('_', 1)[0]
+    if not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JournalConsumer:
+    """读取分段并写入统计表；偏移量与统计数据在同一事务中提交（恰好一次）"""
+
+    def __init__(self, directory: str = JOURNAL_DIR, max_records: int = 10000,
+                 seal_seconds: float = JOURNAL_SEAL_SECONDS):
+        self.directory = directory
+        self.max_records = max_records
+        self.seal_seconds = seal_seconds
+
+    def run_once(self) -> int:
+        """处理一轮所有分段，返回写入的事件数"""
+        offsets = db.get_journal_offsets()
+        applied = 0
+        for names in list_segments(self.directory).values():
+            for i, name in enumerate(names):
+                path = os.path.join(self.directory, name)
+                offset = offsets.get(name, 0)
+                while True:
+                    events, new_offset = read_records(path, offset, self.max_records)
+                    if not events:
+                        break
+                    try:
+                        db.apply_event_batch(aggregate(events), journal_offsets={name: new_offset})
+                        applied += len(events)
+                        offset = new_offset
+                    except Exception as e:
+                        if is_db_unavailable(e) or isinstance(e, pymysql.err.OperationalError):
+                            # 数据库不可用或锁冲突：不跳过记录，交给上层重试
+                            raise
+                        # 数据错误通常只由个别记录引起：逐条重试，跳过无法写入的记录
+                        logger.exception('failed to apply %d records of %s, retrying one by one', len(events), name)
+                        applied += self._apply_one_by_one(path, name, offset, new_offset)
+                        offset = new_offset
+                # 后续已有新分段（写入方已切换），或写入进程已退出且长时间无写入，且已读到末尾：分段已封闭，可删除
+                has_next = i < len(names) - 1
+                abandoned = (time.time() - os.path.getmtime(path) > self.seal_seconds
+                             and not _writer_alive(name))
+                if (has_next or abandoned) and not read_records(path, offset, 1)[0]:
+                    # 先删文件再删偏移量：崩溃时最多残留一条无用的偏移量记录，不会重复计数
+                    os.remove(path)
+                    db.delete_journal_offset(name)
+        return applied
+
+    def _apply_one_by_one(self, path: str, name: str, offset: int, end: int) -> int:
+        """逐条写入 [offset, end) 之间的记录，每条与其偏移量在同一事务中提交；
+        无法写入的记录记录日志后只提交偏移量，避免卡住整个分段"""
+        applied = 0
+        while offset < end:
+            events, next_offset = read_records(path, offset, 1)
+            try:
+                db.apply_event_batch(aggregate(events), journal_offsets={name: next_offset})
+                applied += 1
+            except Exception as e:
+                if is_db_unavailable(e) or isinstance(e, pymysql.err.OperationalError):
+                    raise
+                logger.exception('skipping journal record %s@%d: %r', name, offset, events[0])
+                db.apply_event_batch(EventBatch(), journal_offsets={name: next_offset})
+            offset = next_offset
+        return applied
+
+    def run_forever(self, poll_interval: float = 1.0):
+        while True:
+            try:
+                applied = self.run_once()
+            except Exception as e:
+                if not (is_db_unavailable(e) or isinstance(e, pymysql.err.OperationalError)):
+                    raise
+                # 数据库不可用或锁冲突：偏移量未提交，稍后从断点重试
+                logger.warning('journal consumer retrying after database error: %s', e)
+                applied = 0
+            if not applied:
+                time.sleep(poll_interval)
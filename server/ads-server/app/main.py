@@ -1,20 +1,40 @@
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, RedirectResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 import os
+import asyncio
+import logging
+import orjson
 import uuid
-from typing import Optional
-from pydantic import BaseModel
+from typing import List, Literal, Optional
+from datetime import date, timedelta
+from pydantic import BaseModel, TypeAdapter, ValidationError
 from urllib.parse import urlparse
 
 from . import db
+from .freqcap import capper, SLOT_MAIN, SLOT_SECONDARY
+from .ratelimit import limiter, click_deduper
+from .events import page_view_event, impression_event, click_event, EVENT_PAGE_VIEW, EVENT_IMPRESSION, EVENT_CLICK, DOMAIN_MAX_LENGTH
+from . import journal
+from .snapshot import store as snapshot_store
+from . import bulkhead
+from . import bulkimport
+from .targeting import normalize_pattern, normalize_domain
+from .breaker import breaker, spill_queue, write_events, CircuitOpenError, DB_UNAVAILABLE_ERRORS, is_db_unavailable
+from .coalesce import coalescer
+from . import sketch
+from . import reports
+from . import timeseries
+
+logger = logging.getLogger(__name__)
 
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 UPLOAD_DIR = os.path.join(BASE_DIR, 'static', 'uploads')
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-app = FastAPI(title="广告后台 API")
+app = FastAPI(title="广告后台 API", default_response_class=ORJSONResponse)
 
 # 添加CORS中间件 - 修复跨域访问问题
 app.add_middleware(
@@ -72,7 +92,27 @@ class DomainIn(BaseModel):
 
 @app.on_event('startup')
 def startup():
-    db.init_db()
+    bulkhead.configure_serving_threads()
+    try:
+        db.init_db()
+        # 启动时重新编译投放配置快照，确保与数据库一致
+        snapshot_store.publish()
+    except Exception as e:
+        if not is_db_unavailable(e):
+            raise
+        # 数据库不可用时降级启动：投放使用磁盘上的最后可用快照，事件进入溢出队列
+        logger.warning('database unavailable at startup, serving from last snapshot: %s', e)
+        breaker.record_failure(e)
+    spill_queue.start()
+    coalescer.start()
+    sketch.store.start()
+
+
+@app.on_event('shutdown')
+def shutdown():
+    # 退出前写入合并缓冲区中尚未写入的事件，并保存热门统计摘要
+    coalescer.flush()
+    sketch.store.persist()
 
 
 @app.post('/ads/upload', response_model=UploadResponse)
@@ -92,42 +132,82 @@ async def upload_ad(
     # img_url could be a static path
     img_url = f"/static/uploads/{fname}"
     ad_id = db.create_ad(img_url=img_url, link=link, is_main=is_main, x_redirect_enabled=x_redirect_enabled)
+    snapshot_store.publish()
     return {'id': ad_id}
 
 
+@app.post('/ads/import')
+async def import_ads(file: UploadFile = File(...)):
+    """批量导入广告：zip 内含图片与 manifest.csv / manifest.json，返回逐条结果"""
+    def run_import():
+        items = bulkimport.import_zip(file.file, UPLOAD_DIR, '/static/uploads')
+        if any(item['id'] is not None for item in items):
+            snapshot_store.publish()
+        return items
+
+    try:
+        # 上传内容已落在临时文件中，解压、入库和重新发布快照都放到线程池，不阻塞事件循环
+        items = await run_in_threadpool(run_import)
+    except bulkimport.InvalidImport as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    created = sum(1 for item in items if item['id'] is not None)
+    return {'created': created, 'failed': len(items) - created, 'items': items}
+
+
 @app.get('/ads')
-def list_ads(start: Optional[str]=None, end: Optional[str]=None, type: Optional[str]=None, status: Optional[str]=None):
-    rows = db.list_ads(start=start, end=end, type_filter=type, status=status)
+async def list_ads(request: Request, start: Optional[str]=None, end: Optional[str]=None, type: Optional[str]=None, status: Optional[str]=None):
+    rows = await bulkhead.reporting.run(request, db.list_ads, start=start, end=end, type_filter=type, status=status)
     return {'data': rows}
 
 
+_BLACKLISTED_RESPONSE = orjson.dumps({
+    'code': 200,
+    'msg': 'domain blacklisted',
+    'data': {'main': None, 'secondary': None}
+})
+
+
+def _pair_response(snap, msg: bytes, main=None, secondary=None) -> Response:
+    """用快照中预先序列化的广告与设置片段拼接 random_pair 响应"""
+    body = b''.join((
+        b'{"code":200,"msg":"', msg, b'","data":{"main":',
+        snap.ad_json[main['id']] if main else b'null',
+        b',"secondary":',
+        snap.ad_json[secondary['id']] if secondary else b'null',
+        b'},"settings":', snap.settings_json, b'}',
+    ))
+    return Response(content=body, media_type='application/json')
+
+
 @app.get('/ads/random_pair')
 def random_pair(domain: Optional[str] = None, request: Request = None):
     # 获取域名（优先从参数，其次从请求头）
     if not domain:
         domain = extract_domain_from_headers(request) if request else 'unknown'
     
+    # 投放配置全部来自共享快照，不查询数据库
+    snap = snapshot_store.current()
+
     # 检查域名是否在黑名单中
-    if domain and domain != 'unknown' and db.is_domain_blacklisted(domain):
-        return {
-            'code': 200,
-            'msg': 'domain blacklisted',
-            'data': {'main': None, 'secondary': None}
-        }
+    if domain and domain != 'unknown' and snap.is_domain_blacklisted(domain):
+        return Response(content=_BLACKLISTED_RESPONSE, media_type='application/json')
     
     # 获取广告设置（包括频率控制）
-    settings = db.get_ad_settings()
-    
-    pair = db.get_random_pair()
-    return {
-        'code': 200,
-        'msg': 'success',
-        'data': pair,
-        'settings': {
-            'main_ad_once_per_day': settings['main_ad_once_per_day'],
-            'secondary_ad_once_per_day': settings['secondary_ad_once_per_day'],
-        }
-    }
+    settings = snap.settings
+
+    # 服务端频率控制：今日已展示过的广告位直接跳过，不再选取广告
+    client_ip = extract_client_ip(request) if request else 'unknown'
+    want_main = not (settings['main_ad_once_per_day'] and capper.is_capped(client_ip, domain, SLOT_MAIN))
+    want_secondary = not (settings['secondary_ad_once_per_day'] and capper.is_capped(client_ip, domain, SLOT_SECONDARY))
+    if not want_main and not want_secondary:
+        return _pair_response(snap, b'frequency capped')
+
+    pair = snap.random_pair(want_main=want_main, want_secondary=want_secondary, domain=domain)
+    if settings['main_ad_once_per_day'] and pair['main']:
+        capper.mark_shown(client_ip, domain, SLOT_MAIN)
+    if settings['secondary_ad_once_per_day'] and pair['secondary']:
+        capper.mark_shown(client_ip, domain, SLOT_SECONDARY)
+    return _pair_response(snap, b'success', pair['main'], pair['secondary'])
 
 
 @app.get('/ads/settings', response_model=AdSettingsOut)
@@ -147,6 +227,7 @@ def patch_ad_settings(payload: AdSettingsPatch):
         main_ad_once_per_day=payload.main_ad_once_per_day,
         secondary_ad_once_per_day=payload.secondary_ad_once_per_day,
     )
+    snapshot_store.publish()
     return {'ok': True}
 
 
@@ -158,6 +239,7 @@ def patch_status(ad_id: int, payload: StatusUpdate):
     if payload.status not in ('active', 'inactive'):
         raise HTTPException(status_code=400, detail='invalid status')
     db.update_ad_status(ad_id, payload.status)
+    snapshot_store.publish()
     return {'ok': True}
 
 
@@ -182,11 +264,13 @@ async def update_ad(
     
     # 更新广告信息
     db.update_ad(ad_id, img_url=img_url, link=link, is_main=is_main, x_redirect_enabled=x_redirect_enabled)
+    snapshot_store.publish()
     return {'ok': True}
 
 @app.delete('/ads/{ad_id}')
 def remove_ad(ad_id: int):
     db.delete_ad(ad_id)
+    snapshot_store.publish()
     return {'ok': True}
 
 
@@ -197,22 +281,114 @@ class XRedirectUpdate(BaseModel):
 @app.patch('/ads/{ad_id}/x_redirect')
 def patch_x_redirect(ad_id: int, payload: XRedirectUpdate):
     db.update_ad_x_redirect(ad_id, payload.enabled)
+    snapshot_store.publish()
     return {'ok': True}
 
 
+class TargetingIn(BaseModel):
+    """广告定向规则：精确域名或 *.example.com"""
+    include: List[str] = []
+    exclude: List[str] = []
+
+
+@app.get('/ads/{ad_id}/targeting')
+def get_ad_targeting(ad_id: int):
+    if not db.get_ad(ad_id):
+        raise HTTPException(status_code=404, detail='ad not found')
+    return db.get_ad_targeting(ad_id)
+
+
+@app.put('/ads/{ad_id}/targeting')
+def put_ad_targeting(ad_id: int, payload: TargetingIn):
+    """整体替换广告的定向规则，并重新编译投放配置快照"""
+    if not db.get_ad(ad_id):
+        raise HTTPException(status_code=404, detail='ad not found')
+    try:
+        include = sorted({normalize_pattern(p) for p in payload.include})
+        exclude = sorted({normalize_pattern(p) for p in payload.exclude})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    db.set_ad_targeting(ad_id, include, exclude)
+    snapshot_store.publish()
+    return {'include': include, 'exclude': exclude}
+
+
 @app.post('/events/page_view')
 def page_view(request: Request):
     # 获取域名和IP
     domain = extract_domain_from_headers(request)
     client_ip = extract_client_ip(request)
+
+    # 超过单 IP 限流阈值的事件直接丢弃，不写库
+    if not limiter.hit(client_ip):
+        return JSONResponse(status_code=429, content={'ok': False, 'dropped': 'rate_limited'})
     
     # 双写：保持原有统计 + 新增按域名IP统计
-    db.record_page_view()
-    db.record_visitor_view_by_domain_ip(domain, client_ip)
+    record_events([page_view_event(domain, client_ip)])
     
     return {'ok': True}
 
 
+# 1x1 透明 GIF
+_PIXEL_GIF = (
+    b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00'
+    b',\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;'
+)
+_PIXEL_HEADERS = {
+    'Cache-Control': 'no-store, no-cache, must-revalidate, private',
+    'Pragma': 'no-cache',
+    'Expires': '0',
+}
+
+
+def _pixel_domain(d: Optional[str]) -> Optional[str]:
+    """规范化像素请求中客户端提供的域名（小写、去端口、截断到列宽），为空或含非法字符时返回 None"""
+    domain = normalize_domain(d)[:DOMAIN_MAX_LENGTH]
+    if not domain or '/' in domain or any(c.isspace() or not c.isprintable() for c in domain):
+        return None
+    return domain
+
+
+@app.get('/events/pixel.gif')
+def page_view_pixel(request: Request, d: Optional[str] = None):
+    """图片像素方式记录页面访问：简单 GET 请求，不触发 CORS 预检
+
+    d 为页面域名（可选，缺省或不合法时从请求头提取）；被限流时同样返回像素，只是不计数。
+    """
+    domain = _pixel_domain(d) or extract_domain_from_headers(request)
+    client_ip = extract_client_ip(request)
+    if limiter.hit(client_ip):
+        record_events([page_view_event(domain, client_ip)])
+    return Response(content=_PIXEL_GIF, media_type='image/gif', headers=_PIXEL_HEADERS)
+
+
+def record_events(events):
+    """写入埋点事件：开启 journal 时追加到本地日志（由消费进程入库），否则合并后批量写库
+
+    数据库不可用时事件暂存到本地有界队列，恢复后由后台线程补写。
+    """
+    if not events:
+        return
+    sketch.store.observe(events)
+    if journal.JOURNAL_ENABLED:
+        journal.get_writer().append(events)
+    elif coalescer.enabled:
+        coalescer.add(events)
+    else:
+        write_events(events)
+
+
+def _lookup_ad(ad_id: int):
+    """优先从投放配置快照查找广告（有效广告），找不到再经熔断器查库"""
+    ad = snapshot_store.current().ads_by_id.get(ad_id)
+    if ad is not None:
+        return ad
+    try:
+        return breaker.call(db.get_ad, ad_id)
+    except (CircuitOpenError,) + DB_UNAVAILABLE_ERRORS:
+        raise HTTPException(status_code=503, detail='database unavailable')
+
+
 class ClickIn(BaseModel):
     ad_id: int
     domain: Optional[str] = None
@@ -257,34 +433,168 @@ def extract_client_ip(request: Request) -> str:
 
 @app.post('/events/click')
 def ad_click(payload: ClickIn, request: Request):
-    ad = db.get_ad(payload.ad_id)
+    client_ip = extract_client_ip(request)
+    if not limiter.hit(client_ip):
+        return JSONResponse(status_code=429, content={'ok': False, 'dropped': 'rate_limited'})
+
+    ad = _lookup_ad(payload.ad_id)
     if not ad:
         raise HTTPException(status_code=404, detail='ad not found')
     
-    # 获取域名和IP
+    # 获取域名
     domain = payload.domain or extract_domain_from_headers(request)
-    client_ip = extract_client_ip(request)
+
+    # 短时间内相同 (ip, ad_id) 的重复点击只返回链接，不计数
+    if click_deduper.is_duplicate(client_ip, payload.ad_id):
+        return {'link': ad['link'], 'duplicate': True}
     
     # 双写：保持原有统计 + 新增按域名IP统计
-    db.record_ad_click(payload.ad_id)
-    db.record_ad_click_by_domain_ip(payload.ad_id, domain, client_ip)
+    record_events([click_event(payload.ad_id, domain, client_ip)])
     
     return {'link': ad['link']}
 
 
+# 单次批量上报的最大事件数
+MAX_BATCH_EVENTS = 100
+# 批量上报请求体的最大字节数，超出时在解析前以 413 拒绝
+MAX_BATCH_BODY_BYTES = 128 * 1024
+
+
+class BatchEventIn(BaseModel):
+    """批量上报中的单个事件"""
+    type: Literal['page_view', 'impression', 'click']
+    ad_id: Optional[int] = None
+    # 超长的域名在生成事件时截断到列宽（events.clamp_domain），不因单个事件拒绝整批上报
+    domain: Optional[str] = None
+
+
+_batch_events_adapter = TypeAdapter(List[BatchEventIn])
+
+
+async def _read_body_limited(request: Request, limit: int) -> bytes:
+    """读取请求体，超过 limit 字节时返回 413（先看 Content-Length，分块传输时边读边计数）"""
+    length = request.headers.get('content-length')
+    if length and length.isdigit() and int(length) > limit:
+        raise HTTPException(status_code=413, detail='request body too large')
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise HTTPException(status_code=413, detail='request body too large')
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+@app.post('/events/batch')
+async def events_batch(request: Request):
+    """批量上报事件（page_view / impression / click）
+
+    请求体为事件数组，或 {"events": [...]}。为兼容 navigator.sendBeacon（text/plain，不触发预检），
+    不依赖 Content-Type，直接按 JSON 解析请求体。
+    """
+    raw = await _read_body_limited(request, MAX_BATCH_BODY_BYTES)
+    try:
+        body = orjson.loads(raw or b'[]')
+        if isinstance(body, dict):
+            body = body.get('events', [])
+        events = _batch_events_adapter.validate_python(body)
+    except (ValueError, ValidationError):
+        raise HTTPException(status_code=400, detail='invalid events')
+    if len(events) > MAX_BATCH_EVENTS:
+        raise HTTPException(status_code=413, detail='too many events')
+
+    header_domain = extract_domain_from_headers(request)
+    client_ip = extract_client_ip(request)
+    return await run_in_threadpool(_apply_batch_events, events, header_domain, client_ip)
+
+
+def _apply_batch_events(events, header_domain: str, client_ip: str):
+    ad_ids = {e.ad_id for e in events if e.type != EVENT_PAGE_VIEW and e.ad_id is not None}
+    # 有效广告直接从快照确认，其余（例如刚下线的广告）才查库；数据库不可用时视为无效
+    active_ids = snapshot_store.current().ads_by_id.keys()
+    known_ids = ad_ids & active_ids
+    if ad_ids - known_ids:
+        try:
+            known_ids |= breaker.call(db.get_existing_ad_ids, ad_ids - known_ids)
+        except (CircuitOpenError,) + DB_UNAVAILABLE_ERRORS:
+            pass
+
+    accepted = []
+    dropped = 0
+    for e in events:
+        if e.type != EVENT_PAGE_VIEW and e.ad_id not in known_ids:
+            dropped += 1
+            continue
+        if not limiter.hit(client_ip):
+            dropped += 1
+            continue
+        domain = e.domain or header_domain
+        if e.type == EVENT_PAGE_VIEW:
+            accepted.append(page_view_event(domain, client_ip))
+        elif e.type == EVENT_IMPRESSION:
+            accepted.append(impression_event(e.ad_id, domain, client_ip))
+        elif e.type == EVENT_CLICK:
+            if click_deduper.is_duplicate(client_ip, e.ad_id):
+                dropped += 1
+                continue
+            accepted.append(click_event(e.ad_id, domain, client_ip))
+
+    record_events(accepted)
+    return {'ok': True, 'accepted': len(accepted), 'dropped': dropped}
+
+
+@app.get('/health')
+def health():
+    """健康状态：数据库熔断、事件溢出队列、投放配置快照、只读副本与连接池"""
+    db_status = breaker.status()
+    return {
+        'status': 'ok' if db_status['state'] == 'closed' else 'degraded',
+        'db': db_status,
+        'event_buffer': coalescer.status(),
+        'event_spill': spill_queue.status(),
+        'snapshot': snapshot_store.status(),
+        'replica': db.replica_router.status(),
+        'pools': {
+            'serving': db.SERVING_POOL.stats(),
+            'reporting': db.REPORTING_POOL.stats(),
+        },
+    }
+
+
+@app.get('/events/limits')
+def event_limits():
+    """事件限流与点击去重的计数器，用于调整阈值"""
+    return {
+        'rate_limit': limiter.stats(),
+        'click_dedupe': click_deduper.stats(),
+    }
+
+
+# 报表接口在独立的 reporting bulkhead 中执行，不占用投放接口的线程与连接
+def _parse_date_range(start: str, end: str):
+    """校验 YYYY-MM-DD 日期参数并统一格式（归档按字符串比较日期），非法时返回 400"""
+    try:
+        return date.fromisoformat(start).isoformat(), date.fromisoformat(end).isoformat()
+    except ValueError:
+        raise HTTPException(status_code=400, detail='invalid date')
+
+
 @app.get('/stats/overview')
-def overview():
-    return db.get_overview()
+async def overview(request: Request):
+    return await bulkhead.reporting.run(request, db.get_overview)
 
 
 @app.get('/stats/daily')
-def daily(start: str, end: str):
-    return db.get_daily_stats(start, end)
+async def daily(start: str, end: str, request: Request):
+    start, end = _parse_date_range(start, end)
+    return await bulkhead.reporting.run(request, reports.get_daily_stats, start, end)
 
 
 @app.get('/stats/clicks/by_domain_ip')
-def clicks_by_domain_ip(start: str, end: str, type: str = 'main', page: int = 1, page_size: int = 10):
+async def clicks_by_domain_ip(request: Request, start: str, end: str, type: str = 'main', page: int = 1, page_size: int = 10):
     """获取按域名和IP的点击统计数据"""
+    start, end = _parse_date_range(start, end)
     is_main = type == 'main'
     
     if page < 1:
@@ -294,25 +604,18 @@ def clicks_by_domain_ip(start: str, end: str, type: str = 'main', page: int = 1,
     if page_size > 100:
         page_size = 100
 
-    result = db.get_clicks_by_domain_ip(start, end, is_main, page, page_size)
+    result = await bulkhead.reporting.run(request, reports.get_clicks_by_domain_ip, start, end, is_main, page, page_size)
     
-    total_items = result['total']
-    total_pages = (total_items + page_size - 1) // page_size
-
     return {
         'data': result['data'],
-        'pagination': {
-            'page': page,
-            'page_size': page_size,
-            'total_pages': total_pages,
-            'total_items': total_items,
-        }
+        'pagination': _pagination(page, page_size, result['total']),
     }
 
 
 @app.get('/stats/visitors/by_domain_ip')
-def visitors_by_domain_ip(start: str, end: str, page: int = 1, page_size: int = 10):
+async def visitors_by_domain_ip(request: Request, start: str, end: str, page: int = 1, page_size: int = 10):
     """获取按域名和IP的访客统计数据"""
+    start, end = _parse_date_range(start, end)
     if page < 1:
         page = 1
     if page_size < 1:
@@ -320,23 +623,130 @@ def visitors_by_domain_ip(start: str, end: str, page: int = 1, page_size: int =
     if page_size > 100:
         page_size = 100
     
-    result = db.get_visitors_by_domain_ip(start, end, page, page_size)
+    result = await bulkhead.reporting.run(request, reports.get_visitors_by_domain_ip, start, end, page, page_size)
     
-    total_items = result['total']
-    total_pages = (total_items + page_size - 1) // page_size
-
     return {
         'data': result['data'],
-        'pagination': {
-            'page': page,
-            'page_size': page_size,
-            'total_pages': total_pages,
-            'total_items': total_items,
-        },
-        'summary':result['summary']
+        'pagination': _pagination(page, page_size, result['total']),
+        'summary': result['summary']
+    }
+
+
+def _pagination(page: int, page_size: int, total_items: int) -> dict:
+    return {
+        'page': page,
+        'page_size': page_size,
+        'total_pages': (total_items + page_size - 1) // page_size,
+        'total_items': total_items,
     }
 
 
+@app.get('/stats/top')
+def top_domains_ips(start: str, end: str, metric: Literal['views', 'clicks'] = 'views', k: int = 10):
+    """区间内访问量 / 点击量前 K 的域名与 IP（来自内存与文件中的 space-saving 摘要，不查询数据库）
+
+    count 为估计值（上界），count - error 为下界。
+    """
+    start_day, end_day = map(date.fromisoformat, _parse_date_range(start, end))
+    if end_day < start_day:
+        raise HTTPException(status_code=400, detail='end before start')
+    start_day = max(start_day, end_day - timedelta(days=sketch.SKETCH_RETENTION_DAYS))
+    k = min(max(k, 1), 100)
+    result = sketch.store.top(start_day.isoformat(), end_day.isoformat(), metric, k)
+    return {'metric': metric, 'start': start_day.isoformat(), 'end': end_day.isoformat(), **result}
+
+
+@app.get('/stats/domains')
+async def domain_totals(request: Request, start: str, end: str, metric: Literal['views', 'clicks'] = 'views', limit: int = 20):
+    """区间内访问量 / 点击量最高的域名（精确值；已归档的日期走列式归档）"""
+    start, end = _parse_date_range(start, end)
+    limit = min(max(limit, 1), 1000)
+    rows = await bulkhead.reporting.run(request, reports.get_domain_totals, start, end, metric, limit)
+    return {'metric': metric, 'data': rows}
+
+
+@app.get('/stats/timeseries')
+async def traffic_timeseries(request: Request, start: str, end: str, bucket: Literal['hour', 'day', 'week'] = 'day'):
+    """按小时 / 天 / 周分桶的访问量与点击量（总数、主广告、次要广告）
+
+    小时计数只保留最近 HOURLY_RETENTION_DAYS 天；周以周一为起点。
+    """
+    start, end = _parse_date_range(start, end)
+    try:
+        series = await bulkhead.reporting.run(request, timeseries.get_timeseries, start, end, bucket)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {'bucket': bucket, 'data': series}
+
+
+@app.get('/stats/ctr')
+async def ad_ctr(request: Request, start: Optional[str] = None, end: Optional[str] = None):
+    """各广告的展示、点击与 CTR；不传日期时为累计值（增量维护，不扫描日计数）"""
+    rows = await bulkhead.reporting.run(request, db.get_ad_ctr, start, end)
+    return {'data': rows}
+
+
+DASHBOARD_SECTIONS = ('overview', 'daily', 'clicks', 'visitors')
+
+
+@app.get('/stats/dashboard')
+async def dashboard(request: Request, start: str, end: str, page_size: int = 10, include: Optional[str] = None):
+    """统计面板：一次返回概览、日统计、按域名IP的点击与访客首页数据
+
+    各查询相互独立，分别占用一个报表连接并发执行，总耗时取决于最慢的查询。
+    include 为逗号分隔的区块名（overview,daily,clicks,visitors），默认全部。
+    """
+    start, end = _parse_date_range(start, end)
+    sections = set(include.split(',')) if include else set(DASHBOARD_SECTIONS)
+    page_size = min(max(page_size, 1), 100)
+    run = bulkhead.reporting.run
+
+    tasks = {}
+    if 'overview' in sections:
+        tasks['total_views'] = run(request, db.get_total_views)
+        tasks['total_clicks'] = run(request, db.get_total_clicks)
+        tasks['main_clicks_total'] = run(request, db.get_total_clicks, True)
+        tasks['secondary_clicks_total'] = run(request, db.get_total_clicks, False)
+    if 'daily' in sections:
+        tasks['page_views'] = run(request, reports.get_daily_page_views, start, end)
+        tasks['clicks'] = run(request, reports.get_daily_clicks, start, end)
+        tasks['main_clicks'] = run(request, reports.get_daily_clicks, start, end, True)
+        tasks['secondary_clicks'] = run(request, reports.get_daily_clicks, start, end, False)
+    if 'clicks' in sections:
+        tasks['clicks_main'] = run(request, reports.get_clicks_by_domain_ip, start, end, True, 1, page_size)
+        tasks['clicks_secondary'] = run(request, reports.get_clicks_by_domain_ip, start, end, False, 1, page_size)
+    if 'visitors' in sections:
+        tasks['visitors'] = run(request, reports.get_visitors_by_domain_ip, start, end, 1, page_size)
+
+    results = dict(zip(tasks.keys(), await asyncio.gather(*tasks.values())))
+
+    payload = {}
+    if 'overview' in sections:
+        payload['overview'] = {
+            'total_views': results['total_views'],
+            'total_clicks': results['total_clicks'],
+            'main_clicks': results['main_clicks_total'],
+            'secondary_clicks': results['secondary_clicks_total'],
+        }
+    if 'daily' in sections:
+        payload['daily'] = {k: results[k] for k in ('page_views', 'clicks', 'main_clicks', 'secondary_clicks')}
+    if 'clicks' in sections:
+        payload['clicks_by_domain_ip'] = {
+            slot: {
+                'data': results[f'clicks_{slot}']['data'],
+                'pagination': _pagination(1, page_size, results[f'clicks_{slot}']['total']),
+            }
+            for slot in ('main', 'secondary')
+        }
+    if 'visitors' in sections:
+        payload['visitors_by_domain_ip'] = {
+            'data': results['visitors']['data'],
+            'pagination': _pagination(1, page_size, results['visitors']['total']),
+            'summary': results['visitors']['summary'],
+        }
+    return payload
+
+
 # 域名黑名单管理接口
 @app.get('/domains/blacklist')
 def get_blacklist_domains():
@@ -357,6 +767,7 @@ def add_to_blacklist(payload: DomainIn):
     if not success:
         raise HTTPException(status_code=400, detail='domain already in blacklist')
     
+    snapshot_store.publish()
     return {'ok': True, 'domain': domain}
 
 
@@ -364,11 +775,12 @@ def add_to_blacklist(payload: DomainIn):
 def remove_from_blacklist(domain_id: int):
     """从黑名单移除域名"""
     db.remove_domain_from_blacklist(domain_id)
+    snapshot_store.publish()
     return {'ok': True}
 
 
 @app.get('/domains/blacklist/check')
 def check_domain_blacklist(domain: str):
-    """检查域名是否在黑名单中"""
-    is_blacklisted = db.is_domain_blacklisted(domain)
+    """检查域名是否在黑名单中（与 /ads/random_pair 使用同一份快照，结果与实际投放一致）"""
+    is_blacklisted = snapshot_store.current().is_domain_blacklisted(domain)
     return {'domain': domain, 'blacklisted': is_blacklisted}
@@ -0,0 +1,115 @@
+"""
+事件限流与重复点击抑制
+
+在写入数据库之前，按客户端 IP 做滑动窗口限流，并对短时间内相同 (ip, ad_id) 的点击去重，
+避免单个机器人循环请求直接放大为数据库的 upsert 压力和虚高的统计。
+"""
+
+import os
+import time
+import threading
+
+# 每个 IP 在窗口内允许的事件数
+RATE_LIMIT_WINDOW_SECONDS = float(os.environ.get('RATE_LIMIT_WINDOW_SECONDS', 60))
+RATE_LIMIT_MAX_EVENTS = int(os.environ.get('RATE_LIMIT_MAX_EVENTS', 120))
+# 相同 (ip, ad_id) 点击在该时间内只计一次
+CLICK_DEDUPE_SECONDS = float(os.environ.get('CLICK_DEDUPE_SECONDS', 10))
+
+
+class SlidingWindowLimiter:
+    """滑动窗口计数器：用上一个固定窗口按重叠比例加权，近似真实的滑动窗口，每个 key 只存两个计数"""
+
+    def __init__(self, window: float = RATE_LIMIT_WINDOW_SECONDS, limit: int = RATE_LIMIT_MAX_EVENTS):
+        self.window = window
+        self.limit = limit
+        # key -> [当前窗口编号, 当前窗口计数, 上一窗口计数]
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._last_sweep = 0
+        self.allowed = 0
+        self.limited = 0
+
+    def hit(self, key: str, now: float = None) -> bool:
+        """记录一次事件，返回是否允许通过"""
+        now = time.time() if now is None else now
+        idx = int(now // self.window)
+        with self._lock:
+            self._sweep(idx)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = [idx, 0, 0]
+                self._buckets[key] = bucket
+            elif bucket[0] != idx:
+                bucket[2] = bucket[1] if bucket[0] == idx - 1 else 0
+                bucket[0] = idx
+                bucket[1] = 0
+            elapsed = (now % self.window) / self.window
+            estimated = bucket[2] * (1 - elapsed) + bucket[1]
+            if estimated >= self.limit:
+                self.limited += 1
+                return False
+            bucket[1] += 1
+            self.allowed += 1
+            return True
+
+    def _sweep(self, idx: int):
+        # 每个窗口清理一次不再活跃的 key，防止内存无限增长
+        if idx == self._last_sweep:
+            return
+        self._last_sweep = idx
+        stale = [k for k, b in self._buckets.items() if b[0] < idx - 1]
+        for k in stale:
+            del self._buckets[k]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'window_seconds': self.window,
+                'max_events': self.limit,
+                'tracked_keys': len(self._buckets),
+                'allowed': self.allowed,
+                'limited': self.limited,
+            }
+
+
+class ClickDeduper:
+    """短时间窗口内相同 (ip, ad_id) 的重复点击抑制"""
+
+    def __init__(self, ttl: float = CLICK_DEDUPE_SECONDS):
+        self.ttl = ttl
+        self._seen = {}
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        self.unique = 0
+        self.duplicates = 0
+
+    def is_duplicate(self, ip: str, ad_id: int, now: float = None) -> bool:
+        """记录一次点击，若与窗口内已有点击重复则返回 True"""
+        now = time.time() if now is None else now
+        key = (ip, ad_id)
+        with self._lock:
+            if now - self._last_sweep >= self.ttl:
+                self._last_sweep = now
+                expired = [k for k, ts in self._seen.items() if now - ts >= self.ttl]
+                for k in expired:
+                    del self._seen[k]
+            ts = self._seen.get(key)
+            if ts is not None and now - ts < self.ttl:
+                self.duplicates += 1
+                return True
+            self._seen[key] = now
+            self.unique += 1
+            return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'window_seconds': self.ttl,
+                'tracked_keys': len(self._seen),
+                'unique': self.unique,
+                'duplicates': self.duplicates,
+            }
+
+
+limiter = SlidingWindowLimiter()
+click_deduper = ClickDeduper()
@@ -0,0 +1,89 @@
+"""
+统计查询路由
+
+与 db 中同名报表函数的参数和返回格式相同：查询区间中已归档的部分由列式归档（archive）回答，
+其余日期仍查询 MySQL，结果按原有排序合并。没有归档时等同于直接调用 db。
+"""
+
+from . import db
+from .archive import reader
+
+
+def get_daily_page_views(start: str, end: str):
+    old, recent = reader.split(start, end)
+    rows = [{'day': day, 'count': n} for day, n in reader.daily(*old, 'page_views')] if old else []
+    return rows + (db.get_daily_page_views(*recent) if recent else [])
+
+
+def get_daily_clicks(start: str, end: str, is_main: bool = None):
+    old, recent = reader.split(start, end)
+    field = 'clicks' if is_main is None else ('main_clicks' if is_main else 'secondary_clicks')
+    rows = [{'day': day, 'clicks': n} for day, n in reader.daily(*old, field)] if old else []
+    return rows + (db.get_daily_clicks(*recent, is_main) if recent else [])
+
+
+def get_daily_stats(start: str, end: str):
+    """获取日统计数据"""
+    return {
+        'page_views': get_daily_page_views(start, end),
+        'clicks': get_daily_clicks(start, end),
+        'main_clicks': get_daily_clicks(start, end, is_main=True),
+        'secondary_clicks': get_daily_clicks(start, end, is_main=False)
+    }
+
+
+def _merge_pages(recent_page, old_page, page: int, page_size: int):
+    """在线部分（日期较新）排在前面：本页不足时从归档部分接着取
+
+    recent_page(page, page_size) 返回 {'data', 'total'}；old_page(offset, limit) 返回 (rows, total)。
+    """
+    offset = (page - 1) * page_size
+    recent = recent_page(page, page_size)
+    rows = list(recent['data'])
+    old_offset = max(0, offset - recent['total'])
+    old_rows, old_total = old_page(old_offset, page_size - len(rows))
+    return {'data': rows + old_rows, 'total': recent['total'] + old_total}
+
+
+def get_clicks_by_domain_ip(start: str, end: str, is_main: bool = True, page: int = 1, page_size: int = 10):
+    """获取按域名和IP的点击统计数据"""
+    old, recent = reader.split(start, end)
+    if not old:
+        return db.get_clicks_by_domain_ip(start, end, is_main, page, page_size)
+
+    def old_page(offset, limit):
+        return reader.clicks_page(*old, is_main, offset, limit)
+
+    if not recent:
+        rows, total = old_page((page - 1) * page_size, page_size)
+        return {'data': rows, 'total': total}
+    return _merge_pages(lambda p, s: db.get_clicks_by_domain_ip(*recent, is_main, p, s), old_page, page, page_size)
+
+
+def get_visitors_by_domain_ip(start: str, end: str, page: int = 1, page_size: int = 10):
+    """获取按域名和IP的访客统计数据"""
+    old, recent = reader.split(start, end)
+    if not old:
+        return db.get_visitors_by_domain_ip(start, end, page, page_size)
+
+    def old_page(offset, limit):
+        return reader.visitors_page(*old, offset, limit)
+
+    if not recent:
+        rows, total = old_page((page - 1) * page_size, page_size)
+        return {'data': rows, 'total': total, 'summary': reader.visitors_summary(*old)}
+    result = _merge_pages(lambda p, s: db.get_visitors_by_domain_ip(*recent, p, s), old_page, page, page_size)
+    domains, ips, visits = db.get_visitor_distinct_values(*recent)
+    result['summary'] = reader.visitors_summary(*old, domains, ips, visits)
+    return result
+
+
+def get_domain_totals(start: str, end: str, metric: str = 'views', limit: int = 20):
+    """区间内访问量或点击量最高的域名（精确值），按数量降序"""
+    old, recent = reader.split(start, end)
+    totals = reader.domain_totals(*old, metric) if old else {}
+    if recent:
+        for domain, n in db.get_domain_totals(*recent, metric).items():
+            totals[domain] = totals.get(domain, 0) + n
+    top = sorted(totals.items(), key=lambda kv: -kv[1])[:limit]
+    return [{'domain': domain, 'count': n} for domain, n in top]
@@ -0,0 +1,273 @@
+"""
+热门域名 / IP 的流式统计（space-saving sketch）
+
+每个进程在内存中为每天维护四个 space-saving 摘要：访问量按域名、按 IP，点击量按域名、按 IP，
+每个 page_view / click 事件到达时更新。摘要只保留 SKETCH_CAPACITY 个计数器，
+计数为上界估计，count - error 为下界；频次超过 总数 / 容量 的项一定在摘要中。
+
+后台线程每 SKETCH_PERSIST_SECONDS 秒将有变化的摘要写入 SKETCH_DIR/<day>/<writer>.json，
+每个进程一个 writer，互不覆盖。查询时合并区间内各天、各 writer 的摘要，取前 K 项，不查询数据库。
+"""
+
+import os
+import time
+import uuid
+import heapq
+import shutil
+import logging
+import threading
+from datetime import date, timedelta
+
+import orjson
+
+from .events import EVENT_PAGE_VIEW, EVENT_CLICK
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+SKETCH_DIR = os.environ.get('SKETCH_DIR', os.path.join(BASE_DIR, 'data', 'sketches'))
+# 每个摘要保留的计数器个数，越大越准确
+SKETCH_CAPACITY = int(os.environ.get('SKETCH_CAPACITY', 1000))
+SKETCH_PERSIST_SECONDS = float(os.environ.get('SKETCH_PERSIST_SECONDS', 60))
+# 摘要文件保留天数，更早的按天删除
+SKETCH_RETENTION_DAYS = int(os.environ.get('SKETCH_RETENTION_DAYS', 365))
+
+METRICS = ('views', 'clicks')
+DIMENSIONS = ('domain', 'ip')
+_EVENT_METRICS = {EVENT_PAGE_VIEW: 'views', EVENT_CLICK: 'clicks'}
+
+
+class SpaceSaving:
+    """space-saving 摘要：最多 capacity 个计数器，新项替换当前最小的计数器"""
+
+    def __init__(self, capacity: int = SKETCH_CAPACITY):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        # (计数, 项) 的最小堆，计数变化时压入新条目，旧条目在出堆时按 counts 校验后丢弃
+        self._heap = []
+
+    def add(self, item: str, n: int = 1):
+        count = self.counts.get(item)
+        if count is not None:
+            count += n
+        elif len(self.counts) < self.capacity:
+            count = n
+            self.errors[item] = 0
+        else:
+            min_count, victim = self._pop_min()
+            del self.counts[victim]
+            del self.errors[victim]
+            count = min_count + n
+            self.errors[item] = min_count
+        self.counts[item] = count
+        heapq.heappush(self._heap, (count, item))
+        if len(self._heap) > 4 * self.capacity + 64:
+            self._heap = [(c, i) for i, c in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self):
+        while True:
+            count, item = heapq.heappop(self._heap)
+            if self.counts.get(item) == count:
+                return count, item
+
+    def min_count(self) -> int:
+        """未满时为 0；已满时为最小计数，即任何未被记录的项的计数上界"""
+        if len(self.counts) < self.capacity:
+            return 0
+        while self.counts.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0]
+
+    def top(self, k: int):
+        return [
+            {'key': item, 'count': count, 'error': self.errors[item]}
+            for item, count in heapq.nlargest(k, self.counts.items(), key=lambda kv: kv[1])
+        ]
+
+    def to_dict(self) -> dict:
+        return {
+            'capacity': self.capacity,
+            'items': [[item, count, self.errors[item]] for item, count in self.counts.items()],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'SpaceSaving':
+        sketch = cls(data['capacity'])
+        for item, count, error in data['items']:
+            sketch.counts[item] = count
+            sketch.errors[item] = error
+        sketch._heap = [(c, i) for i, c in sketch.counts.items()]
+        heapq.heapify(sketch._heap)
+        return sketch
+
+    @classmethod
+    def merge(cls, sketches, capacity: int = SKETCH_CAPACITY) -> 'SpaceSaving':
+        """合并多个摘要：某项不在某个已满摘要中时，以该摘要的最小计数作为其上界计入计数与误差"""
+        sketches = [s for s in sketches if s.counts]
+        counts, errors, present_mins = {}, {}, {}
+        mins = [s.min_count() for s in sketches]
+        total_min = sum(mins)
+        for s, m in zip(sketches, mins):
+            for item, count in s.counts.items():
+                counts[item] = counts.get(item, 0) + count
+                errors[item] = errors.get(item, 0) + s.errors[item]
+                present_mins[item] = present_mins.get(item, 0) + m
+        merged = cls(capacity)
+        for item, count in heapq.nlargest(capacity, counts.items(),
+                                          key=lambda kv: kv[1] + total_min - present_mins[kv[0]]):
+            absent = total_min - present_mins[item]
+            merged.counts[item] = count + absent
+            merged.errors[item] = errors[item] + absent
+        merged._heap = [(c, i) for i, c in merged.counts.items()]
+        heapq.heapify(merged._heap)
+        return merged
+
+
+def _new_day_sketches():
+    return {(metric, dim): SpaceSaving() for metric in METRICS for dim in DIMENSIONS}
+
+
+def _days(start: str, end: str):
+    d, last = date.fromisoformat(start), date.fromisoformat(end)
+    while d <= last:
+        yield d.isoformat()
+        d += timedelta(days=1)
+
+
+def _load_file(path: str):
+    with open(path, 'rb') as f:
+        data = orjson.loads(f.read())
+    return {(metric, dim): SpaceSaving.from_dict(data[metric][dim]) for metric in METRICS for dim in DIMENSIONS}
+
+
+class SketchStore:
+    """本进程的每日摘要，以及跨进程、跨天的合并查询"""
+
+    def __init__(self, directory: str = SKETCH_DIR):
+        self.directory = directory
+        self.writer_id = f"{os.getpid()}_{uuid.uuid4().hex[:8]}"
+        self._days = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._persist_lock = threading.Lock()
+        self._thread = None
+        # 已结束日期的合并结果缓存：day -> (文件签名, {(metric, dim): SpaceSaving})
+        self._merged_cache = {}
+
+    def observe(self, events):
+        """按事件更新当日摘要（page_view 计入访问量，click 计入点击量）"""
+        with self._lock:
+            for e in events:
+                metric = _EVENT_METRICS.get(e.type)
+                if metric is None:
+                    continue
+                day = self._days.get(e.day)
+                if day is None:
+                    day = self._days[e.day] = _new_day_sketches()
+                day[(metric, 'domain')].add(e.domain or 'unknown')
+                day[(metric, 'ip')].add(e.ip or 'unknown')
+                self._dirty.add(e.day)
+
+    def persist(self):
+        """将有变化的摘要写入文件；不再更新的旧日期在写入后移出内存"""
+        with self._persist_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+                payloads = {
+                    day: orjson.dumps({
+                        metric: {dim: self._days[day][(metric, dim)].to_dict() for dim in DIMENSIONS}
+                        for metric in METRICS
+                    })
+                    for day in dirty
+                }
+            for day, body in payloads.items():
+                day_dir = os.path.join(self.directory, day)
+                os.makedirs(day_dir, exist_ok=True)
+                path = os.path.join(day_dir, f"{self.writer_id}.json")
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(body)
+                os.replace(tmp_path, path)
+            # 只保留今天和昨天在内存中（跨零点的迟到事件仍可计入昨天）
+            keep_from = (date.today() - timedelta(days=1)).isoformat()
+            with self._lock:
+                for day in [d for d in self._days if d < keep_from and d not in self._dirty]:
+                    del self._days[day]
+            self._remove_expired()
+
+    def _remove_expired(self):
+        if not os.path.isdir(self.directory):
+            return
+        cutoff = (date.today() - timedelta(days=SKETCH_RETENTION_DAYS)).isoformat()
+        for name in os.listdir(self.directory):
+            if len(name) == 10 and name < cutoff:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def _day_files(self, day: str):
+        day_dir = os.path.join(self.directory, day)
+        if not os.path.isdir(day_dir):
+            return []
+        return sorted(
+            (name, os.path.getmtime(os.path.join(day_dir, name)))
+            for name in os.listdir(day_dir) if name.endswith('.json')
+        )
+
+    def _load_day(self, day: str, files, skip_writer: str = None):
+        loaded = []
+        for name, _ in files:
+            if skip_writer and name == f"{skip_writer}.json":
+                continue
+            try:
+                loaded.append(_load_file(os.path.join(self.directory, day, name)))
+            except (OSError, ValueError, KeyError):
+                logger.warning('skipping unreadable sketch file %s/%s', day, name)
+        return loaded
+
+    def _day_sketches(self, day: str):
+        """某天所有 writer 的摘要列表：本进程仍在内存中的用内存版本，其余读取文件"""
+        with self._lock:
+            live = self._days.get(day)
+            live = {key: SpaceSaving.from_dict(s.to_dict()) for key, s in live.items()} if live else None
+        files = self._day_files(day)
+        if live is not None:
+            return [live] + self._load_day(day, files, skip_writer=self.writer_id)
+        if day >= (date.today() - timedelta(days=1)).isoformat():
+            # 其他进程可能仍在更新，不缓存
+            return self._load_day(day, files)
+        signature = tuple(files)
+        cached = self._merged_cache.get(day)
+        if cached is None or cached[0] != signature:
+            per_writer = self._load_day(day, files)
+            merged = {key: SpaceSaving.merge([w[key] for w in per_writer]) for key in per_writer[0]} if per_writer else {}
+            cached = (signature, merged)
+            self._merged_cache[day] = cached
+        return [cached[1]] if cached[1] else []
+
+    def top(self, start: str, end: str, metric: str, k: int):
+        """区间内访问量或点击量前 K 的域名与 IP"""
+        summaries = []
+        for day in _days(start, end):
+            summaries.extend(self._day_sketches(day))
+        result = {}
+        for dim in DIMENSIONS:
+            merged = SpaceSaving.merge([s[(metric, dim)] for s in summaries])
+            result[f'{dim}s'] = merged.top(k)
+        return result
+
+    def _run(self):
+        while True:
+            time.sleep(SKETCH_PERSIST_SECONDS)
+            try:
+                self.persist()
+            except OSError:
+                logger.exception('failed to persist sketches')
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='sketch-persist', daemon=True)
+            self._thread.start()
+
+
+store = SketchStore()
@@ -0,0 +1,185 @@
+"""
+投放配置快照（多 worker 共享）
+
+将投放所需的配置（有效广告、投放设置、域名黑名单、定向规则）编译为一份不可变、带版本号的快照，
+写入本地文件并原子替换；各 uvicorn worker 以只读 mmap 方式映射，通过控制文件中的版本计数器
+发现新版本。管理接口修改数据后调用 publish() 重新编译，N 个 worker 只需一次数据库读取。
+
+文件：
+- snapshot.ctl：<magic 4B><保留 4B><version u64>，各 worker 常驻 mmap，只读取版本号
+- snapshot.bin：<magic 4B><保留 4B><version u64><payload 长度 u32><crc32 u32><JSON payload>
+"""
+
+import os
+import mmap
+import logging
+import zlib
+import fcntl
+import random
+import struct
+import threading
+
+import orjson
+
+from . import db
+from .targeting import TargetingIndex, normalize_domain
+from .breaker import breaker, CircuitOpenError, DB_UNAVAILABLE_ERRORS
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+SNAPSHOT_DIR = os.environ.get('CONFIG_SNAPSHOT_DIR', os.path.join(BASE_DIR, 'data', 'snapshot'))
+
+_MAGIC = b'ADSS'
+_CTL = struct.Struct('<4s4xQ')
+_DATA_HEADER = struct.Struct('<4s4xQII')
+
+
+# 广告脚本用到的字段；created_at / status 等不下发
+SERVED_AD_FIELDS = ('id', 'img_url', 'link', 'is_main', 'x_redirect_enabled')
+SERVED_SETTINGS_FIELDS = ('main_ad_once_per_day', 'secondary_ad_once_per_day')
+
+
+class ConfigSnapshot:
+    """某一版本的投放配置（只读）"""
+
+    def __init__(self, version: int, payload: dict):
+        self.version = version
+        self.settings = payload['settings']
+        # 与数据库中不区分大小写的比较一致：条目和查询的域名都先规范化（旧版本快照文件中的条目未规范化）
+        self.blacklist = frozenset(normalize_domain(d) for d in payload['blacklist'])
+        self.ads_by_id = {ad['id']: ad for ad in payload['ads']}
+        # 定向规则展开后的域名候选索引；旧版本快照文件没有 targeting 字段
+        self.targeting = TargetingIndex(payload['ads'], payload.get('targeting', []))
+        # 预先序列化好的响应片段：投放时只做字节拼接
+        self.ad_json = {ad['id']: orjson.dumps(ad) for ad in payload['ads']}
+        self.settings_json = orjson.dumps({k: self.settings[k] for k in SERVED_SETTINGS_FIELDS})
+
+    def is_domain_blacklisted(self, domain: str) -> bool:
+        return normalize_domain(domain) in self.blacklist
+
+    def random_pair(self, want_main: bool = True, want_secondary: bool = True, domain: str = None):
+        """从快照中随机选取主广告和次要广告各一个（不查询数据库）
+
+        全局开关关闭时均不返回；某个广告位的开关关闭、调用方不需要（want_* 为 False）或
+        该域名经定向筛选后没有有效广告时，该广告位返回 None。
+        """
+        s = self.settings
+        if not s['global_enabled']:
+            return {"main": None, "secondary": None}
+        mains, secondaries = self.targeting.lookup(domain)
+        main = random.choice(mains) if s['main_enabled'] and want_main and mains else None
+        secondary = (random.choice(secondaries)
+                     if s['secondary_enabled'] and want_secondary and secondaries else None)
+        return {"main": main, "secondary": secondary}
+
+
+EMPTY_SNAPSHOT = ConfigSnapshot(0, {
+    'ads': [],
+    'settings': {
+        'global_enabled': False,
+        'main_enabled': False,
+        'secondary_enabled': False,
+        'main_ad_once_per_day': False,
+        'secondary_ad_once_per_day': False,
+    },
+    'blacklist': [],
+    'targeting': [],
+})
+
+
+class SnapshotStore:
+    """快照文件的发布与读取"""
+
+    def __init__(self, directory: str = SNAPSHOT_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.ctl_path = os.path.join(directory, 'snapshot.ctl')
+        self.data_path = os.path.join(directory, 'snapshot.bin')
+        self.lock_path = os.path.join(directory, 'snapshot.lock')
+        self._ctl = None
+        self._current = None
+        self._lock = threading.Lock()
+
+    def _ensure_ctl(self):
+        if self._ctl is not None:
+            return
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if not os.path.exists(self.ctl_path) or os.path.getsize(self.ctl_path) < _CTL.size:
+                with open(self.ctl_path, 'wb') as f:
+                    f.write(_CTL.pack(_MAGIC, 0))
+        with open(self.ctl_path, 'rb') as f:
+            self._ctl = mmap.mmap(f.fileno(), _CTL.size, access=mmap.ACCESS_READ)
+
+    def published_version(self) -> int:
+        """控制文件中的当前版本号"""
+        self._ensure_ctl()
+        _, version = _CTL.unpack(self._ctl[:_CTL.size])
+        return version
+
+    def publish(self) -> int:
+        """从数据库编译新快照并原子替换，返回新版本号"""
+        self._ensure_ctl()
+        with open(self.lock_path, 'a') as lock_file:
+            # 跨进程互斥，保证版本号单调递增；数据库读取也在锁内进行，
+            # 否则并发发布时先读到旧数据的一方可能拿到更大的版本号，覆盖较新的配置
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            payload = {
+                'ads': [{k: ad[k] for k in SERVED_AD_FIELDS} for ad in db.list_active_ads()],
+                'settings': db.get_ad_settings(),
+                'blacklist': [normalize_domain(r['domain']) for r in db.list_blacklist_domains()],
+                'targeting': db.list_active_targeting(),
+            }
+            body = orjson.dumps(payload)
+            version = self.published_version() + 1
+            tmp_path = f"{self.data_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(_DATA_HEADER.pack(_MAGIC, version, len(body), zlib.crc32(body)))
+                f.write(body)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.data_path)
+            # 数据文件替换完成后再递增版本号，读取方看到新版本时数据一定已就绪
+            with open(self.ctl_path, 'r+b') as f:
+                f.write(_CTL.pack(_MAGIC, version))
+                f.flush()
+        return version
+
+    def _load(self) -> ConfigSnapshot:
+        with open(self.data_path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                magic, version, length, crc = _DATA_HEADER.unpack(mm[:_DATA_HEADER.size])
+                body = mm[_DATA_HEADER.size:_DATA_HEADER.size + length]
+        if magic != _MAGIC or zlib.crc32(body) != crc:
+            raise ValueError('corrupted config snapshot')
+        return ConfigSnapshot(version, orjson.loads(body))
+
+    def current(self) -> ConfigSnapshot:
+        """返回最新快照；只有控制文件中的版本号变化时才重新加载
+
+        磁盘上的快照即最后可用版本，数据库不可用时仍可投放；从未发布过且数据库不可用时返回空快照（不投放）。
+        """
+        snap = self._current
+        if snap is not None and snap.version >= self.published_version():
+            return snap
+        with self._lock:
+            if self._current is None or self._current.version < self.published_version():
+                if not os.path.exists(self.data_path):
+                    try:
+                        breaker.call(self.publish)
+                    except (CircuitOpenError,) + DB_UNAVAILABLE_ERRORS as e:
+                        logger.warning('config snapshot unavailable, serving no ads: %s', e)
+                        return EMPTY_SNAPSHOT
+                self._current = self._load()
+            return self._current
+
+    def status(self) -> dict:
+        snap = self._current
+        return {
+            'published_version': self.published_version(),
+            'loaded_version': snap.version if snap else None,
+            'published_at': os.path.getmtime(self.data_path) if os.path.exists(self.data_path) else None,
+        }
+
+
+store = SnapshotStore()
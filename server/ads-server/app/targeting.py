@@ -0,0 +1,95 @@
+"""
+广告域名定向
+
+每个广告可配置 include / exclude 规则，规则为精确域名（a.example.com）或通配（*.example.com，
+匹配 example.com 本身及其所有子域名）：
+- 有 include 规则的广告只在匹配的域名投放，没有 include 规则的广告在所有域名投放；
+- 命中 exclude 规则的域名不投放（优先于 include）。
+
+规则在编译快照时展开为「域名 -> 候选广告列表」的索引，投放时只按域名后缀查表，不逐条计算规则。
+某个域名命中的规则集合只取决于：它是否是某条精确规则的域名，以及它最长的通配后缀，
+因此对每个精确键、每个通配键各预计算一份候选列表，其余域名使用默认列表。
+"""
+
+MODE_INCLUDE = 'include'
+MODE_EXCLUDE = 'exclude'
+MODES = (MODE_INCLUDE, MODE_EXCLUDE)
+
+_EXACT = 'exact'
+_WILDCARD = 'wildcard'
+
+
+def normalize_domain(domain: str) -> str:
+    """统一域名格式：小写、去掉端口和末尾的点"""
+    domain = (domain or '').strip().lower()
+    if domain.startswith('['):
+        return domain
+    return domain.rsplit(':', 1)[0].rstrip('.')
+
+
+def normalize_pattern(pattern: str) -> str:
+    """校验并规范化一条规则，非法时抛出 ValueError"""
+    text = (pattern or '').strip().lower().rstrip('.')
+    wildcard = text.startswith('*.')
+    host = text[2:] if wildcard else text
+    if not host or '*' in host or '/' in host or ':' in host or any(c.isspace() for c in host):
+        raise ValueError(f'invalid domain pattern: {pattern}')
+    if '' in host.split('.'):
+        raise ValueError(f'invalid domain pattern: {pattern}')
+    return f'*.{host}' if wildcard else host
+
+
+def _parse(pattern: str):
+    if pattern.startswith('*.'):
+        return (_WILDCARD, pattern[2:])
+    return (_EXACT, pattern)
+
+
+def _suffixes(domain: str):
+    """a.b.com -> a.b.com, b.com, com"""
+    parts = domain.split('.')
+    for i in range(len(parts)):
+        yield '.'.join(parts[i:])
+
+
+class TargetingIndex:
+    """按域名预计算的候选广告索引（只读）"""
+
+    def __init__(self, ads, rules):
+        include, exclude = {}, {}
+        for r in rules:
+            target = include if r['mode'] == MODE_INCLUDE else exclude
+            target.setdefault(r['ad_id'], set()).add(_parse(r['pattern']))
+        exact_keys = {key for rs in (*include.values(), *exclude.values()) for kind, key in rs if kind == _EXACT}
+        wildcard_keys = {key for rs in (*include.values(), *exclude.values()) for kind, key in rs if kind == _WILDCARD}
+
+        def candidates(matched):
+            """命中规则集合为 matched 时的 (主广告, 次广告) 候选列表"""
+            selected = [
+                ad for ad in ads
+                if (ad['id'] not in include or include[ad['id']] & matched)
+                and not (ad['id'] in exclude and exclude[ad['id']] & matched)
+            ]
+            return ([ad for ad in selected if ad['is_main']], [ad for ad in selected if not ad['is_main']])
+
+        def wildcard_matches(domain):
+            return {(_WILDCARD, s) for s in _suffixes(domain) if s in wildcard_keys}
+
+        self.default = candidates(set())
+        self.exact_index = {key: candidates({(_EXACT, key)} | wildcard_matches(key)) for key in exact_keys}
+        self.wildcard_index = {key: candidates(wildcard_matches(key)) for key in wildcard_keys}
+
+    def lookup(self, domain: str):
+        """返回域名对应的 (主广告, 次广告) 候选列表"""
+        if not self.exact_index and not self.wildcard_index:
+            return self.default
+        domain = normalize_domain(domain)
+        hit = self.exact_index.get(domain)
+        if hit is not None:
+            return hit
+        # 从长到短匹配通配后缀，第一个命中的即为最长通配后缀
+        for suffix in _suffixes(domain):
+            hit = self.wildcard_index.get(suffix)
+            if hit is not None:
+                return hit
+        return self.default
@@ -0,0 +1,94 @@
+"""
+访问量 / 点击量时间序列
+
+按小时的计数（page_views_hourly / ad_clicks_hourly）与日计数在同一事务中由埋点写入，
+只保留最近 HOURLY_RETENTION_DAYS 天；更早的小时行由 compact() 删除，这些日期的按天 / 按周
+统计仍来自日计数（已归档的日期来自列式归档），因此存储量有上界且不丢失日粒度数据。
+"""
+
+import os
+from datetime import date, datetime, timedelta
+
+from . import db, reports
+
+# 小时计数保留天数（含今天之前的完整天数），更早的日期只能按天 / 按周查询
+HOURLY_RETENTION_DAYS = int(os.environ.get('HOURLY_RETENTION_DAYS', 30))
+
+BUCKETS = ('hour', 'day', 'week')
+_FIELDS = ('page_views', 'clicks', 'main_clicks', 'secondary_clicks')
+
+
+def hourly_cutoff() -> date:
+    """仍保留小时计数的最早日期"""
+    return date.today() - timedelta(days=HOURLY_RETENTION_DAYS)
+
+
+def _empty():
+    return dict.fromkeys(_FIELDS, 0)
+
+
+def _hourly(start: date, end: date):
+    counts = db.get_hourly_stats(start.isoformat(), end.isoformat())
+    now = datetime.now()
+    series = []
+    day = start
+    while day <= end:
+        last_hour = now.hour if day == now.date() else 23
+        for hour in range(last_hour + 1):
+            row = counts.get((day.isoformat(), hour)) or _empty()
+            series.append({'time': f'{day.isoformat()} {hour:02d}:00', **row})
+        day += timedelta(days=1)
+    return series
+
+
+def _daily(start: date, end: date):
+    stats = reports.get_daily_stats(start.isoformat(), end.isoformat())
+    by_day = {}
+    for field, rows in stats.items():
+        value_key = 'count' if field == 'page_views' else 'clicks'
+        for r in rows:
+            by_day.setdefault(r['day'], _empty())[field] = int(r[value_key] or 0)
+    series = []
+    day = start
+    while day <= end:
+        series.append({'time': day.isoformat(), **by_day.get(day.isoformat(), _empty())})
+        day += timedelta(days=1)
+    return series
+
+
+def _weekly(start: date, end: date):
+    """按自然周（周一开始）合并日序列，time 为该周周一；首尾两周只包含区间内的日期"""
+    series = []
+    for row in _daily(start, end):
+        day = date.fromisoformat(row['time'])
+        week = (day - timedelta(days=day.weekday())).isoformat()
+        if not series or series[-1]['time'] != week:
+            series.append({'time': week, **_empty()})
+        for field in _FIELDS:
+            series[-1][field] += row[field]
+    return series
+
+
+def get_timeseries(start: str, end: str, bucket: str = 'day'):
+    """区间内按 hour / day / week 分桶的访问量与点击量，没有数据的桶为 0，不超过今天
+
+    按小时查询的起始日期早于 hourly_cutoff() 时抛出 ValueError（小时计数已被压缩删除）。
+    """
+    start_day, end_day = date.fromisoformat(start), date.fromisoformat(end)
+    if end_day < start_day:
+        raise ValueError('end before start')
+    end_day = min(end_day, date.today())
+    if end_day < start_day:
+        return []
+    if bucket == 'hour':
+        if start_day < hourly_cutoff():
+            raise ValueError(f'hourly data is only kept for the last {HOURLY_RETENTION_DAYS} days')
+        return _hourly(start_day, end_day)
+    if bucket == 'week':
+        return _weekly(start_day, end_day)
+    return _daily(start_day, end_day)
+
+
+def compact() -> int:
+    """删除超过保留期的小时计数，返回删除的行数"""
+    return db.compact_hourly_stats(hourly_cutoff().isoformat())
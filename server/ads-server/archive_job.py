@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+统计数据每日维护任务，建议每天凌晨由 cron 运行一次：
+- 将已结束的日期导出为列式文件（ARCHIVE_DIR）
+- 删除超过 HOURLY_RETENTION_DAYS 天的小时计数（对应日期仍保留日计数）
+"""
+
+import os
+import sys
+import logging
+
+# 添加当前目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.archive import ArchiveWriter
+from app import timeseries
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    days = ArchiveWriter().run()
+    print(f"archived {len(days)} day(s)" + (f": {days[0]} ~ {days[-1]}" if days else ""))
+    print(f"compacted {timeseries.compact()} hourly row(s)")
@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+事件 journal 消费进程：读取 EVENT_JOURNAL_DIR 下的分段并写入 MySQL 统计表
+"""
+
+import os
+import sys
+
+# 添加当前目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import db
+from app.journal import JournalConsumer
+
+if __name__ == "__main__":
+    db.init_db()
+    JournalConsumer().run_forever()
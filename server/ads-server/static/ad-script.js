@@ -12,9 +12,16 @@
     const CONFIG = {
         API_BASE: 'http://8.152.194.158:29999', // 后台API地址
         MAIN_AD_CONTAINER_ID: 'main-ad-container',
-        SECONDARY_AD_CONTAINER_ID: 'secondary-ad-container'
+        SECONDARY_AD_CONTAINER_ID: 'secondary-ad-container',
+        EVENT_FLUSH_DELAY: 5000, // 事件队列最长等待时间（毫秒）
+        EVENT_BATCH_SIZE: 20, // 队列达到该数量立即上报
+        PAGE_VIEW_PIXEL: true // 页面访问使用图片像素上报（无预检），关闭则走批量事件队列
     };
     
+    // 待上报的事件队列
+    let eventQueue = [];
+    let flushTimer = null;
+    
     // 广告数据
     let adData = null;
     // 广告设置（频率控制等）
@@ -29,10 +36,58 @@
         }
         
         createAdContainers();
+        listenPageHide();
         recordPageView();
         loadAds();
     }
     
+    // 事件入队，达到批量大小或等待超时后统一上报
+    function enqueueEvent(event) {
+        event.domain = window.location.hostname;
+        eventQueue.push(event);
+        if (eventQueue.length >= CONFIG.EVENT_BATCH_SIZE) {
+            flushEvents();
+        } else if (!flushTimer) {
+            flushTimer = setTimeout(flushEvents, CONFIG.EVENT_FLUSH_DELAY);
+        }
+    }
+    
+    // 上报队列中的事件：优先 sendBeacon（页面卸载时也能送达），text/plain 不触发预检
+    function flushEvents() {
+        if (flushTimer) {
+            clearTimeout(flushTimer);
+            flushTimer = null;
+        }
+        if (eventQueue.length === 0) return;
+        
+        const events = eventQueue;
+        eventQueue = [];
+        const url = `${CONFIG.API_BASE}/events/batch`;
+        const body = JSON.stringify(events);
+        
+        if (navigator.sendBeacon && navigator.sendBeacon(url, new Blob([body], { type: 'text/plain' }))) {
+            return;
+        }
+        fetch(url, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'text/plain'
+            },
+            body: body,
+            keepalive: true
+        }).catch(err => console.warn('上报事件失败:', err));
+    }
+    
+    // 页面隐藏或卸载时上报剩余事件
+    function listenPageHide() {
+        window.addEventListener('pagehide', flushEvents);
+        document.addEventListener('visibilitychange', function() {
+            if (document.visibilityState === 'hidden') {
+                flushEvents();
+            }
+        });
+    }
+    
     // 获取今天的日期字符串（用于频率控制）
     function getTodayString() {
         const now = new Date();
@@ -104,12 +159,17 @@
     
     // 记录页面访问量
     function recordPageView() {
-        fetch(`${CONFIG.API_BASE}/events/page_view`, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            }
-        }).catch(err => console.warn('记录页面访问失败:', err));
+        if (!CONFIG.PAGE_VIEW_PIXEL) {
+            enqueueEvent({ type: 'page_view' });
+            return;
+        }
+        const pixel = new Image(1, 1);
+        pixel.src = `${CONFIG.API_BASE}/events/pixel.gif?d=${encodeURIComponent(window.location.hostname)}&t=${Date.now()}`;
+    }
+    
+    // 记录广告展示量
+    function recordImpression(adId) {
+        enqueueEvent({ type: 'impression', ad_id: adId });
     }
     
     // 加载广告
@@ -181,6 +241,7 @@
         `;
         
         container.style.display = 'block';
+        recordImpression(ad.id);
     }
     
     // 显示次要广告
@@ -206,28 +267,15 @@
         `;
         
         container.style.display = 'block';
+        recordImpression(ad.id);
     }
     
     // 点击广告
     window.clickAd = function(adId, link) {
-        // 记录点击
-        fetch(`${CONFIG.API_BASE}/events/click`, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({ 
-                ad_id: adId,
-                domain: window.location.hostname
-            })
-        }).then(() => {
-            // 跳转到广告链接
-            window.open(link, '_blank');
-        }).catch(err => {
-            console.warn('记录点击失败:', err);
-            // 即使记录失败也要跳转
-            window.open(link, '_blank');
-        });
+        // 记录点击（与队列中其他事件一起立即上报），然后跳转到广告链接
+        enqueueEvent({ type: 'click', ad_id: adId });
+        flushEvents();
+        window.open(link, '_blank');
     };
     
     // 关闭主广告